@@ -1,21 +1,27 @@
 import asyncio
+import functools
 import http
 import logging
 import random
 import argparse
 import ssl
 import os
-import io
-import vt
 import json
 import pathlib
-import logstash
+import time
 from datetime import datetime
 import websockets
 
 
+from logshipper import LoggerLogstash
+from tarpit import TarpitMixin
+from vtanalysis import AnalysisQueue
+from metrics import METRICS
+from codec import CodecMixin
+import fastpath
+from fastpath import fast_response
 from ocpp.routing import on
-from ocpp.v201 import ChargePoint as cp
+from compact import CompactChargePoint
 from ocpp.v201 import call_result, call
 
 
@@ -23,58 +29,88 @@ logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger("ocpp")
 
 
-class LoggerLogstash(object):
-    def __init__(
-        self,
-        logger_name: str = "logstash",
-        logstash_host: str = "localhost",
-        logstash_port: int = 6969,
-    ):
-        self.logger_name = logger_name
-        self.logstash_host = logstash_host
-        self.logstash_port = logstash_port
-
-    def get(self):
-        logging.basicConfig(
-            filename="logfile",
-            filemode="a",
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
-            datefmt="%H:%M:%S",
-            level=logging.INFO,
-        )
+@functools.cache
+def shared_analysis_queue():
+    """VirusTotal analysis queue shared by every connection, None if no
+    token is configured."""
+    try:
+        with open("/config.json") as file:
+            config = json.load(file)
+            config = config["CSMS"]
+    except Exception:
+        return None
+    return AnalysisQueue.from_config(
+        config.get("VT_API_KEY", ""), config.get("virustotal")
+    )
 
-        self.stderrLogger = logging.StreamHandler()
-        logging.getLogger().addHandler(self.stderrLogger)
-        self.logger = logging.getLogger(self.logger_name)
-        self.logger.addHandler(
-            logstash.LogstashHandler(self.logstash_host, self.logstash_port, version=1)
-        )
-        return self.logger
 
+class ChargePoint(TarpitMixin, CodecMixin, CompactChargePoint):
+    __slots__ = (
+        "local_list",
+        "update_status",
+        "remote_ip",
+        "on_change",
+        "connected_at",
+        "last_activity",
+    )
 
-class ChargePoint(cp):
     def __init__(self, id, connection):
-        cp.__init__(self, id, connection)
-        self.charger_station = None
-        self.connectors = {}
-        self.display_message = []
-        self.local_list = []
+        CompactChargePoint.__init__(self, id, connection)
+        # Monotonic times, for the reaper
+        self.connected_at = time.monotonic()
+        self.last_activity = self.connected_at
+        self.local_list = ()
         self.update_status = ""
-        self.vt_client = None
-        # Only create virus total client if token is found
+        self.remote_ip = getattr(connection, "remote_address", None)
+        if self.remote_ip:
+            self.remote_ip = self.remote_ip[0]
+        # Called as on_change(cp, event) when indexed state changes
+        self.on_change = None
+
+    def _changed(self, event: str):
+        if self.on_change is not None:
+            self.on_change(self, event)
+
+    async def route_message(self, raw_msg):
+        self.last_activity = time.monotonic()
+        await super().route_message(raw_msg)
+
+    async def _handle_call(self, msg):
+        metrics = METRICS.action(msg.action)
+        metrics.received += 1
+        start = time.perf_counter()
         try:
-            with open("/config.json") as file:
-                config = json.load(file)
-                config = config["CSMS"]
-            if config.get("VT_API_KEY", "") != "":
-                self.vt_client = vt.Client(config.get("VT_API_KEY"))
-        except:
-            pass
+            await super()._handle_call(msg)
+        except Exception:
+            metrics.handler_errors += 1
+            raise
+        finally:
+            metrics.handler.observe(time.perf_counter() - start)
+
+    async def call(self, payload, suppress=True):
+        # call.SetVariablesPayload -> SetVariables
+        metrics = METRICS.action(payload.__class__.__name__[:-7])
+        metrics.sent += 1
+        start = time.perf_counter()
+        try:
+            response = await super().call(payload, suppress)
+        except asyncio.TimeoutError:
+            metrics.call_timeouts += 1
+            raise
+        except Exception:
+            metrics.call_errors += 1
+            raise
+        finally:
+            metrics.call.observe(time.perf_counter() - start)
+        if response is None:
+            metrics.call_errors += 1
+        return response
 
     @on("BootNotification")
     def on_boot_notification(self, charging_station, reason, **kwargs):
         logging.info(charging_station)
         self.charger_station = charging_station
+        self._changed("BootNotification")
         return call_result.BootNotificationPayload(
             current_time=datetime.utcnow().isoformat(),
             interval=1000,
@@ -82,6 +118,14 @@ class ChargePoint(cp):
         )
 
     @on("Authorize")
+    @fast_response(
+        {
+            "idTokenInfo": {
+                "status": "Accepted",
+                "personalMessage": {"format": "UTF8", "content": "0.69$/kWh"},
+            }
+        }
+    )
     def on_authorize(
         self,
         id_token: dict,
@@ -97,12 +141,12 @@ class ChargePoint(cp):
         )
 
     @on("Heartbeat")
+    @fast_response({"currentTime": None}, time_field="currentTime")
     def on_heartbeat(self, **kwargs):
-        return call_result.HeartbeatPayload(
-            current_time=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z"
-        )
+        return call_result.HeartbeatPayload(current_time=fastpath.now())
 
     @on("StatusNotification")
+    @fast_response(stateful=True)
     def on_status_notification(
         self,
         timestamp: str,
@@ -112,7 +156,8 @@ class ChargePoint(cp):
         **kwargs,
     ):
         #  A connector status changed, the Charging Station sends a StatusNotificationRequest to the CSMS to inform the CSMS about the new status.
-        self.connectors[str(connector_id)] = connector_status
+        self.set_connector_status(connector_id, connector_status)
+        self._changed("StatusNotification")
         return call_result.StatusNotificationPayload()
 
     @on("NotifyDisplayMessages")
@@ -124,9 +169,11 @@ class ChargePoint(cp):
         **kwargs,
     ):
         self.display_message = message_info
+        self._changed("NotifyDisplayMessages")
         return call_result.NotifyDisplayMessagesPayload()
 
     @on("LogStatusNotification")
+    @fast_response()
     def on_log_status_notification(
         self,
         request_id: int,
@@ -137,6 +184,7 @@ class ChargePoint(cp):
         return call_result.LogStatusNotificationPayload()
 
     @on("NotifyEvent")
+    @fast_response()
     def on_notify_event(
         self,
         generated_at: str,
@@ -150,6 +198,7 @@ class ChargePoint(cp):
         return call_result.NotifyEventPayload()
 
     @on("NotifyChargingLimit")
+    @fast_response()
     def on_notify_charging_limit(
         self,
         charging_limit: dict,
@@ -160,6 +209,7 @@ class ChargePoint(cp):
         return call_result.NotifyChargingLimitPayload()
 
     @on("NotifyCustomerInformation")
+    @fast_response()
     def on_notify_customer_information(
         self,
         data: str,
@@ -172,6 +222,7 @@ class ChargePoint(cp):
         return call_result.NotifyCustomerInformationPayload()
 
     @on("NotifyEVChargingSchedule")
+    @fast_response({"status": "Accepted"})
     def on_notify_ev_charging_schedule(
         self,
         time_base: str,
@@ -182,6 +233,7 @@ class ChargePoint(cp):
         return call_result.NotifyEVChargingSchedulePayload(status="Accepted")
 
     @on("MeterValues")
+    @fast_response()
     def on_meter_values(self, evse_id: int, meter_value: list, **kwargs):
         return call_result.MeterValuesPayload()
 
@@ -193,26 +245,26 @@ class ChargePoint(cp):
         data: str | None = None,
         **kwargs,
     ):
-        # scand data with virustotal
-        call.DataTransferPayload()
-        if self.vt_client:
-            try:
-                data = io.StringIO(data)
-                analysis = self.vt_client.scan_file(data, wait_for_completion=True)
-                LOGGER.info(f"VirusTotal analysis: {analysis.stats}")
-            except Exception as e:
-                # usually due to invalid virustotal api key
-                pass
+        # scan data with virustotal in the background
+        analysis = shared_analysis_queue()
+        if analysis is not None and data is not None:
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            analysis.submit(
+                data, charger=self.id, vendor_id=vendor_id, message_id=message_id
+            )
 
         return call_result.DataTransferPayload(status="Accepted", data={})
 
     @on("FirmwareStatusNotification")
+    @fast_response()
     def on_firmware_status_notification(
         self, status: str, request_id: int | None = None, **kwargs
     ):
         return call_result.FirmwareStatusNotificationPayload()
 
     @on("PublishFirmwareStatusNotification")
+    @fast_response()
     def on_publish_firmware_notification(
         self,
         location: str,
@@ -225,16 +277,19 @@ class ChargePoint(cp):
         return call_result.PublishFirmwareStatusNotificationPayload()
 
     @on("MeterValues")
+    @fast_response()
     def on_meter_values(self, evse_id: int, meter_value: list, **kwargs):
         return call_result.MeterValuesPayload()
 
     @on("ClearedChargingLimit")
+    @fast_response()
     def on_cleared_charging_limit(
         self, charging_limit_source: str, evse_id: int | None = None, **kwargs
     ):
         return call_result.ClearedChargingLimitPayload()
 
     @on("TransactionEvent")
+    @fast_response()
     def on_transaction_event(
         self,
         event_type: str,
@@ -257,6 +312,7 @@ class ChargePoint(cp):
         return call_result.TransactionEventPayload()
 
     @on("SecurityEventNotification")
+    @fast_response()
     def on_security_event_notification(
         self, type: str, timestamp: str, tech_info: str | None = None, **kwargs
     ):
@@ -343,6 +399,7 @@ class ChargePoint(cp):
             local_authorization_list=local_authorization_list,
         )
         self.local_list = local_authorization_list_dict
+        self._changed("SendLocalList")
 
         return await self.call(request)
 
@@ -431,22 +488,15 @@ class UserInfoProtocol(websockets.BasicAuthWebSocketServerProtocol):
 
 
 class TLSCheckCert(websockets.WebSocketServerProtocol):
-    async def connection_made(self, transport: asyncio.BaseTransport) -> None:
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
         """
         Register connection and initialize a task to handle it.
         """
-        transport.get_extra_info(...)
         sslsock = transport.get_extra_info("ssl_object")
-        cert = sslsock.getpeercert()
+        cert = sslsock.getpeercert() if sslsock else None
         # do whatever with the certificate
 
-        super().super().connection_made(transport)
-        # Register the connection with the server before creating the handler
-        # task. Registering at the beginning of the handler coroutine would
-        # create a race condition between the creation of the task, which
-        # schedules its execution, and the moment the handler starts running.
-        super().ws_server.register(self)
-        super().handler_task = super().loop.create_task(super().handler())
+        super().connection_made(transport)
 
 
 async def main(
@@ -0,0 +1,169 @@
+import logging
+import time
+
+# Admission control of the websocket server.
+#
+# Every source IP gets a token bucket for handshakes, one for messages and a
+# count of its open sessions, and the number of sessions is also capped
+# globally. Connections over a limit are aborted in connection_made, before
+# the HTTP upgrade and the OCPP handling (with TLS the handshake has already
+# happened by then: asyncio only hands the connection to the protocol after
+# it). Messages over the rate of their source are dropped unanswered. A limit
+# of 0 disables it.
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Source:
+    __slots__ = ("handshakes", "messages", "sessions")
+
+    def __init__(self, handshake_burst: float, message_burst: float, now: float):
+        self.handshakes = TokenBucket(handshake_burst, now)
+        self.messages = TokenBucket(message_burst, now)
+        self.sessions = 0
+
+
+class AdmissionControl:
+    def __init__(
+        self,
+        handshake_rate: float = 5,
+        handshake_burst: float = 20,
+        message_rate: float = 50,
+        message_burst: float = 200,
+        max_sessions_per_ip: int = 50,
+        max_sessions: int = 20000,
+        max_sources: int = 100000,
+    ):
+        self.handshake_rate = handshake_rate
+        self.handshake_burst = handshake_burst
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.max_sessions_per_ip = max_sessions_per_ip
+        self.max_sessions = max_sessions
+        # Sources without sessions are forgotten above this many
+        self.max_sources = max_sources
+        self.sources = {}
+        self.sessions = 0
+        self.rejected = {"rate": 0, "ip_sessions": 0, "sessions": 0}
+        self.dropped_messages = 0
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        """Limits of the "admission" config section, none if it is missing."""
+        if config is None:
+            return cls(
+                handshake_rate=0, message_rate=0, max_sessions_per_ip=0, max_sessions=0
+            )
+        return cls(**config)
+
+    def _source(self, ip: str, now: float) -> Source:
+        source = self.sources.get(ip)
+        if source is None:
+            if len(self.sources) >= self.max_sources:
+                self._prune()
+            source = Source(self.handshake_burst, self.message_burst, now)
+            self.sources[ip] = source
+        return source
+
+    def _prune(self):
+        for ip in [ip for ip, source in self.sources.items() if not source.sessions]:
+            del self.sources[ip]
+
+    def admit(self, ip: str) -> str | None:
+        """Open a session for `ip`, or return why it is rejected."""
+        now = time.monotonic()
+        source = self._source(ip, now)
+        if self.max_sessions and self.sessions >= self.max_sessions:
+            reason = "sessions"
+        elif self.max_sessions_per_ip and source.sessions >= self.max_sessions_per_ip:
+            reason = "ip_sessions"
+        elif self.handshake_rate and not source.handshakes.take(
+            self.handshake_rate, self.handshake_burst, now
+        ):
+            reason = "rate"
+        else:
+            source.sessions += 1
+            self.sessions += 1
+            return None
+        self.rejected[reason] += 1
+        return reason
+
+    def release(self, ip: str):
+        source = self.sources.get(ip)
+        if source is not None and source.sessions:
+            source.sessions -= 1
+            self.sessions -= 1
+
+    def allow_message(self, ip: str) -> bool:
+        if not self.message_rate:
+            return True
+        source = self.sources.get(ip)
+        if source is None or source.messages.take(
+            self.message_rate, self.message_burst, time.monotonic()
+        ):
+            return True
+        self.dropped_messages += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "sources": len(self.sources),
+            "rejected": dict(self.rejected),
+            "dropped_messages": self.dropped_messages,
+        }
+
+    def protocol(self, base: type) -> type:
+        """Subclass of the websocket server protocol `base` enforcing this
+        admission control, for websockets.serve(create_protocol=...)."""
+        return type(base.__name__, (AdmissionMixin, base), {"admission": self})
+
+
+class AdmissionMixin:
+    admission: AdmissionControl = None
+
+    def connection_made(self, transport):
+        peer = transport.get_extra_info("peername")
+        self.admitted_ip = None
+        if peer:
+            reason = self.admission.admit(peer[0])
+            if reason is not None:
+                logging.debug(f"Rejected connection from {peer[0]}: {reason}")
+                # The protocol never started, connection_lost must not run
+                # the websocket close logic.
+                self.rejected = True
+                transport.abort()
+                return
+            self.admitted_ip = peer[0]
+        self.rejected = False
+        super().connection_made(transport)
+
+    def connection_lost(self, exc):
+        if self.rejected:
+            return
+        if self.admitted_ip is not None:
+            self.admission.release(self.admitted_ip)
+            self.admitted_ip = None
+        super().connection_lost(exc)
+
+    async def recv(self):
+        while True:
+            message = await super().recv()
+            if self.admitted_ip is None or self.admission.allow_message(
+                self.admitted_ip
+            ):
+                return message
@@ -9,44 +9,23 @@ import json
 import os
 from ocpp.v201 import datatypes, enums
 from CSMS import ChargePoint, LoggerLogstash, TLSCheckCert, UserInfoProtocol
+from admission import AdmissionControl
+from capture import CapturingConnection, FrameCapture
+from tarpit import Tarpit
+import codec
+import fastpath
+import validation
 from centralsystem import CentralSystem
+from cluster import ClusterCentralSystem
+import metrics
+import operations
 
 
 async def set_locallist(request):
     """HTTP handler for getting the ids of all charge points."""
     data = await request.json()
     csms = request.app["csms"]
-    local_authorization_list = []
-    local_authorization_list_dict = []
-    for locallist_entry in data["locallist"]:
-        local_authorization_list_dict.append(
-            {
-                "idToken": {
-                    "idToken": locallist_entry["idToken"],
-                    "type": locallist_entry["type"],
-                },
-                "idTokenInfo": {"status": locallist_entry["status"]},
-            }
-        )
-        local_authorization_list.append(
-            datatypes.AuthorizationData(
-                id_token=datatypes.IdTokenType(
-                    id_token=locallist_entry["idToken"], type=locallist_entry["type"]
-                ),
-                id_token_info=datatypes.IdTokenInfoType(
-                    status=locallist_entry["status"]
-                ),
-            )
-        )
-    version_number = 1
-    update_type = enums.UpdateType.differential
-    result = await csms.send_sendlocallist(
-        data["id"],
-        version_number,
-        update_type,
-        local_authorization_list,
-        local_authorization_list_dict,
-    )
+    result = await operations.set_locallist(csms, data)
 
     return web.Response(text=json.dumps({"result": result}))
 
@@ -56,7 +35,7 @@ async def get_locallist(request):
     # data = await request.json()
     csms = request.app["csms"]
     data = await request.json()
-    locallist = await csms.get_locallist(data["id"])
+    locallist = await operations.get_locallist(csms, data)
 
     return web.Response(text=json.dumps({"LocalList": locallist}))
 
@@ -65,13 +44,7 @@ async def get_variables(request):
     """HTTP handler for getting variables."""
     data = await request.json()
     csms = request.app["csms"]
-    variable_data = datatypes.GetVariableDataType(
-        component=datatypes.ComponentType(name="evse"),
-        variable=datatypes.VariableType(name="all"),
-    )
-    result = await csms.get_variables(
-        data["id"], data.get("variable_data", [variable_data])
-    )
+    result = await operations.get_variables(csms, data)
 
     return web.Response(text=json.dumps({"result": result}))
 
@@ -80,13 +53,7 @@ async def set_variables(request):
     """HTTP handler for setting variables."""
     data = await request.json()
     csms = request.app["csms"]
-    # {"attributeValue":"","component":"",variable:""}
-    payload = datatypes.SetVariableDataType(
-        attribute_value=data.get("value"),
-        component=datatypes.ComponentType(name=data.get("component")),
-        variable=datatypes.VariableType(data.get("variable")),
-    )
-    await csms.set_variables(data["id"], [payload])
+    await operations.set_variables(csms, data)
 
     return web.Response(text="OK")
 
@@ -95,8 +62,7 @@ async def update_firmware(request):
     """HTTP handler for updating the CP."""
     data = await request.json()
     csms = request.app["csms"]
-    # {"attributeValue":"","component":"",variable:""}
-    await csms.update_firmware(data["id"], data["firmwareURL"])
+    await operations.update_firmware(csms, data)
     return web.Response(text="OK")
 
 
@@ -105,14 +71,7 @@ async def set_display_message(request):
     data = await request.json()
     csms = request.app["csms"]
     # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    message = datatypes.MessageInfoType(
-        id=data["msgId"],
-        priority=enums.MessagePriorityType.always_front,
-        message=datatypes.MessageContentType(
-            format=enums.MessageFormatType.utf8, content=data["msg"]
-        ),
-    )
-    await csms.set_display_message(data["id"], message)
+    await operations.set_display_message(csms, data)
     return web.Response(text="OK")
 
 
@@ -120,8 +79,7 @@ async def get_display_message(request):
     """HTTP handler for getting the ids of all charge points."""
     data = await request.json()
     csms = request.app["csms"]
-    # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    await csms.get_display_message(data["id"])
+    await operations.get_display_message(csms, data)
     return web.Response(text="OK")
 
 
@@ -129,8 +87,7 @@ async def clear_display_message(request):
     """HTTP handler for deleting the ids of all charge points."""
     data = await request.json()
     csms = request.app["csms"]
-    # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    await csms.clear_display_message(data["id"], data["msgId"])
+    await operations.clear_display_message(csms, data)
     return web.Response(text="OK")
 
 
@@ -138,12 +95,7 @@ async def start_transaction(request):
     """HTTP handler for starting a remote transaction."""
     data = await request.json()
     csms = request.app["csms"]
-    # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    id_token = datatypes.IdTokenType(id_token=data["idToken"], type=data["idTokenType"])
-    remote_start_id = 1
-    await csms.start_transaction(
-        data["id"], id_token=id_token, remote_start_id=remote_start_id
-    )
+    await operations.start_transaction(csms, data)
     return web.Response(text="OK")
 
 
@@ -151,8 +103,7 @@ async def trigger_msg(request):
     """HTTP handler for triggerMSG."""
     data = await request.json()
     csms = request.app["csms"]
-    # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    await csms.trigger_message(data["id"], data["requestedMessage"])
+    await operations.trigger_message(csms, data)
     return web.Response(text="OK")
 
 
@@ -161,8 +112,7 @@ async def stop_transaction(request):
     data = await request.json()
     csms = request.app["csms"]
     # id=data["id"], msg=data["transactionId"]
-
-    await csms.stop_transaction(data["id"], data["transactionId"])
+    await operations.stop_transaction(csms, data)
     return web.Response(text="OK")
 
 
@@ -170,21 +120,100 @@ async def change_status(request):
     """HTTP handler for changing the status of the charge points."""
     data = await request.json()
     csms = request.app["csms"]
-    # id=data["id"], msg=data["msg"], msg_id=data["msgId"]
-    await csms.change_status(
-        data["id"], data["operationalStatus"], int(data["connectorId"])
-    )
+    await operations.change_status(csms, data)
     return web.Response(text="OK")
 
 
+async def broadcast(request):
+    """HTTP handler for sending the same OCPP call to many charge points."""
+    data = await request.json()
+    csms = request.app["csms"]
+    if not isinstance(data, dict):
+        return web.Response(status=400, text="Expected an object")
+    try:
+        results = await operations.broadcast(csms, data)
+    except ValueError as e:
+        return web.Response(status=400, text=f"{e}")
+
+    return web.Response(text=json.dumps({"results": results}))
+
+
+async def batch(request):
+    """HTTP handler for running several operations in one request.
+
+    The body is {"operations": [{"op": "reserve", "id": ..., ...}, ...]} where
+    "op" is one of operations.OPERATIONS and the other fields are the ones of
+    the matching route. The results are returned in the same order.
+    """
+    data = await request.json()
+    csms = request.app["csms"]
+    if not isinstance(data, dict) or not isinstance(data.get("operations"), list):
+        return web.Response(status=400, text="Expected a list of operations")
+    results = await operations.run_batch(csms, data["operations"])
+
+    return web.Response(text=json.dumps({"results": results}))
+
+
 async def get_chargers(request):
-    """HTTP handler for getting the ids of all charge points."""
-    # data = await request.json()
+    """HTTP handler for getting the ids of all charge points.
+
+    Supports If-None-Match with the returned ETag, and ?since=<version> to
+    only get the chargers that changed after that version.
+    """
+    csms = request.app["csms"]
+    since = request.query.get("since")
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return web.Response(status=400, text="since must be an integer")
+
+    etag, body = csms.chargers_snapshot(since)
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag})
+
+    return web.Response(text=body, headers={"ETag": etag})
+
+
+async def get_metrics(request):
+    """HTTP handler exposing the metrics in the Prometheus text format."""
     csms = request.app["csms"]
+    text = metrics.render(await csms.metrics())
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
 
-    chargers = await csms.get_connected_chargers()
+async def events(request):
+    """HTTP handler streaming charger changes as server-sent events.
 
-    return web.Response(text=json.dumps(chargers))
+    Events: Connected, Disconnected, BootNotification, StatusNotification,
+    NotifyDisplayMessages, ClearDisplayMessage and SendLocalList. The event id
+    is the /chargers snapshot version after the change.
+    """
+    csms = request.app["csms"]
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    await response.prepare(request)
+
+    with csms.events.subscribe() as subscription:
+        dropped = 0
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), 15)
+                except asyncio.TimeoutError:
+                    message = ": keepalive\n\n"
+                if subscription.dropped != dropped:
+                    # Let the consumer know it missed events and should resync
+                    # with /chargers?since=<last id>
+                    dropped = subscription.dropped
+                    await response.write(
+                        f"event: Dropped\ndata: {dropped}\n\n".encode("utf-8")
+                    )
+                await response.write(message.encode("utf-8"))
+        except ConnectionResetError:
+            pass
+
+    return response
 
 
 async def home(request):
@@ -201,17 +230,9 @@ async def reserve(request):
     """HTTP handler for reserving a charger."""
     data = await request.json()
     csms = request.app["csms"]
-    expiry_date_time = data["expDate"]
 
     try:
-        result = await csms.reserve_now(
-            data["id"],
-            datatypes.IdTokenType(
-                id_token=data["idToken"], type=enums.IdTokenType.central
-            ),
-            expiry_date_time,
-            data.get("connector", 1),
-        )
+        result = await operations.reserve(csms, data)
     except ValueError as e:
         print(f"Failed to reserve charger: {e}")
         return web.Response(status=404)
@@ -224,9 +245,7 @@ async def cancel_reservation(request):
     data = await request.json()
     csms = request.app["csms"]
     try:
-        result = await csms.cancel_reserve(
-            data["id"], connector=data.get("connector", 1)
-        )
+        result = await operations.cancel_reservation(csms, data)
     except ValueError as e:
         print(f"Failed to cancel reservation reserve charger: {e}")
         return web.Response(status=404, text=f"{e}")
@@ -234,7 +253,7 @@ async def cancel_reservation(request):
     return web.Response(text=json.dumps({"result": result}))
 
 
-async def on_connect(websocket, path, csms):
+async def on_connect(websocket, path, csms, capture: FrameCapture | None = None):
     """For every new charge point that connects, create a ChargePoint instance
     and start listening for messages.
 
@@ -242,7 +261,10 @@ async def on_connect(websocket, path, csms):
 
     """
     charge_point_id = path.strip("/")
+    if capture is not None:
+        websocket = CapturingConnection(websocket, capture, charge_point_id)
     cp = ChargePoint(charge_point_id, websocket)
+    metrics.METRICS.handshakes += 1
 
     print(f"Charger {cp.id} connected.")
 
@@ -253,7 +275,9 @@ async def on_connect(websocket, path, csms):
     await queue.get()
 
 
-async def create_websocket_server(csms: CentralSystem, config: dict):
+async def create_websocket_server(
+    csms: CentralSystem, config: dict, reuse_port: bool = False
+):
     address = config.get("IP", "0.0.0.0")
     port = config.get("port", "9000")
     security_profile = config.get("security_profile", 1)
@@ -261,8 +285,10 @@ async def create_websocket_server(csms: CentralSystem, config: dict):
     logstash_port = config.get("logstasth").get("port")
 
     # Add security profiles
-    handler = partial(on_connect, csms=csms)
     logging.info(f"Security profile {security_profile}")
+    logging.info(f"JSON codec: {codec.use(config.get('json_codec'))}")
+    logging.info(f"Fast path: {fastpath.configure(config.get('fast_path'))}")
+    logging.info(f"Schema validation: {validation.configure(config.get('validation'))}")
 
     if logstash_host is not None:
         logging.info("Using Logstash")
@@ -271,6 +297,17 @@ async def create_websocket_server(csms: CentralSystem, config: dict):
         )
         logger = instance.get()
 
+    capture = FrameCapture.from_config(config.get("capture"))
+    if capture is not None:
+        logging.info(f"Capturing frames to {capture.path}")
+    handler = partial(on_connect, csms=csms, capture=capture)
+    admission = AdmissionControl.from_config(config.get("admission"))
+    csms.admission = admission
+    ChargePoint.tarpit = Tarpit.from_config(config.get("tarpit"))
+    csms.tarpit = ChargePoint.tarpit
+    if csms.tarpit is not None:
+        logging.info(f"Tarpit policies: {list(csms.tarpit.policies)}")
+
     match security_profile:
         case 1:
             return await websockets.serve(
@@ -278,7 +315,8 @@ async def create_websocket_server(csms: CentralSystem, config: dict):
                 address,
                 port,
                 subprotocols=["ocpp2.0.1"],
-                create_protocol=UserInfoProtocol,
+                create_protocol=admission.protocol(UserInfoProtocol),
+                reuse_port=reuse_port,
             )
         case 2:
             if not os.path.isfile(config.get("ssl_key")) or not os.path.isfile(
@@ -294,7 +332,8 @@ async def create_websocket_server(csms: CentralSystem, config: dict):
                 port,
                 subprotocols=["ocpp2.0.1"],
                 ssl=ssl_context,
-                create_protocol=UserInfoProtocol,
+                create_protocol=admission.protocol(UserInfoProtocol),
+                reuse_port=reuse_port,
             )
         case 3:
             if not os.path.isfile(config.get("ssl_key")) or not os.path.isfile(
@@ -310,7 +349,8 @@ async def create_websocket_server(csms: CentralSystem, config: dict):
                 port,
                 subprotocols=["ocpp2.0.1"],
                 ssl=ssl_context,
-                create_protocol=TLSCheckCert,
+                create_protocol=admission.protocol(TLSCheckCert),
+                reuse_port=reuse_port,
             )
 
     logging.info("Server Started listening to new connections...")
@@ -334,6 +374,10 @@ async def create_http_server(csms: CentralSystem):
     app.add_routes([web.post("/startTransaction", start_transaction)])
     app.add_routes([web.post("/stopTransaction", stop_transaction)])
     app.add_routes([web.post("/triggerMessage", trigger_msg)])
+    app.add_routes([web.post("/broadcast", broadcast)])
+    app.add_routes([web.post("/batch", batch)])
+    app.add_routes([web.get("/events", events)])
+    app.add_routes([web.get("/metrics", get_metrics)])
 
     # Put CSMS in app so it can be accessed from request handlers.
     app["csms"] = csms
@@ -346,11 +390,23 @@ async def create_http_server(csms: CentralSystem):
 
 
 async def main():
-    csms = CentralSystem()
     with open("./config.json") as file:
         config = json.load(file)
         config = config["CSMS"]
 
+    workers = config.get("workers", 1)
+    if workers > 1:
+        # The websocket servers run in worker processes, this process only
+        # serves the HTTP API and forwards commands to them.
+        csms = ClusterCentralSystem(config)
+        await csms.start(workers)
+        http_server = await create_http_server(csms)
+        await http_server.start()
+        await csms.wait_closed()
+        return
+
+    csms = CentralSystem(config)
+
     websocket_server = await create_websocket_server(csms, config)
     http_server = await create_http_server(csms)
     websocket_task = asyncio.create_task(websocket_server.wait_closed())
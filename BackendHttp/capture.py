@@ -0,0 +1,277 @@
+import array
+import atexit
+import bisect
+import itertools
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+# Raw OCPP frame capture.
+#
+# Every capture is a pair of append-only files:
+#   <name>.dat  records of RECORD header + raw bytes of the frame
+#   <name>.idx  one fixed width INDEX entry per record, in write order, so it
+#               can be memory-mapped and binary searched by timestamp
+#   <name>.ses  one SESSION entry per session, pointing at its OPEN record
+#
+# Sessions are numbered from 1 within a capture. When a session starts a
+# record with direction OPEN is written whose payload is a JSON object with
+# the charge point id and the remote address.
+
+RECORD = struct.Struct("<IdQB")  # length, timestamp, session, direction
+INDEX = struct.Struct("<dQQI")  # timestamp, session, offset, record length
+SESSION = struct.Struct("<QQ")  # session, position of its OPEN index entry
+
+IN = 0
+OUT = 1
+OPEN = 2
+
+
+class FrameCapture:
+    """Append frames to a capture from a background thread. Recording a frame
+    only puts a tuple on a bounded queue; frames are dropped and counted when
+    the writer cannot keep up."""
+
+    _STOP = object()
+
+    def __init__(self, path: str, queue_size: int = 100000, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.written = 0
+        self._sessions = itertools.count(1)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._data = open(f"{path}.dat", "ab")
+        self._index = open(f"{path}.idx", "ab")
+        self._sessions_index = open(f"{path}.ses", "ab")
+        self._offset = self._data.tell()
+        self._position = self._index.tell() // INDEX.size
+        self._last_timestamp = 0.0
+        self._thread = threading.Thread(
+            target=self._run, name="FrameCapture", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        """Create a capture in config["directory"], None if not configured.
+        The file name includes the pid so every worker process writes its own
+        capture."""
+        config = config or {}
+        directory = config.get("directory")
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        name = f"ocpp-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        return cls(
+            os.path.join(directory, name),
+            queue_size=config.get("queue_size", 100000),
+        )
+
+    def open_session(self, charge_point_id: str, remote_address) -> int:
+        session = next(self._sessions)
+        meta = json.dumps({"id": charge_point_id, "remote_address": remote_address})
+        self.record(session, OPEN, meta)
+        return session
+
+    def record(self, session: int, direction: int, frame: str | bytes):
+        try:
+            self._queue.put_nowait((time.time(), session, direction, frame))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5):
+        if not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if self._STOP in batch:
+                stopping = True
+                batch = batch[: batch.index(self._STOP)]
+            self._write(batch)
+        self._data.close()
+        self._index.close()
+        self._sessions_index.close()
+
+    def _write(self, batch: list):
+        data = []
+        index = []
+        sessions = []
+        for timestamp, session, direction, frame in batch:
+            if isinstance(frame, str):
+                frame = frame.encode("utf-8")
+            # Keep the index sorted by time for binary search
+            timestamp = max(timestamp, self._last_timestamp)
+            self._last_timestamp = timestamp
+            header = RECORD.pack(len(frame), timestamp, session, direction)
+            data.append(header)
+            data.append(frame)
+            length = len(header) + len(frame)
+            index.append(INDEX.pack(timestamp, session, self._offset, length))
+            if direction == OPEN:
+                sessions.append(SESSION.pack(session, self._position))
+            self._offset += length
+            self._position += 1
+        self._data.write(b"".join(data))
+        self._data.flush()
+        self._index.write(b"".join(index))
+        self._index.flush()
+        if sessions:
+            self._sessions_index.write(b"".join(sessions))
+            self._sessions_index.flush()
+        self.written += len(batch)
+
+
+class CapturingConnection:
+    """Wraps a websocket connection and records every frame sent or
+    received through it."""
+
+    def __init__(self, connection, capture: FrameCapture, charge_point_id: str):
+        self._connection = connection
+        self._capture = capture
+        self.session = capture.open_session(
+            charge_point_id, getattr(connection, "remote_address", None)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    async def recv(self):
+        message = await self._connection.recv()
+        self._capture.record(self.session, IN, message)
+        return message
+
+    async def send(self, message):
+        self.record_sent(message)
+        await self._connection.send(message)
+
+    def record_sent(self, message):
+        """Record a frame written to the connection without send()."""
+        self._capture.record(self.session, OUT, message)
+
+
+class CaptureReader:
+    """Read a capture written by FrameCapture. Both files are memory-mapped;
+    time ranges are found by binary search on the index. The index positions
+    of every session are collected in one pass over the index the first time
+    a session is asked for."""
+
+    def __init__(self, path: str):
+        if path.endswith((".dat", ".idx", ".ses")):
+            path = path[:-4]
+        self.path = path
+        with open(f"{path}.idx", "rb") as file:
+            self._index = self._map(file)
+        with open(f"{path}.dat", "rb") as file:
+            self._data = self._map(file)
+        self._count = len(self._index) // INDEX.size
+        # session -> index positions of its records, in write order
+        self._positions = None
+
+    @staticmethod
+    def _map(file):
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def _timestamp(self, position: int) -> float:
+        return INDEX.unpack_from(self._index, position * INDEX.size)[0]
+
+    def entries(
+        self,
+        session: int | None = None,
+        start: float | None = None,
+        end: float | None = None,
+    ):
+        """Yield (timestamp, session, offset, length) index entries, optionally
+        restricted to one session and to start <= timestamp < end."""
+        first = 0
+        last = self._count
+        if start is not None:
+            first = bisect.bisect_left(range(last), start, key=self._timestamp)
+        if end is not None:
+            last = bisect.bisect_left(range(last), end, key=self._timestamp)
+        if first >= last:
+            return
+        if session is not None:
+            positions = self._session_positions().get(session, ())
+            begin = bisect.bisect_left(positions, first)
+            stop = bisect.bisect_left(positions, last)
+            for position in positions[begin:stop]:
+                yield INDEX.unpack_from(self._index, position * INDEX.size)
+            return
+        view = memoryview(self._index)[first * INDEX.size : last * INDEX.size]
+        yield from INDEX.iter_unpack(view)
+
+    def _session_positions(self) -> dict:
+        if self._positions is None:
+            positions = {}
+            view = memoryview(self._index)[: self._count * INDEX.size]
+            for position, entry in enumerate(INDEX.iter_unpack(view)):
+                found = positions.get(entry[1])
+                if found is None:
+                    found = positions[entry[1]] = array.array("Q")
+                found.append(position)
+            self._positions = positions
+        return self._positions
+
+    def read(self, offset: int):
+        """Return (timestamp, session, direction, frame) of the record at
+        `offset` in the data file."""
+        length, timestamp, session, direction = RECORD.unpack_from(self._data, offset)
+        start = offset + RECORD.size
+        return timestamp, session, direction, bytes(self._data[start : start + length])
+
+    def frames(self, session: int | None = None, start=None, end=None):
+        """Yield (timestamp, session, direction, frame) records."""
+        for _, _, offset, _ in self.entries(session, start, end):
+            yield self.read(offset)
+
+    def sessions(self) -> dict:
+        """Map every session of the capture to its charge point id and remote
+        address. Only the OPEN records are read, found through the session
+        index; captures without one are scanned."""
+        try:
+            with open(f"{self.path}.ses", "rb") as file:
+                opened = file.read()
+        except FileNotFoundError:
+            opened = None
+        if opened is None:
+            records = (record for record in self.frames() if record[2] == OPEN)
+        else:
+            # The session index can be ahead of the index mapped when the
+            # reader was created
+            records = (
+                self.read(INDEX.unpack_from(self._index, position * INDEX.size)[2])
+                for _, position in SESSION.iter_unpack(
+                    opened[: len(opened) // SESSION.size * SESSION.size]
+                )
+                if position < self._count
+            )
+        sessions = {}
+        for timestamp, session, direction, frame in records:
+            meta = json.loads(frame)
+            meta["start"] = timestamp
+            sessions[session] = meta
+        return sessions
@@ -1,13 +1,41 @@
 import asyncio
+import json
+from dataclasses import asdict
 from functools import partial
 from datetime import datetime, timedelta
-from ocpp.v201 import datatypes, enums
-from CSMS import ChargePoint, LoggerLogstash, TLSCheckCert, UserInfoProtocol
+from ocpp.charge_point import remove_nones
+from ocpp.v201 import call, datatypes, enums
+from CSMS import (
+    ChargePoint,
+    LoggerLogstash,
+    TLSCheckCert,
+    UserInfoProtocol,
+    shared_analysis_queue,
+)
+import validation
+from registry import ChargerRegistry
+from snapshot import ChargerSnapshot
+from events import EventBus
+from metrics import METRICS, log_gauges
+from reaper import ConnectionReaper
 
 
 class CentralSystem:
-    def __init__(self):
-        self._chargers = {}
+    def __init__(self, config: dict | None = None):
+        config = config or {}
+        self._registry = ChargerRegistry()
+        self._snapshot = ChargerSnapshot(self._describe_charger)
+        self.events = EventBus(config.get("events", {}).get("queue_size", 256))
+        # Called as listener(id, event, data) with the JSON encoded event data
+        self.listeners = []
+        broadcast = config.get("broadcast", {})
+        self.broadcast_concurrency = broadcast.get("concurrency", 50)
+        self.broadcast_timeout = broadcast.get("timeout", 30)
+        self._reaper = ConnectionReaper.from_config(config.get("reaper"))
+        self._reaper_task = None
+        # AdmissionControl and Tarpit of the websocket server, for the metrics
+        self.admission = None
+        self.tarpit = None
 
     def register_charger(self, cp: ChargePoint) -> asyncio.Queue:
         """Register a new ChargePoint at the CSMS. The function returns a
@@ -18,7 +46,19 @@ class CentralSystem:
 
         # Store a reference to the task so we can cancel it later if needed.
         task = asyncio.create_task(self.start_charger(cp, queue))
-        self._chargers[cp] = task
+        replaced = self._registry.add(cp, task)
+        if replaced is not None:
+            # start_charger of the previous connection then unblocks its
+            # on_connect() handler, which closes that socket
+            replaced.cancel()
+        self._snapshot.changed(cp)
+        self._publish(cp, "Connected")
+        cp.on_change = self._charger_changed
+        self._reaper.add(cp, task)
+        if self._reaper_task is None:
+            self._reaper_task = asyncio.create_task(
+                self._reaper.run(self._close_charger)
+            )
 
         return queue
 
@@ -30,82 +70,214 @@ class CentralSystem:
             print(f"Charger {cp.id} disconnected: {e}")
         finally:
             # Make sure to remove referenc to charger after it disconnected.
-            del self._chargers[cp]
+            if self._registry.remove(cp):
+                self._snapshot.removed(cp.id)
+                self._publish(cp, "Disconnected")
 
             # This will unblock the `on_connect()` handler and the connection
             # will be destroyed.
             await queue.put(True)
 
+    async def _close_charger(self, cp: ChargePoint, task: asyncio.Task, timeout: float):
+        """Close the connection of a stale charger, start_charger then
+        deregisters it. If the peer does not complete the closing handshake
+        the task of the charger is cancelled."""
+        try:
+            await asyncio.wait_for(cp._connection.close(), timeout)
+        except asyncio.TimeoutError:
+            task.cancel()
+
+    def _charger_changed(self, cp: ChargePoint, event: str):
+        """Called by a ChargePoint when its BootNotification, connector
+        status, display messages or local list change."""
+        self._registry.reindex(cp)
+        self._snapshot.changed(cp)
+        self._publish(cp, event)
+
+    def _publish(self, cp: ChargePoint, event: str):
+        if not self.events and not self.listeners:
+            return
+        if event == "Disconnected":
+            data = "null"
+        elif event == "SendLocalList":
+            data = json.dumps({"localList": cp.local_list})
+        else:
+            data = self._snapshot.charger(cp)
+        if self.events:
+            self.events.publish(
+                cp.id,
+                event,
+                self._snapshot.version,
+                f'{{"id":{json.dumps(cp.id)},"charger":{data}}}',
+            )
+        for listener in self.listeners:
+            listener(cp.id, event, data)
+
+    @staticmethod
+    def _describe_charger(cp: ChargePoint) -> dict:
+        return {
+            "ChargerStation": cp.charger_station,
+            "connectors": cp.connectors,
+            "displayMesagges": cp.display_message,
+        }
+
+    def chargers_snapshot(self, since: int | None = None) -> tuple[str, str]:
+        """Return the ETag and JSON of the connected chargers. With `since`
+        only the chargers that changed after that version are included."""
+        if since is None:
+            return self._snapshot.etag, self._snapshot.full()
+        return self._snapshot.etag, self._snapshot.delta(since)
+
+    async def metrics(self) -> list:
+        """Metrics sources of this process for metrics.render()."""
+        reaper = self._reaper.stats()
+        gauges = {
+            "ocpp_connected_chargers": len(self._registry),
+            "ocpp_reaper_tracked": reaper["tracked"],
+            "ocpp_reaped_idle_total": reaper["reaped_idle"],
+            "ocpp_reaped_no_boot_total": reaper["reaped_no_boot"],
+            **log_gauges(),
+        }
+        if self.admission is not None:
+            admission = self.admission.stats()
+            gauges["ocpp_admission_sessions"] = admission["sessions"]
+            gauges["ocpp_admission_sources"] = admission["sources"]
+            for reason, count in admission["rejected"].items():
+                gauges[f"ocpp_admission_rejected_{reason}_total"] = count
+            gauges["ocpp_admission_dropped_messages_total"] = admission[
+                "dropped_messages"
+            ]
+        if self.tarpit is not None:
+            for name, value in self.tarpit.stats().items():
+                counter = name in ("held", "sent", "dropped", "overflow")
+                suffix = "_total" if counter else ""
+                gauges[f"ocpp_tarpit_{name}{suffix}"] = value
+        analysis = shared_analysis_queue()
+        if analysis is not None:
+            for name, value in analysis.stats().items():
+                suffix = "" if name == "queued" else "_total"
+                gauges[f"ocpp_vt_{name}{suffix}"] = value
+        for name, value in validation.stats().items():
+            gauges[f"ocpp_schema_{name}_total"] = value
+        return [("", METRICS, gauges)]
+
+    def find_chargers(
+        self,
+        vendor: str | None = None,
+        model: str | None = None,
+        status: str | None = None,
+        ip: str | None = None,
+    ) -> list:
+        """Return the ids of the connected chargers matching all the given
+        criteria."""
+        chargers = self._registry.filter(
+            vendor=vendor, model=model, status=status, ip=ip
+        )
+        return [cp.id for cp in chargers]
+
+    async def broadcast(
+        self,
+        action: str,
+        payload: dict,
+        selector: dict | None = None,
+        concurrency: int | None = None,
+        timeout: float | None = None,
+    ) -> dict:
+        """Send the same OCPP call to every charger matching `selector` (see
+        find_chargers) concurrently, at most `concurrency` at a time. Returns
+        a dict with the response payload or the error of every charger.
+        """
+        try:
+            payload_class = getattr(call, f"{action}Payload")
+        except AttributeError:
+            raise ValueError(f"Unknown action {action}.")
+        try:
+            request = payload_class(**payload)
+        except TypeError as e:
+            raise ValueError(f"Invalid payload for {action}: {e}")
+
+        selector = selector or {}
+        if not isinstance(selector, dict):
+            raise ValueError("The selector must be an object.")
+        unknown = set(selector) - set(ChargerRegistry.INDEXES)
+        if unknown:
+            raise ValueError(f"Unknown selector keys {', '.join(sorted(unknown))}.")
+
+        timeout = timeout or self.broadcast_timeout
+        semaphore = asyncio.Semaphore(concurrency or self.broadcast_concurrency)
+        chargers = self._registry.filter(**selector)
+
+        async def send(cp):
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(cp.call(request), timeout)
+                except asyncio.TimeoutError:
+                    return {"error": f"Timeout after {timeout}s"}
+                except Exception as e:
+                    return {"error": f"{type(e).__name__}: {e}"}
+            if result is None:
+                # ChargePoint.call() suppresses CallErrors and returns None
+                return {"error": "CallError"}
+            return {"result": remove_nones(asdict(result))}
+
+        results = await asyncio.gather(*(send(cp) for cp in chargers))
+        return {cp.id: result for cp, result in zip(chargers, results)}
+
     # async def change_configuration(self, key: str, value: str):
-    #     for cp in self._chargers:
+    #     for cp in self._registry:
     #         await cp.change_configuration(key, value)
 
     async def set_variables(self, id: str, set_variable_data: list):
-        for cp in self._chargers:
-            if cp.id == id:
-                result = await cp.send_set_variables(set_variable_data)
-                return result
+        cp = self._registry.get(id)
+        if cp is not None:
+            result = await cp.send_set_variables(set_variable_data)
+            return result
 
     async def get_variables(self, id: str, get_variable_data: list):
-        for cp in self._chargers:
-            if cp.id == id:
-                result = await cp.send_get_variables(get_variable_data)
-                return result.get_variable_result
+        cp = self._registry.get(id)
+        if cp is not None:
+            result = await cp.send_get_variables(get_variable_data)
+            return result.get_variable_result
 
     async def get_connected_chargers(self):
         chargers = {}
-        for cp in self._chargers:
-            chargers[cp.id] = {
-                "ChargerStation": cp.charger_station,
-                "connectors": cp.connectors,
-                "displayMesagges": cp.display_message,
-            }
+        for cp in self._registry:
+            chargers[cp.id] = self._describe_charger(cp)
         return chargers
 
     async def reserve_now(
         self, id: str, id_token: dict, expiry_date_time: datetime, connector: int = 1
     ):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_reserve_now(
-                    id=connector,
-                    expiry_date_time=expiry_date_time,
-                    id_token=id_token,
-                )
-                return result.status
-
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_reserve_now(
+            id=connector,
+            expiry_date_time=expiry_date_time,
+            id_token=id_token,
+        )
+        return result.status
 
     async def cancel_reserve(self, id: str, connector: int = 1):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_reserve_cancel(reservation_id=connector)
-                return result.status
-
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_reserve_cancel(reservation_id=connector)
+        return result.status
 
     async def set_display_message(self, id: str, message):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_set_display_messages(message)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_set_display_messages(message)
+        return result.status
 
     async def get_display_message(self, id: str):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_get_display_messages(1)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_get_display_messages(1)
+        return result.status
 
     async def clear_display_message(self, id: str, msg_id: int):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_clear_display_messages(msg_id)
-                if result.status == "Acepted":
-                    cp.display_message.pop(msg_id - 1)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_clear_display_messages(msg_id)
+        if result.status == "Acepted":
+            cp.display_message.pop(msg_id - 1)
+            self._charger_changed(cp, "ClearDisplayMessage")
+        return result.status
 
     async def send_sendlocallist(
         self,
@@ -115,60 +287,46 @@ class CentralSystem:
         local_authorization_list: list,
         local_authorization_list_dict: list,
     ):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_sendlocallist(
-                    version_number,
-                    update_type,
-                    local_authorization_list,
-                    local_authorization_list_dict,
-                )
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_sendlocallist(
+            version_number,
+            update_type,
+            local_authorization_list,
+            local_authorization_list_dict,
+        )
+        return result.status
 
     async def get_locallist(self, id: str):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                return cp.local_list
+        cp = self._registry.get(id)
+        if cp is not None:
+            return cp.local_list
 
     async def update_firmware(self, id: str, url: str):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                firmware = datatypes.FirmwareType(
-                    location=url, retrieve_date_time=datetime.now().isoformat()
-                )
-                result = await cp.send_update_firmware(request_id=1, firmware=firmware)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        firmware = datatypes.FirmwareType(
+            location=url, retrieve_date_time=datetime.now().isoformat()
+        )
+        result = await cp.send_update_firmware(request_id=1, firmware=firmware)
+        return result.status
 
     async def change_status(self, id: str, operational_status: str, connector: int):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_change_availability(
-                    operational_status, datatypes.EVSEType(1, connector)
-                )
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_change_availability(
+            operational_status, datatypes.EVSEType(1, connector)
+        )
+        return result.status
 
     async def start_transaction(self, id: str, id_token: dict, remote_start_id: int):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_remote_start_transaction(
-                    id_token, remote_start_id
-                )
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_remote_start_transaction(id_token, remote_start_id)
+        return result.status
 
     async def stop_transaction(self, id: str, transaction_id: str):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_remote_stop_transaction(transaction_id)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_remote_stop_transaction(transaction_id)
+        return result.status
 
     async def trigger_message(self, id: str, requested_message: str):
-        for cp, task in self._chargers.items():
-            if cp.id == id:
-                result = await cp.send_trigger_message(requested_message)
-                return result.status
-        raise ValueError(f"Charger {id} not connected.")
+        cp = self._registry.require(id)
+        result = await cp.send_trigger_message(requested_message)
+        return result.status
@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+import tempfile
+from events import EventBus
+from metrics import METRICS, log_gauges
+from snapshot import ChargerSnapshot
+
+# Multi-process mode of the backend.
+#
+# N worker processes bind the websocket port with SO_REUSEPORT, so the kernel
+# spreads incoming connections between them, and each runs a normal
+# CentralSystem. The main process serves the HTTP API with a
+# ClusterCentralSystem which mirrors the charger events of every worker and
+# forwards commands to the worker holding the charger through a unix socket.
+#
+# Frames on the control socket are a 4 byte length followed by a pickled
+# tuple:
+#   worker -> main: ("hello", index), ("event", id, event, data),
+#                   ("reply", request_id, ok, value)
+#   main -> worker: ("request", request_id, method, args, kwargs)
+
+_HEADER = struct.Struct("!I")
+
+# CentralSystem methods addressed to one charger, the first argument is its id
+ROUTED_METHODS = {
+    "set_variables",
+    "get_variables",
+    "reserve_now",
+    "cancel_reserve",
+    "set_display_message",
+    "get_display_message",
+    "clear_display_message",
+    "send_sendlocallist",
+    "get_locallist",
+    "update_firmware",
+    "change_status",
+    "start_transaction",
+    "stop_transaction",
+    "trigger_message",
+}
+
+# Methods that return None instead of raising for an unknown charger
+OPTIONAL_METHODS = {"set_variables", "get_variables", "get_locallist"}
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return pickle.loads(await reader.readexactly(length))
+
+
+def write_frame(writer: asyncio.StreamWriter, message: tuple):
+    data = pickle.dumps(message)
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+class RemoteCharger:
+    """Mirror of a charger connected to a worker process."""
+
+    __slots__ = ("id", "worker", "state")
+
+    def __init__(self, id, worker):
+        self.id = id
+        self.worker = worker
+        self.state = None
+
+
+class ClusterCentralSystem:
+    """Stand-in for CentralSystem in the main process of the multi-process
+    mode. It exposes the same methods used by the HTTP API."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.control_path = config.get("control_socket") or os.path.join(
+            tempfile.mkdtemp(prefix="csms-"), "control.sock"
+        )
+        self.events = EventBus(config.get("events", {}).get("queue_size", 256))
+        self._snapshot = ChargerSnapshot(lambda charger: charger.state)
+        # Limit of the operations of a /batch run at once, as in CentralSystem
+        self.broadcast_concurrency = config.get("broadcast", {}).get("concurrency", 50)
+        self._chargers = {}
+        self._workers = {}
+        self._processes = {}
+        # request id -> (worker index, future)
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._server = None
+        self._supervisor = None
+
+    async def start(self, workers: int):
+        self._server = await asyncio.start_unix_server(
+            self._handle_worker, path=self.control_path
+        )
+        for index in range(workers):
+            self._spawn(index)
+        logging.info(f"Started {workers} workers, control socket {self.control_path}")
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    def _spawn(self, index: int):
+        process = multiprocessing.get_context("spawn").Process(
+            target=worker_main,
+            args=(index, self.config, self.control_path),
+            name=f"csms-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def _supervise(self, interval: float = 1):
+        """Restart the workers that died, as CSMS.run_workers does."""
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in list(self._processes.items()):
+                if not process.is_alive():
+                    logging.error(
+                        f"Worker {index} exited with {process.exitcode}, restarting"
+                    )
+                    self._spawn(index)
+
+    async def wait_closed(self):
+        await self._server.serve_forever()
+
+    async def _handle_worker(self, reader, writer):
+        _, index = await read_frame(reader)
+        self._workers[index] = writer
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message[0] == "event":
+                    self._worker_event(index, *message[1:])
+                elif message[0] == "reply":
+                    _, request_id, ok, value = message
+                    _, future = self._pending.pop(request_id, (None, None))
+                    if future is not None and not future.done():
+                        if ok:
+                            future.set_result(value)
+                        else:
+                            future.set_exception(value)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.error(f"Worker {index} disconnected")
+        finally:
+            # A restarted worker may already have said hello
+            if self._workers.get(index) is writer:
+                del self._workers[index]
+            for request_id, (worker, future) in list(self._pending.items()):
+                if worker == index:
+                    del self._pending[request_id]
+                    if not future.done():
+                        future.set_exception(ValueError(f"Worker {index} disconnected"))
+            for charger in list(self._chargers.values()):
+                if charger.worker == index:
+                    self._worker_event(index, charger.id, "Disconnected", "null")
+
+    def _worker_event(self, index: int, id: str, event: str, data: str):
+        charger = self._chargers.get(id)
+        if event == "Disconnected":
+            if charger is None or charger.worker != index:
+                # The id has been taken by a connection on another worker
+                return
+            del self._chargers[id]
+            self._snapshot.removed(id)
+        elif event != "SendLocalList":
+            if charger is None or charger.worker != index:
+                charger = RemoteCharger(id, index)
+                self._chargers[id] = charger
+            charger.state = json.loads(data)
+            self._snapshot.changed(charger)
+        if self.events:
+            self.events.publish(
+                id,
+                event,
+                self._snapshot.version,
+                f'{{"id":{json.dumps(id)},"charger":{data}}}',
+            )
+
+    async def _request(self, index: int, method: str, *args, **kwargs):
+        writer = self._workers.get(index)
+        if writer is None:
+            raise ValueError(f"Worker {index} not available.")
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (index, future)
+        write_frame(writer, ("request", request_id, method, args, kwargs))
+        try:
+            await writer.drain()
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    def __getattr__(self, method):
+        if method not in ROUTED_METHODS:
+            raise AttributeError(method)
+
+        async def routed(id, *args, **kwargs):
+            charger = self._chargers.get(id)
+            if charger is None:
+                if method in OPTIONAL_METHODS:
+                    return None
+                raise ValueError(f"Charger {id} not connected.")
+            return await self._request(charger.worker, method, id, *args, **kwargs)
+
+        return routed
+
+    async def get_connected_chargers(self):
+        return {id: charger.state for id, charger in self._chargers.items()}
+
+    def chargers_snapshot(self, since: int | None = None) -> tuple[str, str]:
+        if since is None:
+            return self._snapshot.etag, self._snapshot.full()
+        return self._snapshot.etag, self._snapshot.delta(since)
+
+    async def metrics(self) -> list:
+        """Metrics of every worker, labelled with its index, and of this
+        process."""
+        indexes = list(self._workers)
+        results = await asyncio.gather(
+            *(self._request(index, "metrics") for index in indexes)
+        )
+        sources = []
+        for index, worker_sources in zip(indexes, results):
+            for labels, metrics, gauges in worker_sources:
+                sources.append((f'worker="{index}"', metrics, gauges))
+        sources.append(('worker="main"', METRICS, log_gauges()))
+        return sources
+
+    async def broadcast(self, action: str, payload: dict, **kwargs) -> dict:
+        """Run the broadcast on every worker. The concurrency limit applies
+        per worker."""
+        results = await asyncio.gather(
+            *(
+                self._request(index, "broadcast", action, payload, **kwargs)
+                for index in list(self._workers)
+            )
+        )
+        merged = {}
+        for result in results:
+            merged.update(result)
+        return merged
+
+
+class WorkerLink:
+    """Connection of a worker process to the main process. Forwards the events
+    of the local CentralSystem and executes the requests of the main one."""
+
+    def __init__(self, csms, index: int, control_path: str):
+        self.csms = csms
+        self.index = index
+        self.control_path = control_path
+        self._writer = None
+
+    async def connect(self, attempts: int = 50):
+        for attempt in range(attempts):
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.control_path
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Cannot reach control socket {self.control_path}")
+        write_frame(self._writer, ("hello", self.index))
+        self.csms.listeners.append(self._forward_event)
+        return asyncio.create_task(self._serve(reader))
+
+    def _forward_event(self, id: str, event: str, data: str):
+        write_frame(self._writer, ("event", id, event, data))
+
+    async def _serve(self, reader):
+        while True:
+            _, request_id, method, args, kwargs = await read_frame(reader)
+            asyncio.create_task(self._execute(request_id, method, args, kwargs))
+
+    async def _execute(self, request_id, method, args, kwargs):
+        try:
+            value = await getattr(self.csms, method)(*args, **kwargs)
+            reply = ("reply", request_id, True, value)
+        except Exception as e:
+            reply = ("reply", request_id, False, e)
+        try:
+            write_frame(self._writer, reply)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            write_frame(self._writer, ("reply", request_id, False, ValueError(f"{e}")))
+
+
+async def run_worker(index: int, config: dict, control_path: str):
+    # Imported here, backend.py imports this module.
+    from backend import create_websocket_server
+    from centralsystem import CentralSystem
+
+    csms = CentralSystem(config)
+    link_task = await WorkerLink(csms, index, control_path).connect()
+    server = await create_websocket_server(csms, config, reuse_port=True)
+    # Exit with the main process: the link breaks when it goes away.
+    await asyncio.wait(
+        [link_task, asyncio.create_task(server.wait_closed())],
+        return_when=asyncio.FIRST_COMPLETED,
+    )
+
+
+def worker_main(index: int, config: dict, control_path: str):
+    asyncio.run(run_worker(index, config, control_path))
@@ -0,0 +1,277 @@
+import asyncio
+import decimal
+import inspect
+import json
+import logging
+
+from ocpp.exceptions import (
+    FormatViolationError,
+    NotSupportedError,
+    OCPPError,
+    PropertyConstraintViolationError,
+    ProtocolError,
+)
+from ocpp.messages import Call, CallError, CallResult, MessageType
+
+import fastpath
+import validation
+from keys import camel_to_snake_case
+from serialize import to_payload
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+# JSON codec of the OCPP frames.
+#
+# The ocpp ChargePoint parses and serializes every frame with the stdlib json
+# module. CodecMixin, put before the ChargePoint base class, routes frames
+# through loads()/dumps() of this module instead: orjson when it is installed,
+# json otherwise, or the one chosen with use(). orjson rejects some frames
+# json accepts (NaN, integers over 64 bits), those fall back to json so both
+# codecs answer attackers alike.
+
+LOGGER = logging.getLogger("ocpp")
+
+
+def _default(obj):
+    # Same conversions as ocpp.messages._DecimalEncoder
+    if isinstance(obj, decimal.Decimal):
+        return float("%.1f" % obj)
+    try:
+        return obj.to_json()
+    except AttributeError:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), default=_default)
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+def _orjson_dumps(obj) -> str:
+    try:
+        # Frames must go out as text, websockets sends bytes as binary frames
+        return orjson.dumps(obj, default=_default).decode()
+    except TypeError:
+        return _json_dumps(obj)
+
+
+_CODECS = {"json": (_json_loads, _json_dumps)}
+if orjson is not None:
+    _CODECS["orjson"] = (_orjson_loads, _orjson_dumps)
+
+CODEC = "orjson" if orjson is not None else "json"
+loads, dumps = _CODECS[CODEC]
+
+
+def use(name: str | None = "auto") -> str:
+    """Select the codec by name, "auto" for the fastest installed one.
+    Returns the codec in use."""
+    global CODEC, loads, dumps
+    if name in (None, "", "auto"):
+        name = "orjson" if orjson is not None else "json"
+    if name not in _CODECS:
+        LOGGER.warning(f"JSON codec {name} is not available, using json")
+        name = "json"
+    CODEC = name
+    loads, dumps = _CODECS[name]
+    return name
+
+
+def unpack(raw_msg):
+    """ocpp.messages.unpack with the selected codec."""
+    try:
+        msg = loads(raw_msg)
+    except ValueError:
+        raise FormatViolationError(
+            details={"cause": "Message is not valid JSON", "ocpp_message": raw_msg}
+        )
+
+    if not isinstance(msg, list):
+        raise ProtocolError(
+            details={
+                "cause": (
+                    "OCPP message hasn't the correct format. It "
+                    f"should be a list, but got '{type(msg)}' "
+                    "instead"
+                )
+            }
+        )
+
+    for cls in (Call, CallResult, CallError):
+        try:
+            if msg[0] == cls.message_type_id:
+                return cls(*msg[1:])
+        except IndexError:
+            raise ProtocolError(
+                details={"cause": "Message does not contain MessageTypeId"}
+            )
+        except TypeError:
+            raise ProtocolError(details={"cause": "Message is missing elements."})
+
+    raise PropertyConstraintViolationError(
+        details={"cause": f"MessageTypeId '{msg[0]}' isn't valid"}
+    )
+
+
+def pack(msg) -> str:
+    """msg.to_json() with the selected codec."""
+    if type(msg) is Call:
+        return dumps([Call.message_type_id, msg.unique_id, msg.action, msg.payload])
+    if type(msg) is CallResult:
+        return dumps([CallResult.message_type_id, msg.unique_id, msg.payload])
+    return dumps(
+        [
+            CallError.message_type_id,
+            msg.unique_id,
+            msg.error_code,
+            msg.error_description,
+            msg.error_details,
+        ]
+    )
+
+
+class CodecMixin:
+    """route_message, _handle_call and call of ocpp.charge_point.ChargePoint
+    with frames decoded and encoded by this module, payloads serialized by
+    serialize.py and validated by validation.py. Handlers marked with
+    fastpath.fast_response() are answered with their pre-encoded payload."""
+
+    __slots__ = ()
+
+    async def route_message(self, raw_msg):
+        try:
+            msg = unpack(raw_msg)
+        except OCPPError as e:
+            LOGGER.exception(
+                "Unable to parse message: '%s', it doesn't seem "
+                "to be valid OCPP: %s",
+                raw_msg,
+                e,
+            )
+            return
+
+        if msg.message_type_id == MessageType.Call:
+            try:
+                await self._handle_call(msg)
+            except OCPPError as error:
+                LOGGER.exception("Error while handling request '%s'", msg)
+                await self._reply(msg, pack(msg.create_call_error(error)))
+
+        elif msg.message_type_id in (MessageType.CallResult, MessageType.CallError):
+            self._response_queue.put_nowait(msg)
+
+    async def _handle_call(self, msg):
+        try:
+            handlers = self.route_map[msg.action]
+        except KeyError:
+            raise NotSupportedError(
+                details={"cause": f"No handler for {msg.action} registered."}
+            )
+
+        if not handlers.get("_skip_schema_validation", False):
+            validation.validate(msg, inbound=True, charger_id=self.id)
+
+        try:
+            handler = handlers["_on_action"]
+        except KeyError:
+            raise NotSupportedError(
+                details={"cause": f"No handler for {msg.action} registered."}
+            )
+
+        fast = getattr(handler, "_fast_response", None) if fastpath.enabled else None
+        if fast is not None:
+            snake_case_payload = None
+            if fast.stateful:
+                snake_case_payload = camel_to_snake_case(msg.payload)
+                try:
+                    response = handler(**snake_case_payload)
+                    if inspect.isawaitable(response):
+                        await response
+                except Exception as e:
+                    LOGGER.exception("Error while handling request '%s'", msg)
+                    await self._reply(msg, pack(msg.create_call_error(e)))
+                    return
+            await self._reply(msg, fast.frame(msg.unique_id))
+            if "_after_action" in handlers:
+                if snake_case_payload is None:
+                    snake_case_payload = camel_to_snake_case(msg.payload)
+                self._run_after_action(handlers, snake_case_payload)
+            return
+
+        snake_case_payload = camel_to_snake_case(msg.payload)
+        try:
+            response = handler(**snake_case_payload)
+            if inspect.isawaitable(response):
+                response = await response
+        except Exception as e:
+            LOGGER.exception("Error while handling request '%s'", msg)
+            await self._reply(msg, pack(msg.create_call_error(e)))
+            return
+
+        response = msg.create_call_result(to_payload(response))
+
+        if not handlers.get("_skip_schema_validation", False):
+            validation.validate(response, inbound=False, charger_id=self.id)
+
+        await self._reply(msg, pack(response))
+
+        if "_after_action" in handlers:
+            self._run_after_action(handlers, snake_case_payload)
+
+    async def _reply(self, msg, frame: str):
+        """Send `frame`, the answer to the Call `msg`."""
+        await self._send(frame)
+
+    @staticmethod
+    def _run_after_action(handlers, snake_case_payload):
+        # A task so that calls made by the after handler do not block
+        response = handlers["_after_action"](**snake_case_payload)
+        if inspect.isawaitable(response):
+            asyncio.ensure_future(response)
+
+    async def call(self, payload, suppress=True):
+        call = Call(
+            unique_id=str(self._unique_id_generator()),
+            action=payload.__class__.__name__[:-7],
+            payload=to_payload(payload),
+        )
+
+        validation.validate(call, inbound=False, charger_id=self.id)
+
+        frame = pack(call)
+        # Only one call at a time waits for its response, as OCPP requires
+        async with self._call_lock:
+            await self._send(frame)
+            try:
+                response = await self._get_specific_response(
+                    call.unique_id, self._response_timeout
+                )
+            except asyncio.TimeoutError:
+                raise asyncio.TimeoutError(
+                    f"Waited {self._response_timeout}s for response on {frame}."
+                )
+
+        if response.message_type_id == MessageType.CallError:
+            LOGGER.warning("Received a CALLError: %s'", response)
+            if suppress:
+                return
+            raise response.to_exception()
+        response.action = call.action
+        validation.validate(response, inbound=True, charger_id=self.id)
+
+        # call.BootNotificationPayload -> call_result.BootNotificationPayload
+        cls = getattr(self._call_result, payload.__class__.__name__)
+        return cls(**camel_to_snake_case(response.payload))
@@ -0,0 +1,71 @@
+import asyncio
+from collections import deque
+
+
+class Subscription:
+    """Bounded buffer of events for one consumer.
+
+    When the buffer is full a new event replaces a pending event with the same
+    key (same charger and event type), so a slow consumer still ends up with
+    the latest state. If there is none the oldest pending event is dropped.
+    """
+
+    def __init__(self, bus, maxsize: int):
+        self._bus = bus
+        self._maxsize = maxsize
+        self._events = deque()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._bus.unsubscribe(self)
+
+    def put(self, key, event: str):
+        if len(self._events) >= self._maxsize:
+            for pending in self._events:
+                if pending[0] == key:
+                    self._events.remove(pending)
+                    self.coalesced += 1
+                    break
+            else:
+                self._events.popleft()
+                self.dropped += 1
+        self._events.append((key, event))
+        self._ready.set()
+
+    async def get(self) -> str:
+        while not self._events:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._events.popleft()[1]
+
+
+class EventBus:
+    """Fan out charger events to any number of subscribers."""
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscriptions = set()
+
+    def __bool__(self):
+        return bool(self._subscriptions)
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self, self.queue_size)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def publish(self, id: str, event: str, version: int, data: str):
+        """Publish an event. `data` must already be JSON encoded, it is
+        formatted once as a server-sent event and shared by every
+        subscriber."""
+        message = f"id: {version}\nevent: {event}\ndata: {data}\n\n"
+        for subscription in self._subscriptions:
+            subscription.put((id, event), message)
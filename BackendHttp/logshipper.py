@@ -0,0 +1,234 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import socket
+import sys
+import threading
+import logstash
+
+# Largest JSON array sent to Logstash in a single UDP datagram.
+MAX_DATAGRAM = 60000
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: records are dropped and counted when
+    the queue is full. Formatting and I/O happen in the LogShipper thread."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments into the message here, so mutable objects
+        # logged by the handlers cannot change before the worker formats them.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogstashFormatter(logstash.LogstashFormatterVersion1):
+    """LogstashFormatterVersion1 for the records of DroppingQueueHandler:
+    their traceback is only left as the exc_text formatted by prepare()."""
+
+    def get_extra_fields(self, record):
+        fields = super().get_extra_fields(record)
+        if record.exc_text and not record.exc_info:
+            fields.update(self.get_debug_fields(record))
+        return fields
+
+    def get_debug_fields(self, record):
+        fields = super().get_debug_fields(record)
+        if not record.exc_info:
+            fields["stack_trace"] = record.exc_text
+        return fields
+
+
+class LogShipper(threading.Thread):
+    """Background thread that drains the log queue in batches, writes them to
+    the local handlers and ships them to Logstash as JSON arrays over UDP
+    (the json codec of the Logstash udp input turns an array into one event
+    per element)."""
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        records: queue.Queue,
+        handlers: list,
+        logstash_host: str | None = None,
+        logstash_port: int | None = None,
+        logstash_logger: str = "",
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+    ):
+        super().__init__(name="LogShipper", daemon=True)
+        self.records = records
+        self.handlers = handlers
+        self.logstash_address = (logstash_host, logstash_port)
+        self.logstash_logger = logstash_logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.formatter = LogstashFormatter()
+        self.socket = None
+        if logstash_host is not None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.shipped = 0
+        self.failed = 0
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self.records.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            if self._STOP in batch:
+                stopping = True
+                batch.remove(self._STOP)
+            if batch:
+                self._write(batch)
+        # Flush whatever was enqueued before the stop marker was seen.
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.records.get_nowait())
+            except queue.Empty:
+                break
+        if remaining:
+            self._write([r for r in remaining if r is not self._STOP])
+
+    def stop(self, timeout: float = 5):
+        """Flush pending records and stop the thread."""
+        if not self.is_alive():
+            return
+        try:
+            self.records.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # The worker is stuck, do not hang the interpreter on exit.
+            return
+        self.join(timeout)
+
+    def _write(self, batch: list):
+        for handler in self.handlers:
+            for record in batch:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+            handler.flush()
+        if self.socket is not None:
+            self._ship(batch)
+
+    def _ship(self, batch: list):
+        datagram = []
+        size = 2
+        for record in batch:
+            if record.name != self.logstash_logger and not record.name.startswith(
+                self.logstash_logger + "."
+            ):
+                continue
+            try:
+                event = self.formatter.format(record)
+            except Exception:
+                self.failed += 1
+                continue
+            if datagram and size + len(event) + 1 > MAX_DATAGRAM:
+                self._send(datagram)
+                datagram, size = [], 2
+            datagram.append(event)
+            size += len(event) + 1
+        if datagram:
+            self._send(datagram)
+
+    def _send(self, events: list):
+        try:
+            self.socket.sendto(b"[" + b",".join(events) + b"]", self.logstash_address)
+            self.shipped += len(events)
+        except OSError:
+            self.failed += len(events)
+
+
+_shipper = None
+_queue_handler = None
+
+
+def stats() -> dict:
+    """Counters of the logging pipeline, empty if it was not started."""
+    if _shipper is None:
+        return {}
+    return {
+        "queued": _shipper.records.qsize(),
+        "dropped": _queue_handler.dropped,
+        "shipped": _shipper.shipped,
+        "failed": _shipper.failed,
+    }
+
+
+class LoggerLogstash(object):
+    def __init__(
+        self,
+        logger_name: str = "logstash",
+        logstash_host: str = "localhost",
+        logstash_port: int = 6969,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+    ):
+        self.logger_name = logger_name
+        self.logstash_host = logstash_host
+        self.logstash_port = logstash_port
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+    def get(self):
+        """Route every log record through a bounded queue to a LogShipper
+        thread writing to stderr and `logfile` and shipping the records of
+        `logger_name` to Logstash. The pipeline is only set up once per
+        process."""
+        global _shipper, _queue_handler
+
+        self.logger = logging.getLogger(self.logger_name)
+        if _shipper is not None:
+            return self.logger
+
+        formatter = logging.Formatter(
+            "%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
+            datefmt="%H:%M:%S",
+        )
+        self.fileLogger = logging.FileHandler("logfile", mode="a")
+        self.fileLogger.setFormatter(formatter)
+        self.stderrLogger = logging.StreamHandler(sys.stderr)
+        self.stderrLogger.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+        records = queue.Queue(maxsize=self.queue_size)
+        _queue_handler = DroppingQueueHandler(records)
+        _shipper = LogShipper(
+            records,
+            [self.stderrLogger, self.fileLogger],
+            self.logstash_host,
+            self.logstash_port,
+            self.logger_name,
+            self.batch_size,
+            self.flush_interval,
+        )
+        _shipper.start()
+        atexit.register(_shipper.stop)
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(logging.INFO)
+        return self.logger
@@ -0,0 +1,228 @@
+import bisect
+import logshipper
+from ocpp.v201.enums import Action
+
+# Operational metrics of the CSMS in the Prometheus text format.
+#
+# Everything a message touches is allocated up front: one ActionMetrics per
+# OCPP action (plus "other" for the names attackers make up, so they cannot
+# grow the label set) holding plain int counters and fixed bucket histograms.
+# Recording a message is a dict lookup, a few integer additions and a bisect.
+
+# Upper bounds in seconds of the latency histograms
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+OTHER = "other"
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple = BUCKETS):
+        self.bounds = bounds
+        # counts[i] observations in (bounds[i-1], bounds[i]], the last one +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class ActionMetrics:
+    __slots__ = (
+        "received",
+        "sent",
+        "handler_errors",
+        "call_errors",
+        "call_timeouts",
+        "handler",
+        "call",
+    )
+
+    def __init__(self):
+        # Calls received from chargers and sent to them
+        self.received = 0
+        self.sent = 0
+        self.handler_errors = 0
+        # Failed or CallError answered calls, and unanswered ones
+        self.call_errors = 0
+        self.call_timeouts = 0
+        self.handler = Histogram()
+        self.call = Histogram()
+
+
+class Metrics:
+    def __init__(self):
+        self.handshakes = 0
+        self.other = ActionMetrics()
+        self.actions = {action.value: ActionMetrics() for action in Action}
+        self.actions[OTHER] = self.other
+
+    def action(self, name: str) -> ActionMetrics:
+        return self.actions.get(name, self.other)
+
+
+# Metrics of this process
+METRICS = Metrics()
+
+# logshipper.stats() keys -> metric names
+_LOG_GAUGES = {
+    "queued": "ocpp_log_queue_depth",
+    "dropped": "ocpp_log_dropped_total",
+    "shipped": "ocpp_log_shipped_total",
+    "failed": "ocpp_log_failed_total",
+}
+
+
+def log_gauges() -> dict:
+    """Counters of the logging pipeline of this process."""
+    return {_LOG_GAUGES[name]: value for name, value in logshipper.stats().items()}
+
+
+def _histogram(lines: list, name: str, labels: str, histogram: Histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    cumulative += histogram.counts[-1]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+def _labels(*labels: str) -> str:
+    return ",".join(label for label in labels if label)
+
+
+def render(sources: list) -> str:
+    """Prometheus text exposition of (labels, Metrics, gauges) sources. The
+    labels, e.g. 'worker="1"', tell apart the processes of the multi-process
+    mode; gauges maps gauge names to values read when rendering."""
+    lines = []
+
+    def family(name, kind, help, samples):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    def per_action(attribute):
+        for labels, metrics, _ in sources:
+            for action, values in metrics.actions.items():
+                value = getattr(values, attribute)
+                if value:
+                    yield _labels(labels, f'action="{action}"'), value
+
+    gauges = {
+        "ocpp_connected_chargers": "Chargers with an open websocket connection.",
+        "ocpp_reaper_tracked": "Connections watched by the idle connection reaper.",
+        "ocpp_reaped_idle_total": "Connections closed after being idle too long.",
+        "ocpp_reaped_no_boot_total": "Connections closed without a BootNotification.",
+        "ocpp_admission_sessions": "Sessions admitted and still open.",
+        "ocpp_admission_sources": "Source IPs tracked by the admission control.",
+        "ocpp_admission_rejected_rate_total": "Handshakes over the rate of their IP.",
+        "ocpp_admission_rejected_ip_sessions_total": "Connections over the session cap of their IP.",
+        "ocpp_admission_rejected_sessions_total": "Connections over the global session cap.",
+        "ocpp_admission_dropped_messages_total": "Messages over the rate of their IP.",
+        "ocpp_tarpit_sessions": "Sessions whose frames go through the tarpit.",
+        "ocpp_tarpit_pending_frames": "Frames held by the tarpit.",
+        "ocpp_tarpit_pending_bytes": "Size of the frames held by the tarpit.",
+        "ocpp_tarpit_memory_bytes": "Estimated memory held by the tarpit.",
+        "ocpp_tarpit_held_total": "Frames taken by the tarpit.",
+        "ocpp_tarpit_sent_total": "Frames sent by the tarpit.",
+        "ocpp_tarpit_dropped_total": "Frames dropped over the per session limit of the tarpit.",
+        "ocpp_tarpit_overflow_total": "Sessions not tarpitted because the tarpit was full.",
+        "ocpp_vt_queued": "Payloads waiting for a VirusTotal analysis.",
+        "ocpp_vt_submitted_total": "Payloads submitted to VirusTotal analysis.",
+        "ocpp_vt_deduplicated_total": "Payloads already analysed or queued.",
+        "ocpp_vt_dropped_total": "Payloads not analysed because the queue was full.",
+        "ocpp_vt_analysed_total": "VirusTotal analyses completed.",
+        "ocpp_vt_failed_total": "VirusTotal analyses that failed.",
+        "ocpp_schema_validated_total": "Frames validated against the OCPP schemas.",
+        "ocpp_schema_skipped_total": "Frames not validated because of the validation mode.",
+        "ocpp_schema_malformed_total": "Frames rejected by schema validation.",
+        "ocpp_log_queue_depth": "Log records waiting in the logging queue.",
+        "ocpp_log_dropped_total": "Log records dropped because the queue was full.",
+        "ocpp_log_shipped_total": "Log records shipped to Logstash.",
+        "ocpp_log_failed_total": "Log records that could not be shipped.",
+    }
+    for name, help in gauges.items():
+        family(
+            name,
+            "counter" if name.endswith("_total") else "gauge",
+            help,
+            [(labels, values[name]) for labels, _, values in sources if name in values],
+        )
+    family(
+        "ocpp_handshakes_total",
+        "counter",
+        "Completed websocket handshakes.",
+        [(labels, metrics.handshakes) for labels, metrics, _ in sources],
+    )
+
+    lines.append("# HELP ocpp_messages_total OCPP calls by action and direction.")
+    lines.append("# TYPE ocpp_messages_total counter")
+    for direction, attribute in (("in", "received"), ("out", "sent")):
+        for labels, value in per_action(attribute):
+            lines.append(
+                f'ocpp_messages_total{{{labels},direction="{direction}"}} {value}'
+            )
+
+    family(
+        "ocpp_handler_errors_total",
+        "counter",
+        "Calls from chargers answered with a CallError.",
+        per_action("handler_errors"),
+    )
+    family(
+        "ocpp_call_errors_total",
+        "counter",
+        "Calls to chargers that failed or were answered with a CallError.",
+        per_action("call_errors"),
+    )
+    family(
+        "ocpp_call_timeouts_total",
+        "counter",
+        "Calls to chargers without a response in time.",
+        per_action("call_timeouts"),
+    )
+
+    for name, attribute, counter, help in (
+        (
+            "ocpp_handler_seconds",
+            "handler",
+            "received",
+            "Time to handle a call from a charger and send the response.",
+        ),
+        ("ocpp_call_seconds", "call", "sent", "Round trip of calls to chargers."),
+    ):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, metrics, _ in sources:
+            for action, values in metrics.actions.items():
+                if getattr(values, counter):
+                    _histogram(
+                        lines,
+                        name,
+                        _labels(labels, f'action="{action}"'),
+                        getattr(values, attribute),
+                    )
+    lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,206 @@
+import asyncio
+from dataclasses import asdict, is_dataclass
+from ocpp.charge_point import remove_nones
+from ocpp.v201 import datatypes, enums
+from centralsystem import CentralSystem
+
+# Admin operations shared by the HTTP handlers in backend.py and the /batch
+# endpoint. Every operation takes the CentralSystem and the JSON body of the
+# request and returns a JSON serializable result.
+
+
+async def set_locallist(csms: CentralSystem, data: dict):
+    local_authorization_list = []
+    local_authorization_list_dict = []
+    for locallist_entry in data["locallist"]:
+        local_authorization_list_dict.append(
+            {
+                "idToken": {
+                    "idToken": locallist_entry["idToken"],
+                    "type": locallist_entry["type"],
+                },
+                "idTokenInfo": {"status": locallist_entry["status"]},
+            }
+        )
+        local_authorization_list.append(
+            datatypes.AuthorizationData(
+                id_token=datatypes.IdTokenType(
+                    id_token=locallist_entry["idToken"], type=locallist_entry["type"]
+                ),
+                id_token_info=datatypes.IdTokenInfoType(
+                    status=locallist_entry["status"]
+                ),
+            )
+        )
+    version_number = 1
+    update_type = enums.UpdateType.differential
+    return await csms.send_sendlocallist(
+        data["id"],
+        version_number,
+        update_type,
+        local_authorization_list,
+        local_authorization_list_dict,
+    )
+
+
+async def get_locallist(csms: CentralSystem, data: dict):
+    return await csms.get_locallist(data["id"])
+
+
+async def get_variables(csms: CentralSystem, data: dict):
+    variable_data = datatypes.GetVariableDataType(
+        component=datatypes.ComponentType(name="evse"),
+        variable=datatypes.VariableType(name="all"),
+    )
+    return await csms.get_variables(
+        data["id"], data.get("variable_data", [variable_data])
+    )
+
+
+async def set_variables(csms: CentralSystem, data: dict):
+    # {"attributeValue":"","component":"",variable:""}
+    payload = datatypes.SetVariableDataType(
+        attribute_value=data.get("value"),
+        component=datatypes.ComponentType(name=data.get("component")),
+        variable=datatypes.VariableType(data.get("variable")),
+    )
+    return await csms.set_variables(data["id"], [payload])
+
+
+async def update_firmware(csms: CentralSystem, data: dict):
+    return await csms.update_firmware(data["id"], data["firmwareURL"])
+
+
+async def set_display_message(csms: CentralSystem, data: dict):
+    message = datatypes.MessageInfoType(
+        id=data["msgId"],
+        priority=enums.MessagePriorityType.always_front,
+        message=datatypes.MessageContentType(
+            format=enums.MessageFormatType.utf8, content=data["msg"]
+        ),
+    )
+    return await csms.set_display_message(data["id"], message)
+
+
+async def get_display_message(csms: CentralSystem, data: dict):
+    return await csms.get_display_message(data["id"])
+
+
+async def clear_display_message(csms: CentralSystem, data: dict):
+    return await csms.clear_display_message(data["id"], data["msgId"])
+
+
+async def start_transaction(csms: CentralSystem, data: dict):
+    id_token = datatypes.IdTokenType(id_token=data["idToken"], type=data["idTokenType"])
+    remote_start_id = 1
+    return await csms.start_transaction(
+        data["id"], id_token=id_token, remote_start_id=remote_start_id
+    )
+
+
+async def trigger_message(csms: CentralSystem, data: dict):
+    return await csms.trigger_message(data["id"], data["requestedMessage"])
+
+
+async def stop_transaction(csms: CentralSystem, data: dict):
+    return await csms.stop_transaction(data["id"], data["transactionId"])
+
+
+async def change_status(csms: CentralSystem, data: dict):
+    return await csms.change_status(
+        data["id"], data["operationalStatus"], int(data["connectorId"])
+    )
+
+
+async def broadcast(csms: CentralSystem, data: dict):
+    if "action" not in data:
+        raise ValueError("Missing field 'action'.")
+    return await csms.broadcast(
+        data["action"],
+        data.get("payload", {}),
+        selector=data.get("selector"),
+        concurrency=data.get("concurrency"),
+        timeout=data.get("timeout"),
+    )
+
+
+async def get_chargers(csms: CentralSystem, data: dict):
+    return await csms.get_connected_chargers()
+
+
+async def reserve(csms: CentralSystem, data: dict):
+    return await csms.reserve_now(
+        data["id"],
+        datatypes.IdTokenType(id_token=data["idToken"], type=enums.IdTokenType.central),
+        data["expDate"],
+        data.get("connector", 1),
+    )
+
+
+async def cancel_reservation(csms: CentralSystem, data: dict):
+    return await csms.cancel_reserve(data["id"], connector=data.get("connector", 1))
+
+
+# Operation names accepted by /batch, named after the HTTP routes.
+OPERATIONS = {
+    "reserve": reserve,
+    "cancelReservation": cancel_reservation,
+    "getChargers": get_chargers,
+    "setVariables": set_variables,
+    "getVariables": get_variables,
+    "setDisplayMessage": set_display_message,
+    "getDisplayMessage": get_display_message,
+    "clearDisplayMessage": clear_display_message,
+    "getLocallist": get_locallist,
+    "setLocallist": set_locallist,
+    "update": update_firmware,
+    "status": change_status,
+    "startTransaction": start_transaction,
+    "stopTransaction": stop_transaction,
+    "triggerMessage": trigger_message,
+    "broadcast": broadcast,
+}
+
+
+async def run_batch(csms: CentralSystem, operations: list) -> list:
+    """Execute a list of operations and return their results in the same
+    order. Operations addressed to the same charger run one after the other
+    in the given order; everything else runs concurrently, at most
+    csms.broadcast_concurrency at a time.
+    """
+    results = [None] * len(operations)
+    groups = {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            results[index] = {"error": "Operation must be an object."}
+            continue
+        charger = operation.get("id")
+        # Operations without a charger id (getChargers, broadcast) do not
+        # depend on anything else in the batch.
+        key = charger if isinstance(charger, str) else ("", index)
+        groups.setdefault(key, []).append(index)
+
+    semaphore = asyncio.Semaphore(csms.broadcast_concurrency)
+
+    async def run_group(indexes):
+        for index in indexes:
+            async with semaphore:
+                results[index] = await _run_operation(csms, operations[index])
+
+    await asyncio.gather(*(run_group(indexes) for indexes in groups.values()))
+    return results
+
+
+async def _run_operation(csms: CentralSystem, operation: dict) -> dict:
+    name = operation.get("op")
+    if name not in OPERATIONS:
+        return {"error": f"Unknown operation {name}."}
+    try:
+        result = await OPERATIONS[name](csms, operation)
+    except KeyError as e:
+        return {"error": f"Missing field {e}."}
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    if is_dataclass(result):
+        result = remove_nones(asdict(result))
+    return {"result": result}
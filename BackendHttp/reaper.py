@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from timerwheel import TimerWheel
+
+
+class ConnectionReaper:
+    """Close connections that go silent or never send a BootNotification.
+
+    Every connection sits once in a timer wheel at its next deadline, with
+    the task that runs it: a connection is tracked until its task finishes,
+    even if another connection took over its charger id. Messages only
+    update cp.last_activity; when the entry expires the deadline is computed
+    again and the charger is either rescheduled or reaped. Expired chargers
+    are closed together once per tick.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = 300,
+        boot_timeout: float = 60,
+        resolution: float = 1.0,
+        close_timeout: float = 10,
+    ):
+        self.idle_timeout = idle_timeout
+        self.boot_timeout = boot_timeout
+        self.close_timeout = close_timeout
+        self.wheel = TimerWheel(resolution)
+        self.reaped_idle = 0
+        self.reaped_no_boot = 0
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        config = config or {}
+        return cls(
+            idle_timeout=config.get("idle_timeout", 300),
+            boot_timeout=config.get("boot_timeout", 60),
+            resolution=config.get("resolution", 1.0),
+        )
+
+    def _deadline(self, cp) -> tuple[float | None, str | None]:
+        deadlines = []
+        if self.idle_timeout:
+            deadlines.append((cp.last_activity + self.idle_timeout, "idle"))
+        if self.boot_timeout and cp.charger_station is None:
+            deadlines.append((cp.connected_at + self.boot_timeout, "no_boot"))
+        if not deadlines:
+            return None, None
+        return min(deadlines)
+
+    def add(self, cp, task: asyncio.Task):
+        """Track the connection of `cp` until `task`, which runs it,
+        finishes."""
+        deadline, _ = self._deadline(cp)
+        if deadline is not None:
+            self.wheel.schedule((cp, task), deadline)
+
+    def expired(self, now: float | None = None) -> list:
+        """Advance the wheel and return (cp, task, reason) of the
+        connections past their deadline, rescheduling the others."""
+        if now is None:
+            now = time.monotonic()
+        stale = []
+        for entry in self.wheel.advance(now):
+            cp, task = entry
+            if task.done():
+                continue
+            deadline, reason = self._deadline(cp)
+            if deadline is None:
+                continue
+            if deadline <= now:
+                stale.append((cp, task, reason))
+            else:
+                self.wheel.schedule(entry, deadline)
+        return stale
+
+    async def run(self, close):
+        """Reap every tick, close(cp, task, timeout) must end the task."""
+        while True:
+            await asyncio.sleep(self.wheel.resolution)
+            stale = self.expired()
+            if not stale:
+                continue
+            for _, _, reason in stale:
+                if reason == "idle":
+                    self.reaped_idle += 1
+                else:
+                    self.reaped_no_boot += 1
+            logging.info(f"Reaping {len(stale)} stale connections")
+            await asyncio.gather(
+                *(close(cp, task, self.close_timeout) for cp, task, _ in stale),
+                return_exceptions=True,
+            )
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.wheel),
+            "reaped_idle": self.reaped_idle,
+            "reaped_no_boot": self.reaped_no_boot,
+        }
@@ -0,0 +1,125 @@
+class ChargerRegistry:
+    """Connected charge points indexed by their id.
+
+    Besides the primary index the registry keeps secondary indexes by vendor,
+    model, connector status and remote IP. They are updated incrementally when
+    a charger registers, disconnects or reports a BootNotification or
+    StatusNotification, so lookups never have to scan every connection.
+    """
+
+    INDEXES = ("vendor", "model", "status", "ip")
+
+    def __init__(self):
+        self._chargers = {}
+        self._tasks = {}
+        # index name -> key -> set of charger ids
+        self._indexes = {name: {} for name in self.INDEXES}
+        # charger id -> index name -> keys the charger is currently filed under
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._chargers)
+
+    def __iter__(self):
+        return iter(list(self._chargers.values()))
+
+    def __contains__(self, id):
+        return id in self._chargers
+
+    def add(self, cp, task):
+        """Register a charger and the task that runs it. A charger connecting
+        with an id that is already in use replaces the previous entry, whose
+        task is returned so that the caller can close that connection."""
+        replaced = self._tasks.get(cp.id)
+        self._chargers[cp.id] = cp
+        self._tasks[cp.id] = task
+        self.reindex(cp)
+        return replaced
+
+    def remove(self, cp) -> bool:
+        """Remove a charger. Returns False if the id has since been taken by
+        another connection, in which case that one is left untouched."""
+        if self._chargers.get(cp.id) is not cp:
+            return False
+        del self._chargers[cp.id]
+        del self._tasks[cp.id]
+        for name, keys in self._keys.pop(cp.id, {}).items():
+            for key in keys:
+                self._discard(name, key, cp.id)
+        return True
+
+    def get(self, id):
+        return self._chargers.get(id)
+
+    def require(self, id):
+        """Like get() but raises ValueError if the charger is not connected."""
+        try:
+            return self._chargers[id]
+        except KeyError:
+            raise ValueError(f"Charger {id} not connected.")
+
+    def task(self, id):
+        return self._tasks.get(id)
+
+    def ids(self):
+        return list(self._chargers)
+
+    def filter(
+        self,
+        vendor: str | None = None,
+        model: str | None = None,
+        status: str | None = None,
+        ip: str | None = None,
+    ) -> list:
+        """Return the chargers matching every given criterion. Without
+        criteria all chargers are returned."""
+        criteria = {"vendor": vendor, "model": model, "status": status, "ip": ip}
+        candidates = [
+            self._indexes[name].get(key, set())
+            for name, key in criteria.items()
+            if key is not None
+        ]
+        if not candidates:
+            return list(self._chargers.values())
+        candidates.sort(key=len)
+        ids = candidates[0].intersection(*candidates[1:])
+        return [self._chargers[id] for id in ids]
+
+    def count(self, index: str) -> dict:
+        """Number of chargers per key of a secondary index."""
+        return {key: len(ids) for key, ids in self._indexes[index].items()}
+
+    def reindex(self, cp):
+        """Refresh the secondary index entries of a charger from its current
+        state. Called whenever the charger reports something indexed."""
+        if self._chargers.get(cp.id) is not cp:
+            return
+        station = cp.charger_station
+        if not isinstance(station, dict):
+            station = {}
+        # The charger reported these, only strings are filed
+        vendor, model = station.get("vendor_name"), station.get("model")
+        wanted = {
+            "vendor": {vendor if isinstance(vendor, str) else None},
+            "model": {model if isinstance(model, str) else None},
+            "status": set(cp.connectors.values()),
+            "ip": {cp.remote_ip},
+        }
+        current = self._keys.setdefault(cp.id, {})
+        for name, keys in wanted.items():
+            keys.discard(None)
+            old = current.get(name, set())
+            for key in old - keys:
+                self._discard(name, key, cp.id)
+            for key in keys - old:
+                self._indexes[name].setdefault(key, set()).add(cp.id)
+            current[name] = keys
+
+    def _discard(self, name, key, id):
+        index = self._indexes[name]
+        ids = index.get(key)
+        if ids is None:
+            return
+        ids.discard(id)
+        if not ids:
+            del index[key]
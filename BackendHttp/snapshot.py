@@ -0,0 +1,95 @@
+import json
+import time
+from collections import OrderedDict
+
+
+class ChargerSnapshot:
+    """Versioned, incrementally maintained JSON view of the connected chargers.
+
+    Every change to a charger bumps a global version number. The JSON of a
+    charger is only re-serialized when it is requested after a change, the
+    full document is only rebuilt when the version moved, and a delta since a
+    given version only walks the chargers changed after it.
+    """
+
+    def __init__(self, describe, max_tombstones: int = 10000):
+        # describe(cp) returns the JSON serializable state of a charger
+        self._describe = describe
+        self._max_tombstones = max_tombstones
+        # Distinguishes versions of different process runs in ETags.
+        self.epoch = int(time.time())
+        self.version = 0
+        # id -> (version, charger), ordered from least to most recently changed
+        self._changes = OrderedDict()
+        # id -> version at which it disconnected, oldest first
+        self._tombstones = OrderedDict()
+        # Deltas since versions older than this would miss pruned tombstones
+        self._floor = 0
+        self._fragments = {}
+        self._body = None
+        self._body_version = -1
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.epoch}-{self.version}"'
+
+    def changed(self, cp):
+        self.version += 1
+        self._changes[cp.id] = (self.version, cp)
+        self._changes.move_to_end(cp.id)
+        self._tombstones.pop(cp.id, None)
+        self._fragments.pop(cp.id, None)
+
+    def removed(self, id: str):
+        if self._changes.pop(id, None) is None:
+            return
+        self.version += 1
+        self._fragments.pop(id, None)
+        self._tombstones[id] = self.version
+        if len(self._tombstones) > self._max_tombstones:
+            _, self._floor = self._tombstones.popitem(last=False)
+
+    def charger(self, cp) -> str:
+        """JSON of a single charger, shared with the cached documents."""
+        return self._fragment(cp.id, cp)
+
+    def full(self) -> str:
+        """JSON object of every connected charger keyed by id."""
+        if self._body_version != self.version:
+            parts = [
+                f"{json.dumps(id)}:{self._fragment(id, cp)}"
+                for id, (_, cp) in self._changes.items()
+            ]
+            self._body = "{" + ",".join(parts) + "}"
+            self._body_version = self.version
+        return self._body
+
+    def delta(self, since: int) -> str:
+        """JSON document with the chargers changed and removed after version
+        `since`. Falls back to every charger ("full": true) when the delta
+        cannot be computed from the retained history."""
+        full = since < self._floor or since > self.version
+        chargers = []
+        for id, (version, cp) in reversed(self._changes.items()):
+            if version <= since and not full:
+                break
+            chargers.append(f"{json.dumps(id)}:{self._fragment(id, cp)}")
+        removed = []
+        if not full:
+            for id, version in reversed(self._tombstones.items()):
+                if version <= since:
+                    break
+                removed.append(id)
+        return (
+            f'{{"version":{self.version},"since":{since},'
+            f'"full":{json.dumps(full)},'
+            f'"chargers":{{{",".join(reversed(chargers))}}},'
+            f'"removed":{json.dumps(removed)}}}'
+        )
+
+    def _fragment(self, id, cp) -> str:
+        fragment = self._fragments.get(id)
+        if fragment is None:
+            fragment = json.dumps(self._describe(cp))
+            self._fragments[id] = fragment
+        return fragment
@@ -0,0 +1,370 @@
+import asyncio
+import ipaddress
+import logging
+import random
+import sys
+import time
+
+from timerwheel import TimerWheel
+
+# Tarpit of the websocket server.
+#
+# The replies sent to chosen sessions are held and released late: whole after
+# a delay ("delay"), a few bytes at a time as websocket fragments ("trickle")
+# or when the charger sends its next message ("defer"). Sessions are chosen
+# by their source address, or by the action of the call a reply answers.
+# Calls of the CSMS itself are not held, their response timeout runs from
+# the moment they are sent, except behind a reply being trickled: a websocket
+# message cannot start inside the fragments of another, so they go out right
+# after its last fragment.
+#
+# A held frame is a string in the list of its session and the session sits
+# in one timer wheel at the time its next frame is due. A single task, only
+# running while frames are held, writes the due frames straight to the
+# transports, so a tarpitted session costs no coroutine and no timer handle.
+# Once a session holds replies every later reply queues behind them, which
+# keeps them in order.
+
+LOGGER = logging.getLogger("ocpp")
+
+MODES = ("delay", "trickle", "defer")
+
+# Websocket opcodes
+OP_CONT = 0
+OP_TEXT = 1
+
+
+class Policy:
+    __slots__ = ("name", "mode", "delay", "jitter", "chunk_size", "interval")
+
+    def __init__(
+        self,
+        name: str,
+        mode: str = "delay",
+        delay: float = 10,
+        jitter: float = 0,
+        chunk_size: int = 16,
+        interval: float = 1,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Tarpit policy {name}: unknown mode {mode}")
+        self.name = name
+        self.mode = mode
+        # "defer" waits at most this long for the next message
+        self.delay = delay
+        self.jitter = jitter
+        # "trickle" sends chunk_size bytes every interval seconds
+        self.chunk_size = max(1, chunk_size)
+        self.interval = interval
+
+    def due(self, now: float) -> float:
+        if self.jitter:
+            return now + self.delay + random.uniform(0, self.jitter)
+        return now + self.delay
+
+
+class Session:
+    __slots__ = ("cp", "policy", "pending", "deadline", "data", "offset")
+
+    def __init__(self, cp, policy: Policy | None):
+        # None once the session is released
+        self.cp = cp
+        # Policy of the source, None if only some actions are tarpitted
+        self.policy = policy
+        # [due, frame, policy] in sending order
+        self.pending = []
+        self.deadline = None
+        # Encoded frame being trickled and how much of it was sent
+        self.data = None
+        self.offset = 0
+
+
+# Rough sizes for Tarpit.memory()
+_SESSION_SIZE = sys.getsizeof(Session(None, None)) + sys.getsizeof([])
+_FRAME_SIZE = sys.getsizeof([0.0, "", None]) + sys.getsizeof(0.0) + sys.getsizeof("")
+_ENTRY_SIZE = sys.getsizeof((2**40, None)) + sys.getsizeof(2**40) + 8
+
+
+class Tarpit:
+    def __init__(
+        self,
+        policies: dict,
+        actions: dict | None = None,
+        sources: dict | None = None,
+        resolution: float = 0.5,
+        max_sessions: int = 50000,
+        max_pending: int = 16,
+        max_buffer: int = 65536,
+        log_interval: float = 60,
+    ):
+        self.policies = {
+            name: Policy(name, **options) for name, options in policies.items()
+        }
+        # Action -> policy of the answers to its calls
+        self.actions = {
+            action: self.policies[name] for action, name in (actions or {}).items()
+        }
+        # Source address or network -> policy of every reply to its sessions
+        self._addresses = {}
+        self._networks = []
+        for source, name in (sources or {}).items():
+            network = ipaddress.ip_network(source, strict=False)
+            if network.num_addresses == 1:
+                self._addresses[str(network.network_address)] = self.policies[name]
+            else:
+                self._networks.append((network, self.policies[name]))
+        self.max_sessions = max_sessions
+        # Frames over this many per session are dropped
+        self.max_pending = max_pending
+        # Frames wait while the peer has not read this many bytes already sent
+        self.max_buffer = max_buffer
+        self.log_interval = log_interval
+        self.wheel = TimerWheel(resolution)
+        self.sessions = 0
+        self.pending = 0
+        self.pending_bytes = 0
+        self.held = 0
+        self.sent = 0
+        self.dropped = 0
+        self.overflow = 0
+        self._task = None
+        self._logged = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        """Tarpit of the "tarpit" config section, None if it is missing,
+        disabled or chooses no session."""
+        config = dict(config or {})
+        if not config.pop("enabled", True):
+            return None
+        if not config.get("actions") and not config.get("sources"):
+            return None
+        return cls(**config)
+
+    def source_policy(self, ip: str | None) -> Policy | None:
+        if ip is None:
+            return None
+        policy = self._addresses.get(ip)
+        if policy is not None or not self._networks:
+            return policy
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        for network, policy in self._networks:
+            if address in network:
+                return policy
+        return None
+
+    @staticmethod
+    def _address(cp) -> str | None:
+        remote = getattr(cp._connection, "remote_address", None)
+        return remote[0] if remote else None
+
+    def hold(self, cp, frame: str, action: str | None = None) -> bool:
+        """Take `frame`, sent to `cp` (answering a call of `action`), if it
+        must go through the tarpit. False if it can be sent now."""
+        session = cp._tarpit
+        policy = self.actions.get(action)
+        if session is None:
+            if self._addresses or self._networks:
+                source = self.source_policy(self._address(cp))
+                policy = policy or source
+            else:
+                source = None
+            if policy is None:
+                return False
+            if self.max_sessions and self.sessions >= self.max_sessions:
+                self.overflow += 1
+                return False
+            session = Session(cp, source)
+            cp._tarpit = session
+            self.sessions += 1
+        else:
+            policy = policy or session.policy
+            # Nothing to queue behind
+            if policy is None and not session.pending:
+                return False
+
+        if len(session.pending) >= self.max_pending:
+            self.dropped += 1
+            return True
+        now = time.monotonic()
+        due = now if policy is None else policy.due(now)
+        session.pending.append([due, frame, policy])
+        self.pending += 1
+        self.pending_bytes += len(frame)
+        self.held += 1
+        if len(session.pending) == 1:
+            self._schedule(session, due)
+        return True
+
+    def hold_call(self, cp, frame: str) -> bool:
+        """Take `frame`, a call sent to `cp`, if a reply is being trickled to
+        it. False if it can be sent now."""
+        session = cp._tarpit
+        if session is None or session.data is None:
+            return False
+        # Right behind the trickled reply, ahead of the replies still held
+        session.pending.insert(1, [time.monotonic(), frame, None])
+        self.pending += 1
+        self.pending_bytes += len(frame)
+        self.held += 1
+        return True
+
+    def received(self, cp):
+        """A message came from `cp`, its deferred frame is due."""
+        session = cp._tarpit
+        if session is None or not session.pending:
+            return
+        head = session.pending[0]
+        if head[2] is not None and head[2].mode == "defer":
+            now = time.monotonic()
+            if head[0] > now:
+                head[0] = now
+                self._schedule(session, now)
+
+    def release(self, cp):
+        """Forget the frames held for `cp`, its connection is gone."""
+        session = cp._tarpit
+        if session is None:
+            return
+        cp._tarpit = None
+        session.cp = None
+        self.sessions -= 1
+        self.pending -= len(session.pending)
+        self.pending_bytes -= sum(len(item[1]) for item in session.pending)
+        session.pending.clear()
+        session.data = None
+
+    def _schedule(self, session: Session, due: float):
+        session.deadline = due
+        self.wheel.schedule(session, due)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while len(self.wheel):
+                await asyncio.sleep(self.wheel.resolution)
+                self.tick()
+        finally:
+            self._task = None
+
+    def tick(self, now: float | None = None):
+        """Write the frames that came due."""
+        if now is None:
+            now = time.monotonic()
+        for session in self.wheel.advance(now):
+            cp = session.cp
+            if cp is None:
+                continue
+            try:
+                self._flush(session, cp, now)
+            except Exception:
+                LOGGER.exception(f"Tarpit: sending to {cp.id} failed")
+                self.release(cp)
+        if self.log_interval and now - self._logged >= self.log_interval:
+            self._logged = now
+            LOGGER.info(f"Tarpit: {self.stats()}")
+
+    def _flush(self, session: Session, cp, now: float):
+        pending = session.pending
+        if not pending or pending[0][0] > now:
+            # A stale wheel entry, the session is scheduled at its deadline
+            return
+        connection = cp._connection
+        if not connection.open:
+            self.release(cp)
+            return
+        if connection.transport.get_write_buffer_size() > self.max_buffer:
+            self._schedule(session, now + self.wheel.resolution)
+            return
+
+        while pending and pending[0][0] <= now:
+            _, frame, policy = pending[0]
+            if policy is not None and policy.mode == "trickle":
+                if session.data is None:
+                    self._record(cp, frame)
+                    session.data = frame.encode()
+                    session.offset = 0
+                start = session.offset
+                end = start + policy.chunk_size
+                last = end >= len(session.data)
+                connection.write_frame_sync(
+                    last, OP_CONT if start else OP_TEXT, session.data[start:end]
+                )
+                if not last:
+                    session.offset = end
+                    pending[0][0] = now + policy.interval
+                    break
+                session.data = None
+            else:
+                self._record(cp, frame)
+                connection.write_frame_sync(True, OP_TEXT, frame.encode())
+            pending.pop(0)
+            self.pending -= 1
+            self.pending_bytes -= len(frame)
+            self.sent += 1
+
+        if pending and pending[0][0] != session.deadline:
+            self._schedule(session, pending[0][0])
+
+    @staticmethod
+    def _record(cp, frame: str):
+        LOGGER.info("%s: send %s", cp.id, frame)
+        # Frames written without send() are not seen by a CapturingConnection
+        record = getattr(cp._connection, "record_sent", None)
+        if record is not None:
+            record(frame)
+
+    def memory(self) -> int:
+        """Estimate of the bytes held by the tarpit."""
+        return (
+            self.sessions * _SESSION_SIZE
+            + self.pending * _FRAME_SIZE
+            + self.pending_bytes
+            + len(self.wheel) * _ENTRY_SIZE
+        )
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "pending_frames": self.pending,
+            "pending_bytes": self.pending_bytes,
+            "memory_bytes": self.memory(),
+            "held": self.held,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "overflow": self.overflow,
+        }
+
+
+class TarpitMixin:
+    """Put before CodecMixin in the bases of a CompactChargePoint. Sends the
+    replies of the sessions chosen by the class attribute `tarpit` through
+    it."""
+
+    __slots__ = ()
+
+    tarpit: Tarpit = None
+
+    async def start(self):
+        try:
+            await super().start()
+        finally:
+            if self.tarpit is not None:
+                self.tarpit.release(self)
+
+    async def route_message(self, raw_msg):
+        if self.tarpit is not None:
+            self.tarpit.received(self)
+        await super().route_message(raw_msg)
+
+    async def _reply(self, msg, frame: str):
+        if self.tarpit is None or not self.tarpit.hold(self, frame, msg.action):
+            await super()._reply(msg, frame)
+
+    async def _send(self, message):
+        if self.tarpit is None or not self.tarpit.hold_call(self, message):
+            await super()._send(message)
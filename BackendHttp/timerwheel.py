@@ -0,0 +1,53 @@
+import math
+import time
+
+
+class TimerWheel:
+    """Hashed timing wheel: a ring of `slots` buckets, one per `resolution`
+    seconds. Scheduling is an append to the bucket of the deadline and
+    advancing the wheel only visits the buckets whose time passed, so
+    thousands of timers cost no tasks and no heap operations.
+
+    Entries are never cancelled, the owner checks when they expire whether
+    they are still relevant (and schedules them again if needed)."""
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        self._slots = [[] for _ in range(slots)]
+        self._tick = math.floor(time.monotonic() / resolution)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, item, deadline: float):
+        """Expire `item` on the first advance() at or after the monotonic
+        time `deadline`."""
+        tick = max(math.ceil(deadline / self.resolution), self._tick + 1)
+        self._slots[tick % len(self._slots)].append((tick, item))
+        self._count += 1
+
+    def advance(self, now: float | None = None) -> list:
+        """Move the wheel to `now` and return the expired items."""
+        if now is None:
+            now = time.monotonic()
+        target = math.floor(now / self.resolution)
+        expired = []
+        # After a stall longer than a turn every bucket is visited once
+        for tick in range(
+            max(self._tick + 1, target - len(self._slots) + 1), target + 1
+        ):
+            index = tick % len(self._slots)
+            bucket = self._slots[index]
+            if not bucket:
+                continue
+            pending = []
+            for entry in bucket:
+                if entry[0] <= target:
+                    expired.append(entry[1])
+                else:
+                    pending.append(entry)
+            self._slots[index] = pending
+        self._tick = max(self._tick, target)
+        self._count -= len(expired)
+        return expired
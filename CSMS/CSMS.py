@@ -1,15 +1,17 @@
 import asyncio
+import functools
 import http
 import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
 import random
 import argparse
 import ssl
 import os
-import io
-import vt
 import json
 import pathlib
-import logstash
 from datetime import datetime
 
 try:
@@ -20,58 +22,40 @@ except ModuleNotFoundError:
 
     sys.exit(1)
 
+from admission import AdmissionControl
+from capture import CapturingConnection, FrameCapture
+import codec
+import validation
+from codec import CodecMixin
+import fastpath
+from fastpath import fast_response
+from logshipper import LoggerLogstash
+from tarpit import Tarpit, TarpitMixin
+from vtanalysis import AnalysisQueue
 from ocpp.routing import on
-from ocpp.v201 import ChargePoint as cp
+from compact import CompactChargePoint
 from ocpp.v201 import call_result, call
 
 
 logging.basicConfig(level=logging.INFO)
 
 
-class LoggerLogstash(object):
-    def __init__(
-        self,
-        logger_name: str = "logstash",
-        logstash_host: str = "localhost",
-        logstash_port: int = 6969,
-    ):
-        self.logger_name = logger_name
-        self.logstash_host = logstash_host
-        self.logstash_port = logstash_port
-
-    def get(self):
-        logging.basicConfig(
-            filename="logfile",
-            filemode="a",
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
-            datefmt="%H:%M:%S",
-            level=logging.INFO,
-        )
+@functools.cache
+def shared_analysis_queue():
+    """VirusTotal analysis queue shared by every connection, None if no
+    token is configured."""
+    try:
+        with open("/config.json") as file:
+            config = json.load(file)
+    except Exception:
+        return None
+    return AnalysisQueue.from_config(
+        config.get("VT_API_KEY", ""), config.get("virustotal")
+    )
 
-        self.stderrLogger = logging.StreamHandler()
-        logging.getLogger().addHandler(self.stderrLogger)
-        self.logger = logging.getLogger(self.logger_name)
-        self.logger.addHandler(
-            logstash.LogstashHandler(self.logstash_host, self.logstash_port, version=1)
-        )
-        return self.logger
-
-
-class ChargePoint(cp):
-    def __init__(self, id, connection):
-        cp.__init__(self, id, connection)
-        self.charger_station = None
-        self.connectors = {}
-        self.display_message = []
-        self.vt_client = None
-        # Only create virus total client if token is found
-        try:
-            with open("/config.json") as file:
-                config = json.load(file)
-            if config.get("VT_API_KEY", "") != "":
-                vt_client = vt.Client(config.get("VT_API_KEY"))
-        except:
-            pass
+
+class ChargePoint(TarpitMixin, CodecMixin, CompactChargePoint):
+    __slots__ = ()
 
     @on("BootNotification")
     def on_boot_notification(self, charging_station, reason, **kwargs):
@@ -84,6 +68,14 @@ class ChargePoint(cp):
         )
 
     @on("Authorize")
+    @fast_response(
+        {
+            "idTokenInfo": {
+                "status": "Accepted",
+                "personalMessage": {"format": "UTF8", "content": "0.69$/kWh"},
+            }
+        }
+    )
     def on_authorize(
         self,
         id_token: dict,
@@ -100,12 +92,12 @@ class ChargePoint(cp):
         )
 
     @on("Heartbeat")
+    @fast_response({"currentTime": None}, time_field="currentTime")
     def on_heartbeat(self, **kwargs):
-        return call_result.HeartbeatPayload(
-            current_time=datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z"
-        )
+        return call_result.HeartbeatPayload(current_time=fastpath.now())
 
     @on("StatusNotification")
+    @fast_response(stateful=True)
     def on_status_notification(
         self,
         timestamp: str,
@@ -115,7 +107,7 @@ class ChargePoint(cp):
         **kwargs,
     ):
         #  A connector status changed, the Charging Station sends a StatusNotificationRequest to the CSMS to inform the CSMS about the new status.
-        self.connectors[str(connector_id)] = connector_status
+        self.set_connector_status(connector_id, connector_status)
         return call_result.StatusNotificationPayload()
 
     @on("NotifyDisplayMessages")
@@ -130,6 +122,7 @@ class ChargePoint(cp):
         return call_result.NotifyDisplayMessagesPayload()
 
     @on("LogStatusNotification")
+    @fast_response()
     def on_log_status_notification(
         self,
         request_id: int,
@@ -140,6 +133,7 @@ class ChargePoint(cp):
         return call_result.LogStatusNotificationPayload()
 
     @on("NotifyEvent")
+    @fast_response()
     def on_notify_event(
         self,
         generated_at: str,
@@ -153,6 +147,7 @@ class ChargePoint(cp):
         return call_result.NotifyEventPayload()
 
     @on("NotifyChargingLimit")
+    @fast_response()
     def on_notify_charging_limit(
         self,
         charging_limit: dict,
@@ -163,6 +158,7 @@ class ChargePoint(cp):
         return call_result.NotifyChargingLimitPayload()
 
     @on("NotifyCustomerInformation")
+    @fast_response()
     def on_notify_customer_information(
         self,
         data: str,
@@ -175,6 +171,7 @@ class ChargePoint(cp):
         return call_result.NotifyCustomerInformationPayload()
 
     @on("NotifyEVChargingSchedule")
+    @fast_response({"status": "Accepted"})
     def on_notify_ev_charging_schedule(
         self,
         time_base: str,
@@ -185,6 +182,7 @@ class ChargePoint(cp):
         return call_result.NotifyEVChargingSchedulePayload(status="Accepted")
 
     @on("MeterValues")
+    @fast_response()
     def on_meter_values(self, evse_id: int, meter_value: list, **kwargs):
         return call_result.MeterValuesPayload()
 
@@ -196,26 +194,26 @@ class ChargePoint(cp):
         data: str | None = None,
         **kwargs,
     ):
-        # scand data with virustotal
-        call.DataTransferPayload()
-        if self.vt_client:
-            try:
-                data = io.StringIO(data)
-                analysis = self.client.scan_file(data, wait_for_completion=True)
-                LOGGER.info(f"VirusTotal analysis: {analysis.stats}")
-            except Exception as e:
-                # usually due to invalid virustotal api key
-                pass
+        # scan data with virustotal in the background
+        analysis = shared_analysis_queue()
+        if analysis is not None and data is not None:
+            if not isinstance(data, str):
+                data = json.dumps(data)
+            analysis.submit(
+                data, charger=self.id, vendor_id=vendor_id, message_id=message_id
+            )
 
         return call_result.DataTransferPayload(status="Accepted", data={})
 
     @on("FirmwareStatusNotification")
+    @fast_response()
     def on_firmware_status_notification(
         self, status: str, request_id: int | None = None, **kwargs
     ):
         return call_result.FirmwareStatusNotificationPayload()
 
     @on("PublishFirmwareStatusNotification")
+    @fast_response()
     def on_publish_firmware_notification(
         self,
         location: str,
@@ -228,16 +226,19 @@ class ChargePoint(cp):
         return call_result.PublishFirmwareStatusNotificationPayload()
 
     @on("MeterValues")
+    @fast_response()
     def on_meter_values(self, evse_id: int, meter_value: list, **kwargs):
         return call_result.MeterValuesPayload()
 
     @on("ClearedChargingLimit")
+    @fast_response()
     def on_cleared_charging_limit(
         self, charging_limit_source: str, evse_id: int | None = None, **kwargs
     ):
         return call_result.ClearedChargingLimitPayload()
 
     @on("TransactionEvent")
+    @fast_response()
     def on_transaction_event(
         self,
         event_type: str,
@@ -260,6 +261,7 @@ class ChargePoint(cp):
         return call_result.TransactionEventPayload()
 
     @on("SecurityEventNotification")
+    @fast_response()
     def on_security_event_notification(
         self, type: str, timestamp: str, tech_info: str | None = None, **kwargs
     ):
@@ -348,7 +350,7 @@ class ChargePoint(cp):
         return await self.call(request)
 
 
-async def on_connect(websocket, path):
+async def on_connect(websocket, path, capture: FrameCapture | None = None):
     """For every new charge point that connects, create a ChargePoint
     instance and start listening for messages.
     """
@@ -372,6 +374,8 @@ async def on_connect(websocket, path):
         return await websocket.close()
 
     charge_point_id = path.strip("/")
+    if capture is not None:
+        websocket = CapturingConnection(websocket, capture, charge_point_id)
     charge_point = ChargePoint(charge_point_id, websocket)
 
     await charge_point.start()
@@ -386,22 +390,15 @@ class UserInfoProtocol(websockets.BasicAuthWebSocketServerProtocol):
 
 
 class TLSCheckCert(websockets.WebSocketServerProtocol):
-    async def connection_made(self, transport: asyncio.BaseTransport) -> None:
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
         """
         Register connection and initialize a task to handle it.
         """
-        transport.get_extra_info(...)
         sslsock = transport.get_extra_info("ssl_object")
-        cert = sslsock.getpeercert()
+        cert = sslsock.getpeercert() if sslsock else None
         # do whatever with the certificate
 
-        super().super().connection_made(transport)
-        # Register the connection with the server before creating the handler
-        # task. Registering at the beginning of the handler coroutine would
-        # create a race condition between the creation of the task, which
-        # schedules its execution, and the moment the handler starts running.
-        super().ws_server.register(self)
-        super().handler_task = super().loop.create_task(super().handler())
+        super().connection_made(transport)
 
 
 async def main(
@@ -410,6 +407,10 @@ async def main(
     security_profile: int,
     logstash_host: str | None,
     logstash_port: int | None,
+    reuse_port: bool = False,
+    capture_config: dict | None = None,
+    admission_config: dict | None = None,
+    tarpit_config: dict | None = None,
 ):
     logging.info(f"Security profile {security_profile}")
 
@@ -419,14 +420,24 @@ async def main(
         )
         logger = instance.get()
 
+    capture = FrameCapture.from_config(capture_config)
+    if capture is not None:
+        logging.info(f"Capturing frames to {capture.path}")
+    handler = functools.partial(on_connect, capture=capture)
+    admission = AdmissionControl.from_config(admission_config)
+    ChargePoint.tarpit = Tarpit.from_config(tarpit_config)
+    if ChargePoint.tarpit is not None:
+        logging.info(f"Tarpit policies: {list(ChargePoint.tarpit.policies)}")
+
     match security_profile:
         case 1:
             server = await websockets.serve(
-                on_connect,
+                handler,
                 address,
                 port,
                 subprotocols=["ocpp2.0.1"],
-                create_protocol=UserInfoProtocol,
+                create_protocol=admission.protocol(UserInfoProtocol),
+                reuse_port=reuse_port,
             )
         case 2:
             if not os.path.isfile(config.get("ssl_key")) or not os.path.isfile(
@@ -437,12 +448,13 @@ async def main(
             ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
             ssl_context.load_cert_chain(config.get("ssl_pem"), config.get("ssl_key"))
             server = await websockets.serve(
-                on_connect,
+                handler,
                 address,
                 port,
                 subprotocols=["ocpp2.0.1"],
                 ssl=ssl_context,
-                create_protocol=UserInfoProtocol,
+                create_protocol=admission.protocol(UserInfoProtocol),
+                reuse_port=reuse_port,
             )
         case 3:
             if not os.path.isfile(config.get("ssl_key")) or not os.path.isfile(
@@ -453,18 +465,75 @@ async def main(
             ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
             ssl_context.load_cert_chain(config.get("ssl_pem"), config.get("ssl_key"))
             server = await websockets.serve(
-                on_connect,
+                handler,
                 address,
                 port,
                 subprotocols=["ocpp2.0.1"],
                 ssl=ssl_context,
-                create_protocol=TLSCheckCert,
+                create_protocol=admission.protocol(TLSCheckCert),
+                reuse_port=reuse_port,
             )
 
     logging.info("Server Started listening to new connections...")
     await server.wait_closed()
 
 
+def run_worker(
+    args: tuple,
+    capture_config: dict | None,
+    admission_config: dict | None,
+    tarpit_config: dict | None,
+):
+    asyncio.run(
+        main(
+            *args,
+            reuse_port=True,
+            capture_config=capture_config,
+            admission_config=admission_config,
+            tarpit_config=tarpit_config,
+        )
+    )
+
+
+def run_workers(
+    workers: int,
+    args: tuple,
+    capture_config: dict | None = None,
+    admission_config: dict | None = None,
+    tarpit_config: dict | None = None,
+):
+    """Run the server in `workers` processes sharing the port with
+    SO_REUSEPORT, the kernel balances new connections between them. A worker
+    that dies is restarted. Admission and tarpit limits apply per worker."""
+    # Forked before any event loop exists, so the children inherit the config
+    context = multiprocessing.get_context("fork")
+    processes = {}
+
+    def stop(signum, frame):
+        for process in processes.values():
+            process.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        for index in range(workers):
+            process = processes.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    logging.error(
+                        f"Worker {index} exited with {process.exitcode}, restarting"
+                    )
+                process = context.Process(
+                    target=run_worker,
+                    args=(args, capture_config, admission_config, tarpit_config),
+                    name=f"csms-worker-{index}",
+                )
+                process.start()
+                processes[index] = process
+        multiprocessing.connection.wait([p.sentinel for p in processes.values()])
+
+
 if __name__ == "__main__":
     # load config json
     with open("/config.json") as file:
@@ -472,13 +541,33 @@ if __name__ == "__main__":
 
     logging.info("[CSMS]Using config:")
     logging.info(config)
-
-    asyncio.run(
-        main(
-            config.get("IP", "0.0.0.0"),
-            config.get("port", "9000"),
-            config.get("security_profile", 1),
-            config.get("logstasth").get("ip"),
-            config.get("logstasth").get("port"),
-        )
+    logging.info(f"JSON codec: {codec.use(config.get('json_codec'))}")
+    logging.info(f"Fast path: {fastpath.configure(config.get('fast_path'))}")
+    workers = config.get("workers", 1)
+    validation_config = config.get("validation", {})
+    if workers > 1:
+        # Loaded before forking, the workers share the validators
+        validation_config = {**validation_config, "warm": "startup"}
+    logging.info(f"Schema validation: {validation.configure(validation_config)}")
+
+    args = (
+        config.get("IP", "0.0.0.0"),
+        config.get("port", "9000"),
+        config.get("security_profile", 1),
+        config.get("logstasth").get("ip"),
+        config.get("logstasth").get("port"),
     )
+    capture_config = config.get("capture")
+    admission_config = config.get("admission")
+    tarpit_config = config.get("tarpit")
+    if workers > 1:
+        run_workers(workers, args, capture_config, admission_config, tarpit_config)
+    else:
+        asyncio.run(
+            main(
+                *args,
+                capture_config=capture_config,
+                admission_config=admission_config,
+                tarpit_config=tarpit_config,
+            )
+        )
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import uuid
+from ocpp.routing import create_route_map
+from ocpp.v201 import ChargePoint as cp
+from ocpp.v201.enums import ConnectorStatusType
+
+# Compact per-connection state of the CSMS ChargePoint.
+#
+# Most connections to the honeypot are idle scanners, so what a connection
+# costs before it does anything is what limits how many we can hold. The
+# upstream ChargePoint builds a route map of bound methods, a lock and a
+# queue for every instance. CompactChargePoint keeps its attributes in slots,
+# shares one route map per class, creates the lock and the queue on first use
+# and stores connector statuses as one byte per connector.
+
+# Connector status codes, 0 is "never reported"
+CONNECTOR_STATUSES = (None,) + tuple(status.value for status in ConnectorStatusType)
+_STATUS_CODES = {status: code for code, status in enumerate(CONNECTOR_STATUSES)}
+
+# Connector ids are attacker controlled, statuses of higher ids are dropped
+MAX_CONNECTORS = 64
+
+
+class _BoundRoutes:
+    """Route map of a class bound to one instance when an action is looked
+    up, the shape ocpp's _handle_call expects."""
+
+    __slots__ = ("_routes", "_instance")
+
+    def __init__(self, routes: dict, instance):
+        self._routes = routes
+        self._instance = instance
+
+    def __getitem__(self, action):
+        handlers = dict(self._routes[action])
+        for option in ("_on_action", "_after_action"):
+            if option in handlers:
+                handlers[option] = handlers[option].__get__(self._instance)
+        return handlers
+
+    def __contains__(self, action):
+        return action in self._routes
+
+
+class CompactChargePoint(cp):
+    __slots__ = (
+        "id",
+        "_response_timeout",
+        "_connection",
+        "_lock",
+        "_queue",
+        "_connectors",
+        "charger_station",
+        "_display_message",
+        "_tarpit",
+    )
+
+    # Shared by every instance, see ocpp.charge_point.ChargePoint
+    _unique_id_generator = staticmethod(uuid.uuid4)
+    _class_routes = {}
+
+    def __init__(self, id, connection, response_timeout=30):
+        # The upstream __init__ is not called, it allocates per instance what
+        # is shared or lazily created here.
+        self.id = id
+        self._response_timeout = response_timeout
+        self._connection = connection
+        self._lock = None
+        self._queue = None
+        self._connectors = None
+        self.charger_station = None
+        self._display_message = None
+        # Session of tarpit.py, while frames to this charger are held
+        self._tarpit = None
+
+    @property
+    def route_map(self):
+        routes = CompactChargePoint._class_routes.get(type(self))
+        if routes is None:
+            routes = create_route_map(type(self))
+            CompactChargePoint._class_routes[type(self)] = routes
+        return _BoundRoutes(routes, self)
+
+    @property
+    def _call_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def _response_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    @property
+    def connectors(self) -> dict:
+        """Status of every reported connector keyed by its id as a string."""
+        if self._connectors is None:
+            return {}
+        return {
+            str(connector_id): CONNECTOR_STATUSES[code]
+            for connector_id, code in enumerate(self._connectors)
+            if code
+        }
+
+    def set_connector_status(self, connector_id: int, status: str):
+        code = _STATUS_CODES.get(status)
+        if (
+            code is None
+            or not isinstance(connector_id, int)
+            or not 0 <= connector_id < MAX_CONNECTORS
+        ):
+            logging.warning(
+                f"Charger {self.id}: ignoring status {status} of connector {connector_id}"
+            )
+            return
+        if self._connectors is None:
+            self._connectors = bytearray(connector_id + 1)
+        elif len(self._connectors) <= connector_id:
+            self._connectors.extend(bytes(connector_id + 1 - len(self._connectors)))
+        self._connectors[connector_id] = code
+
+    @property
+    def display_message(self) -> list:
+        if self._display_message is None:
+            self._display_message = []
+        return self._display_message
+
+    @display_message.setter
+    def display_message(self, messages: list):
+        self._display_message = messages
@@ -0,0 +1,125 @@
+import json
+import os
+import re
+
+import ocpp.messages
+
+# camelCase <-> snake_case translation of payload keys.
+#
+# The ocpp library runs two regular expressions (or a split and a join) over
+# every key of every payload. Payloads only use the few hundred property
+# names of the OCPP 2.0.1 schemas, so their translations are computed once
+# at import into fixed tables. Other keys, which only attackers send, are
+# translated the same way and remembered in a small overflow table that is
+# emptied when full, so unknown keys cannot make the tables grow.
+
+_SCHEMAS = os.path.join(os.path.dirname(ocpp.messages.__file__), "v201", "schemas")
+
+# Keys longer than this are translated every time, never remembered
+MAX_KEY_LENGTH = 64
+OVERFLOW_SIZE = 1024
+
+_FIRST = re.compile("(.)([A-Z][a-z]+)")
+_SECOND = re.compile("([a-z0-9])([A-Z])(?=\\S)")
+
+
+def snake(key: str) -> str:
+    """ocpp.charge_point.camel_to_snake_case for one key."""
+    return _SECOND.sub(r"\1_\2", _FIRST.sub(r"\1_\2", key)).lower()
+
+
+def camel(key: str) -> str:
+    """ocpp.charge_point.snake_to_camel_case for one key."""
+    key = key.replace("soc", "SoC")
+    components = key.split("_")
+    return components[0] + "".join(x[:1].upper() + x[1:] for x in components[1:])
+
+
+_SNAKE = {}
+_CAMEL = {}
+_SNAKE_OVERFLOW = {}
+_CAMEL_OVERFLOW = {}
+# Unknown keys translated, for the benchmarks
+misses = 0
+
+
+def _properties(schema, names: set):
+    if isinstance(schema, dict):
+        for name, value in schema.get("properties", {}).items():
+            names.add(name)
+            _properties(value, names)
+        for key, value in schema.items():
+            if key != "properties":
+                _properties(value, names)
+    elif isinstance(schema, list):
+        for value in schema:
+            _properties(value, names)
+
+
+def seed(directory: str = _SCHEMAS):
+    """Fill the tables with the property names of the schemas."""
+    names = set()
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8-sig") as file:
+                _properties(json.load(file), names)
+    for name in names:
+        key = snake(name)
+        _SNAKE[name] = key
+        _CAMEL[key] = camel(key)
+        # Handlers also return dicts with keys already in camelCase
+        _CAMEL[name] = camel(name)
+
+
+def _translate(key: str, overflow: dict, function) -> str:
+    global misses
+    misses += 1
+    translated = function(key)
+    if len(key) <= MAX_KEY_LENGTH:
+        if len(overflow) >= OVERFLOW_SIZE:
+            overflow.clear()
+        overflow[key] = translated
+    return translated
+
+
+def to_snake(key: str) -> str:
+    translated = _SNAKE.get(key)
+    if translated is None:
+        translated = _SNAKE_OVERFLOW.get(key)
+        if translated is None:
+            translated = _translate(key, _SNAKE_OVERFLOW, snake)
+    return translated
+
+
+def to_camel(key: str) -> str:
+    translated = _CAMEL.get(key)
+    if translated is None:
+        translated = _CAMEL_OVERFLOW.get(key)
+        if translated is None:
+            translated = _translate(key, _CAMEL_OVERFLOW, camel)
+    return translated
+
+
+def camel_to_snake_case(data):
+    """ocpp.charge_point.camel_to_snake_case with the tables."""
+    if isinstance(data, dict):
+        return {
+            to_snake(key): camel_to_snake_case(value) for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [camel_to_snake_case(value) for value in data]
+    return data
+
+
+def snake_to_camel_case(data):
+    """ocpp.charge_point.snake_to_camel_case with the tables."""
+    if isinstance(data, dict):
+        return {
+            to_camel(key): snake_to_camel_case(value) for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [snake_to_camel_case(value) for value in data]
+    return data
+
+
+seed()
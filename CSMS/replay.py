@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict, deque
+
+import websockets
+
+from capture import IN, OPEN, OUT, CaptureReader
+
+# Replay sessions recorded by FrameCapture (see capture.py) against a running
+# CSMS, e.g.:
+#
+#   python replay.py /captures/ocpp-20230101-120000-1 --target ws://csms1:9000 \
+#       --speed 10 --multiply 50
+#
+# Frames the charge point sent are sent again in their original order. The
+# inter-message delays are the recorded ones divided by --speed (0 sends as
+# fast as possible). Calls initiated by the live CSMS are answered with the
+# responses recorded for the same action.
+
+LOGGER = logging.getLogger("replay")
+
+
+def parse(frame: bytes):
+    try:
+        message = json.loads(frame)
+    except ValueError:
+        return None
+    if isinstance(message, list) and len(message) >= 3:
+        return message
+    return None
+
+
+class SessionReplay:
+    def __init__(self, charge_point_id: str, frames: list):
+        self.charge_point_id = charge_point_id
+        # (timestamp, frame) sent by the charge point, in order
+        self.requests = []
+        # action -> recorded responses of the charge point to CSMS calls
+        self.responses = defaultdict(deque)
+
+        csms_calls = {}
+        for timestamp, _, direction, frame in frames:
+            message = parse(frame)
+            if direction == OUT:
+                if message and message[0] == 2 and len(message) >= 4:
+                    csms_calls[message[1]] = message[2]
+            elif direction == IN:
+                if message and message[0] in (3, 4) and message[1] in csms_calls:
+                    self.responses[csms_calls[message[1]]].append(message)
+                else:
+                    self.requests.append((timestamp, frame))
+
+
+class ReplayStats:
+    def __init__(self):
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.csms_calls = 0
+        self.latencies = []
+
+    def report(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "sessions": self.sessions,
+            "failed_sessions": self.failed_sessions,
+            "sent": self.sent,
+            "answered": self.answered,
+            "timeouts": self.timeouts,
+            "csms_calls": self.csms_calls,
+            "elapsed": elapsed,
+            "messages_per_second": self.sent / elapsed if elapsed else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_p99": percentile(0.99),
+        }
+
+
+async def replay_session(
+    session: SessionReplay,
+    target: str,
+    stats: ReplayStats,
+    speed: float = 1.0,
+    suffix: str = "",
+    response_timeout: float = 30,
+    wait_responses: bool = True,
+):
+    stats.sessions += 1
+    responses = {name: deque(queue) for name, queue in session.responses.items()}
+    pending = {}
+
+    async def receive(ws):
+        async for raw in ws:
+            message = parse(raw)
+            if message is None:
+                continue
+            if message[0] == 2:
+                # Call from the live CSMS, answer as recorded
+                stats.csms_calls += 1
+                recorded = responses.get(message[2])
+                if recorded:
+                    answer = list(recorded.popleft())
+                    answer[1] = message[1]
+                else:
+                    answer = [4, message[1], "NotImplemented", "", {}]
+                await ws.send(json.dumps(answer, separators=(",", ":")))
+            elif message[1] in pending:
+                future = pending.pop(message[1])
+                if not future.done():
+                    future.set_result(message)
+
+    try:
+        async with websockets.connect(
+            f"{target.rstrip('/')}/{session.charge_point_id}{suffix}",
+            subprotocols=["ocpp2.0.1"],
+        ) as ws:
+            receiver = asyncio.create_task(receive(ws))
+            try:
+                previous = None
+                for timestamp, frame in session.requests:
+                    if speed and previous is not None:
+                        await asyncio.sleep((timestamp - previous) / speed)
+                    previous = timestamp
+                    message = parse(frame)
+                    future = None
+                    if wait_responses and message and message[0] == 2:
+                        future = asyncio.get_running_loop().create_future()
+                        pending[message[1]] = future
+                    sent_at = time.perf_counter()
+                    await ws.send(frame.decode("utf-8", errors="replace"))
+                    stats.sent += 1
+                    if future is not None:
+                        try:
+                            await asyncio.wait_for(future, response_timeout)
+                            stats.answered += 1
+                            stats.latencies.append(time.perf_counter() - sent_at)
+                        except asyncio.TimeoutError:
+                            stats.timeouts += 1
+                            pending.pop(message[1], None)
+            finally:
+                receiver.cancel()
+                # Also retrieves the error of a receiver that ended with the
+                # connection
+                await asyncio.gather(receiver, return_exceptions=True)
+    except (OSError, websockets.exceptions.WebSocketException) as e:
+        stats.failed_sessions += 1
+        LOGGER.warning(f"Session {session.charge_point_id}{suffix} failed: {e}")
+
+
+async def replay(
+    path: str,
+    target: str,
+    sessions: list | None = None,
+    speed: float = 1.0,
+    multiply: int = 1,
+    concurrency: int = 1000,
+    wait_responses: bool = True,
+) -> dict:
+    reader = CaptureReader(path)
+    recorded = reader.sessions()
+    if sessions:
+        unknown = [session for session in sessions if session not in recorded]
+        for session in unknown:
+            LOGGER.warning(f"Session {session} is not in {path}, skipped")
+        recorded = {
+            session: recorded[session] for session in sessions if session in recorded
+        }
+
+    replays = []
+    for number, meta in recorded.items():
+        frames = [f for f in reader.frames(session=number) if f[2] != OPEN]
+        replays.append(SessionReplay(meta["id"], frames))
+
+    stats = ReplayStats()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(session, suffix):
+        async with semaphore:
+            await replay_session(
+                session,
+                target,
+                stats,
+                speed=speed,
+                suffix=suffix,
+                wait_responses=wait_responses,
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run(session, f"-{copy}" if multiply > 1 else "")
+            for session in replays
+            for copy in range(multiply)
+        )
+    )
+    return stats.report(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured OCPP sessions")
+    parser.add_argument("capture", help="Capture path, with or without .dat/.idx")
+    parser.add_argument(
+        "--target",
+        default="ws://localhost:9000",
+        help="CSMS websocket URL, credentials can be given as ws://user:pass@host",
+    )
+    parser.add_argument(
+        "--session", type=int, action="append", help="Only replay these sessions"
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Timing scale: 1 real time, 10 ten times faster, 0 as fast as possible",
+    )
+    parser.add_argument(
+        "--multiply", type=int, default=1, help="Concurrent copies of every session"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=1000, help="Maximum open sessions"
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Do not wait for the response of a call before sending the next frame",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="List the sessions of the capture"
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for number, meta in CaptureReader(args.capture).sessions().items():
+            print(number, json.dumps(meta))
+        return
+
+    report = asyncio.run(
+        replay(
+            args.capture,
+            args.target,
+            sessions=args.session,
+            speed=args.speed,
+            multiply=args.multiply,
+            concurrency=args.concurrency,
+            wait_responses=not args.no_wait,
+        )
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import random
+import threading
+
+import ocpp.messages
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import ValidationError as SchemaValidationError
+from ocpp.exceptions import (
+    FormatViolationError,
+    NotImplementedError,
+    ProtocolError,
+    TypeConstraintViolationError,
+)
+from ocpp.messages import Call, CallResult, MessageType
+
+# Schema validation of OCPP 2.0.1 frames for CodecMixin.
+#
+# The validators of every action and direction are built once, on the first
+# warm() (at startup, in a background thread by default) or on first use,
+# and kept in a dict keyed by (message type, action). The mode trades
+# strictness for throughput:
+#
+#   full     every frame, received and sent, as the ocpp library does
+#   inbound  only the frames received, our own frames are trusted
+#   sampled  every frame received and `sample_rate` of the frames sent
+#
+# Received frames come from the peer, which on a honeypot is the attacker,
+# so no mode lets them through unvalidated.
+#
+# A frame that fails validation is rejected with the same CallError as the
+# ocpp library would send, and logged as malformed.
+
+LOGGER = logging.getLogger("ocpp")
+
+MODES = ("full", "inbound", "sampled")
+
+_SCHEMAS = os.path.join(os.path.dirname(ocpp.messages.__file__), "v201", "schemas")
+
+
+class SchemaCache:
+    def __init__(self, directory: str = _SCHEMAS):
+        self.directory = directory
+        # (message type id, action) -> Draft4Validator
+        self._validators = {}
+
+    def __len__(self):
+        return len(self._validators)
+
+    def get(self, message_type_id: int, action: str) -> Draft4Validator:
+        validator = self._validators.get((message_type_id, action))
+        if validator is None:
+            validator = self._load(message_type_id, action)
+        return validator
+
+    def _load(self, message_type_id: int, action: str) -> Draft4Validator:
+        suffix = "Request" if message_type_id == MessageType.Call else "Response"
+        path = os.path.join(self.directory, f"{action}{suffix}.json")
+        try:
+            # The OCPP 2.0.1 schemas start with a byte order mark
+            with open(path, encoding="utf-8-sig") as file:
+                schema = json.load(file)
+        except (OSError, ValueError):
+            raise NotImplementedError(
+                details={"cause": f"Failed to validate action: {action}"}
+            )
+        validator = Draft4Validator(schema)
+        self._validators[(message_type_id, action)] = validator
+        return validator
+
+    def load_all(self):
+        for name in sorted(os.listdir(self.directory)):
+            for suffix, message_type_id in (
+                ("Request.json", MessageType.Call),
+                ("Response.json", MessageType.CallResult),
+            ):
+                if name.endswith(suffix):
+                    action = name[: -len(suffix)]
+                    if (message_type_id, action) not in self._validators:
+                        self._load(message_type_id, action)
+
+
+SCHEMAS = SchemaCache()
+mode = "full"
+sample_rate = 0.1
+# Frames validated, not validated because of the mode, and rejected
+validated = 0
+skipped = 0
+malformed = 0
+
+
+def configure(config: dict | None):
+    """Apply the "validation" config section and warm the schema cache:
+    {"mode": "inbound", "sample_rate": 0.1, "warm": "background"}, warm
+    being "background", "startup" or "lazy"."""
+    global mode, sample_rate
+    config = config or {}
+    mode = config.get("mode", "full")
+    if mode not in MODES:
+        LOGGER.warning(f"Unknown validation mode {mode}, using full")
+        mode = "full"
+    sample_rate = config.get("sample_rate", 0.1)
+    warm(config.get("warm", "background"))
+    return mode
+
+
+def warm(how: str = "background"):
+    if how == "startup":
+        SCHEMAS.load_all()
+    elif how == "background":
+        threading.Thread(
+            target=SCHEMAS.load_all, name="schema-warmup", daemon=True
+        ).start()
+
+
+def stats() -> dict:
+    return {"validated": validated, "skipped": skipped, "malformed": malformed}
+
+
+def validate(message: Call | CallResult, inbound: bool, charger_id=None):
+    """Validate the payload of a frame received (inbound) or about to be
+    sent, as far as the mode asks for it."""
+    global validated, skipped, malformed
+    if not inbound and (
+        mode == "inbound" or (mode == "sampled" and random.random() >= sample_rate)
+    ):
+        skipped += 1
+        return
+    validated += 1
+    validator = SCHEMAS.get(message.message_type_id, message.action)
+    try:
+        validator.validate(message.payload)
+    except SchemaValidationError as e:
+        malformed += 1
+        LOGGER.warning(
+            f"Malformed {message.action} {'from' if inbound else 'to'} "
+            f"{charger_id}: {e.message}"
+        )
+        # Same errors as ocpp.messages.validate_payload
+        if e.validator == "type":
+            raise TypeConstraintViolationError(
+                details={"cause": e.message, "ocpp_message": message}
+            )
+        elif e.validator == "additionalProperties":
+            raise FormatViolationError(
+                details={"cause": e.message, "ocpp_message": message}
+            )
+        elif e.validator == "required":
+            raise ProtocolError(details={"cause": e.message})
+        elif e.validator == "maxLength":
+            raise TypeConstraintViolationError(
+                details={"cause": e.message, "ocpp_message": message}
+            ) from e
+        else:
+            raise FormatViolationError(
+                details={
+                    "cause": f"Payload '{message.payload}' for action "
+                    f"'{message.action}' is not valid: {e}",
+                    "ocpp_message": message,
+                }
+            )
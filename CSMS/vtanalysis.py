@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import vt
+
+# Background VirusTotal analysis of payloads received by the honeypot.
+#
+# submit() hashes the payload and returns at once. A payload whose sha256 was
+# already analysed (in memory LRU, then the sqlite cache) or is waiting in
+# the queue is not sent again. A fixed pool of workers takes payloads from a
+# bounded queue, asks VirusTotal for an existing report of the hash and only
+# uploads unknown ones. Every API request, polls of running analyses
+# included, waits for the shared rate limit. Results are logged.
+
+LOGGER = logging.getLogger("ocpp")
+
+
+class ResultCache:
+    """sha256 -> analysis stats, persisted in sqlite. Only used from worker
+    threads, the lock serializes access to the connection."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(sha256 TEXT PRIMARY KEY, stats TEXT, analysed REAL)"
+        )
+        self._db.commit()
+
+    def get(self, sha256: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT stats FROM results WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, sha256: str, stats: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (sha256, json.dumps(stats), time.time()),
+            )
+            self._db.commit()
+
+
+class AnalysisQueue:
+    def __init__(
+        self,
+        api_key: str,
+        host: str | None = None,
+        workers: int = 2,
+        queue_size: int = 1000,
+        requests_per_minute: float = 4,
+        cache_size: int = 10000,
+        cache_path: str | None = None,
+        poll_interval: float = 20,
+        max_size: int = 32 * 1024 * 1024,
+    ):
+        self.api_key = api_key
+        self.host = host or None
+        self.workers = workers
+        self.queue_size = queue_size
+        self.interval = 60 / requests_per_minute if requests_per_minute else 0
+        self.cache_size = cache_size
+        self.poll_interval = poll_interval
+        # VirusTotal needs a separate upload URL above 32MB
+        self.max_size = max_size
+        self.persistent = ResultCache(cache_path) if cache_path else None
+        # sha256 -> stats of the most recently seen analysed payloads
+        self._results = OrderedDict()
+        # Hashes waiting in the queue or being analysed
+        self._pending = set()
+        self._queue = None
+        self._tasks = []
+        self._client = None
+        self._next_request = 0.0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.analysed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_config(cls, api_key: str, config: dict | None):
+        """None without an API key."""
+        if not api_key:
+            return None
+        return cls(api_key, **(config or {}))
+
+    def submit(self, data: bytes | str, **context) -> str | None:
+        """Queue `data` for analysis, `context` is logged with the result.
+        Returns the sha256, None if the payload was not queued."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if len(data) > self.max_size:
+            self.dropped += 1
+            return None
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.submitted += 1
+        stats = self._results.get(sha256)
+        if stats is not None:
+            self._results.move_to_end(sha256)
+            self.deduplicated += 1
+            LOGGER.info(f"VirusTotal analysis (cached) {sha256} {context}: {stats}")
+            return sha256
+        if sha256 in self._pending:
+            self.deduplicated += 1
+            return sha256
+        self._start()
+        try:
+            self._queue.put_nowait((sha256, data, context))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return None
+        self._pending.add(sha256)
+        return sha256
+
+    def _start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._client = vt.Client(self.api_key, host=self.host)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._client is not None:
+            await self._client.close_async()
+
+    async def _throttle(self):
+        """Wait for the next request slot of the rate limit."""
+        now = time.monotonic()
+        slot = max(now, self._next_request)
+        self._next_request = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _request(self, function, *args, **kwargs):
+        while True:
+            await self._throttle()
+            try:
+                return await function(*args, **kwargs)
+            except vt.APIError as e:
+                if e.code != "QuotaExceededError":
+                    raise
+                LOGGER.warning("VirusTotal quota exceeded, backing off")
+                self._next_request = time.monotonic() + 60
+
+    async def _worker(self):
+        while True:
+            sha256, data, context = await self._queue.get()
+            try:
+                stats = await self._analyse(sha256, data)
+                self._remember(sha256, stats)
+                self.analysed += 1
+                LOGGER.info(f"VirusTotal analysis {sha256} {context}: {stats}")
+            except Exception as e:
+                # usually due to invalid virustotal api key
+                self.failed += 1
+                LOGGER.warning(f"VirusTotal analysis of {sha256} failed: {e}")
+            finally:
+                self._pending.discard(sha256)
+
+    async def _analyse(self, sha256: str, data: bytes) -> dict:
+        if self.persistent is not None:
+            stats = await asyncio.to_thread(self.persistent.get, sha256)
+            if stats is not None:
+                return stats
+        try:
+            file = await self._request(
+                self._client.get_object_async, "/files/{}", sha256
+            )
+            stats = dict(file.last_analysis_stats)
+        except vt.APIError as e:
+            if e.code != "NotFoundError":
+                raise
+            # Two requests: the upload URL and the upload
+            await self._throttle()
+            analysis = await self._request(
+                self._client.scan_file_async, io.BytesIO(data)
+            )
+            while getattr(analysis, "status", None) != "completed":
+                await asyncio.sleep(self.poll_interval)
+                analysis = await self._request(
+                    self._client.get_object_async, "/analyses/{}", analysis.id
+                )
+            stats = dict(analysis.stats)
+        if self.persistent is not None:
+            await asyncio.to_thread(self.persistent.put, sha256, stats)
+        return stats
+
+    def _remember(self, sha256: str, stats: dict):
+        self._results[sha256] = stats
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "analysed": self.analysed,
+            "failed": self.failed,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import time
+
+from aiohttp import web
+
+# Minimal local stand-in for the VirusTotal v3 API, enough for vtanalysis.py:
+#
+#   python vtstub.py --port 8090 --analysis-time 5
+#
+# and set "virustotal": {"host": "http://localhost:8090"} (any VT_API_KEY).
+# Payloads containing the --malicious marker are reported as malicious.
+# GET /stub/stats returns the number of requests per endpoint.
+
+
+class VirusTotalStub:
+    def __init__(
+        self,
+        analysis_time: float = 0,
+        malicious: bytes = b"EICAR",
+        quota: int = 0,
+    ):
+        self.analysis_time = analysis_time
+        self.malicious = malicious
+        # Requests per minute before answering QuotaExceededError, 0 unlimited
+        self.quota = quota
+        # sha256 -> (uploaded at, stats)
+        self.files = {}
+        self.requests = {}
+        self._minute = (0, 0)
+
+    def _count(self, endpoint: str) -> web.Response | None:
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        minute = int(time.time() // 60)
+        count = self._minute[1] + 1 if self._minute[0] == minute else 1
+        self._minute = (minute, count)
+        if self.quota and count > self.quota:
+            return self._error(429, "QuotaExceededError", "Quota exceeded")
+        return None
+
+    @staticmethod
+    def _error(status: int, code: str, message: str) -> web.Response:
+        return web.json_response(
+            {"error": {"code": code, "message": message}}, status=status
+        )
+
+    def _stats(self, data: bytes) -> dict:
+        malicious = 1 if self.malicious and self.malicious in data else 0
+        return {"harmless": 0, "malicious": malicious, "undetected": 1 - malicious}
+
+    def _completed(self, sha256: str) -> bool:
+        uploaded, _ = self.files[sha256]
+        return time.time() - uploaded >= self.analysis_time
+
+    async def get_file(self, request):
+        error = self._count("files")
+        if error:
+            return error
+        sha256 = request.match_info["id"]
+        if sha256 not in self.files or not self._completed(sha256):
+            return self._error(404, "NotFoundError", f"File {sha256} not found")
+        return web.json_response(
+            {
+                "data": {
+                    "type": "file",
+                    "id": sha256,
+                    "attributes": {"last_analysis_stats": self.files[sha256][1]},
+                }
+            }
+        )
+
+    async def upload_url(self, request):
+        error = self._count("upload_url")
+        if error:
+            return error
+        return web.json_response({"data": f"{request.url.origin()}/stub/upload"})
+
+    async def upload(self, request):
+        error = self._count("upload")
+        if error:
+            return error
+        reader = await request.multipart()
+        part = await reader.next()
+        data = await part.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.files.setdefault(sha256, (time.time(), self._stats(data)))
+        return web.json_response(
+            {"data": {"type": "analysis", "id": sha256, "attributes": {}}}
+        )
+
+    async def get_analysis(self, request):
+        error = self._count("analyses")
+        if error:
+            return error
+        sha256 = request.match_info["id"]
+        if sha256 not in self.files:
+            return self._error(404, "NotFoundError", f"Analysis {sha256} not found")
+        completed = self._completed(sha256)
+        attributes = {"status": "completed" if completed else "queued"}
+        if completed:
+            attributes["stats"] = self.files[sha256][1]
+        return web.json_response(
+            {"data": {"type": "analysis", "id": sha256, "attributes": attributes}}
+        )
+
+    async def stats(self, request):
+        return web.json_response(self.requests)
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/api/v3/files/upload_url", self.upload_url),
+                web.get("/api/v3/files/{id}", self.get_file),
+                web.get("/api/v3/analyses/{id}", self.get_analysis),
+                web.post("/api/v3/files", self.upload),
+                web.post("/stub/upload", self.upload),
+                web.get("/stub/stats", self.stats),
+            ]
+        )
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local VirusTotal API stub")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument(
+        "--analysis-time", type=float, default=0, help="Seconds an analysis takes"
+    )
+    parser.add_argument("--malicious", default="EICAR")
+    parser.add_argument("--quota", type=int, default=0, help="Requests per minute")
+    args = parser.parse_args()
+    stub = VirusTotalStub(args.analysis_time, args.malicious.encode(), args.quota)
+    web.run_app(stub.application(), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
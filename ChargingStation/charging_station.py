@@ -1,4 +1,5 @@
 import asyncio
+import copy
 import logging
 import random
 import vt
@@ -6,12 +7,17 @@ import os
 import io
 import json
 import websockets
-import logstash
 import ssl
 import uuid
-import time
 from datetime import datetime
 
+import codec
+import validation
+from codec import CodecMixin
+from firmware import FirmwareUpdate
+from logshipper import LoggerLogstash
+from quotas import DisplayMessages, LocalList, Quota, VariableStore
+from scheduler import PeriodicScheduler
 from ocpp.routing import on, after
 from ocpp.v201 import ChargePoint as cp
 from ocpp.v201 import call, call_result
@@ -21,36 +27,32 @@ logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger("ocpp")
 
 
-class LoggerLogstash(object):
-    def __init__(
-        self,
-        logger_name: str = "logstash",
-        logstash_host: str = "localhost",
-        logstash_port: int = 6969,
-    ):
-        self.logger_name = logger_name
-        self.logstash_host = logstash_host
-        self.logstash_port = logstash_port
-
-    def get(self):
-        logging.basicConfig(
-            filename="logfile",
-            filemode="a",
-            format="%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s",
-            datefmt="%H:%M:%S",
-            level=logging.INFO,
-        )
+_vt_clients = {}
+
+
+def shared_vt_client(api_key: str):
+    """One VirusTotal client per API key for every station in the process."""
+    if api_key == "":
+        return None
+    if api_key not in _vt_clients:
+        LOGGER.info("Creating VirusTotal object")
+        _vt_clients[api_key] = vt.Client(api_key)
+    return _vt_clients[api_key]
 
-        self.stderrLogger = logging.StreamHandler()
-        logging.getLogger().addHandler(self.stderrLogger)
-        self.logger = logging.getLogger(self.logger_name)
-        self.logger.addHandler(
-            logstash.LogstashHandler(self.logstash_host, self.logstash_port, version=1)
-        )
-        return self.logger
 
+_scheduler = None
 
-class ChargePoint(cp):
+
+def shared_scheduler(config: dict | None) -> PeriodicScheduler:
+    """One scheduler for the periodic messages of every station in the
+    process, configured by the first station."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PeriodicScheduler.from_config(config)
+    return _scheduler
+
+
+class ChargePoint(CodecMixin, cp):
     def __init__(self, id, connection, response_timeout, config):
         cp.__init__(self, id, connection, response_timeout)
         self.availability: str = "Operative"
@@ -61,15 +63,38 @@ class ChargePoint(cp):
             self.connector_status,
             self.connector_status_exp,
         ) = self.generate_connectors(config)
-        self.occp_variables = config.get("OCPP_variables", {})
-        self.display_message = []
-        self.local_list = []
+        # What the CSMS can write is bounded by the "quotas" config section
+        quotas = config.get("quotas", {})
+        self.occp_variables = VariableStore(
+            config.get("OCPP_variables", {}),
+            id,
+            Quota.from_config(quotas.get("variables")),
+        )
+        self.display_message = DisplayMessages(
+            id, Quota.from_config(quotas.get("display_messages"))
+        )
+        self.local_list = LocalList(id, Quota.from_config(quotas.get("local_list")))
         self.version_number = 0
-        self.vt_client = None
         # Only create virus total client if token is found
-        if config.get("VT_API_KEY", "") != "":
-            LOGGER.info("Creating VirusTotal object")
-            self.vt_client = vt.Client(config.get("VT_API_KEY"))
+        self.vt_client = shared_vt_client(config.get("VT_API_KEY", ""))
+        self.firmware = FirmwareUpdate.from_config(
+            self.send_firmware_status_notification, config.get("firmware")
+        )
+        self.scheduler = shared_scheduler(config.get("schedule"))
+        # Seconds between MeterValues and StatusNotifications, 0 disables
+        self.meter_values_interval = config.get("schedule", {}).get(
+            "meter_values_interval", 0
+        )
+        self.status_interval = config.get("schedule", {}).get("status_interval", 0)
+        self.meter_wh = 0
+        # References to fire-and-forget tasks so they are not collected
+        self.background_tasks = set()
+
+    def run_in_background(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
 
     def generate_connectors(self, config):
         n_connectors = config.get("connectors", 1)
@@ -82,16 +107,64 @@ class ChargePoint(cp):
             reserved_exp.append(datetime.now())
         return connectors, reserved, reserved_exp
 
-    async def send_heartbeat(self, interval):
-        request = call.HeartbeatPayload()
-        while True:
-            await self.call(request)
-            await asyncio.sleep(interval)
+    def start_periodic_messages(self, heartbeat_interval: int):
+        self.scheduler.every(
+            self, "Heartbeat", heartbeat_interval, self.send_heartbeat_once
+        )
+        self.scheduler.every(
+            self, "MeterValues", self.meter_values_interval, self.send_meter_values
+        )
+        self.scheduler.every(
+            self,
+            "StatusNotification",
+            self.status_interval,
+            self.send_status_notification,
+        )
+
+    def stop_periodic_messages(self):
+        self.scheduler.cancel(self)
+
+    def change_interval(self, component: str, variable: str, value):
+        """Apply a SetVariables of a variable that drives a periodic
+        message."""
+        match (component, variable):
+            case ("OCPPCommCtrlr", "HeartbeatInterval"):
+                name, callback = "Heartbeat", self.send_heartbeat_once
+            case ("AlignedDataCtrlr", "Interval"):
+                name, callback = "MeterValues", self.send_meter_values
+            case _:
+                return
+        try:
+            interval = int(value)
+        except (TypeError, ValueError):
+            return
+        if name == "MeterValues":
+            self.meter_values_interval = interval
+        self.scheduler.every(self, name, interval, callback)
 
     async def send_heartbeat_once(self):
         request = call.HeartbeatPayload()
         await self.call(request)
 
+    async def send_meter_values(self):
+        # A slowly increasing energy register
+        self.meter_wh += random.randint(0, 50)
+        request = call.MeterValuesPayload(
+            evse_id=1,
+            meter_value=[
+                {
+                    "timestamp": datetime.utcnow().isoformat() + "Z",
+                    "sampled_value": [
+                        {
+                            "value": self.meter_wh,
+                            "measurand": "Energy.Active.Import.Register",
+                        }
+                    ],
+                }
+            ],
+        )
+        await self.call(request)
+
     async def send_status_notification(self):
         for index in range(len(self.connector_status)):
             if self.connector_status[index] == "Operative":
@@ -118,7 +191,7 @@ class ChargePoint(cp):
             if response.status == "Accepted":
                 # send connectors status
                 await self.send_status_notification()
-                await self.send_heartbeat(response.interval)
+                self.start_periodic_messages(response.interval)
         except Exception as e:
             logging.error(e)
 
@@ -194,35 +267,24 @@ class ChargePoint(cp):
 
         variable_result = []
         for variable in set_variable_data:
-            # Do something with variable.get("attributeValue")
-            # if component exist
-            if self.occp_variables.get(variable["component"]["name"]):
-                if self.occp_variables[variable["component"]["name"]].get(
-                    variable["variable"]["name"]
-                ):
-                    # value exist edit
-                    self.occp_variables[variable["component"]["name"]][
-                        variable["variable"]["name"]
-                    ] = variable["attribute_value"]
-                else:
-                    # component exist but not variable
-                    self.occp_variables[variable["component"]["name"]][
-                        variable["variable"]["name"]
-                    ] = variable["attribute_value"]
-
-            else:
-                # compnenet doesnt exist
-                self.occp_variables[variable["component"]["name"]] = {
-                    variable["variable"]["name"]: variable["attribute_value"]
-                }
+            component_name = variable["component"]["name"]
+            variable_name = variable["variable"]["name"]
+            # Creates the component and the variable if they do not exist
+            accepted = self.occp_variables.set(
+                component_name, variable_name, variable["attribute_value"]
+            )
 
             result = datatypes.SetVariableResultType(
-                attribute_status="Accepted",
-                component=datatypes.ComponentType(name=variable["component"]["name"]),
-                variable=datatypes.VariableType(name=variable["variable"]["name"]),
+                attribute_status="Accepted" if accepted else "Rejected",
+                component=datatypes.ComponentType(name=component_name),
+                variable=datatypes.VariableType(name=variable_name),
                 attribute_type=variable.get("attributeType"),
             )
             variable_result.append(result)
+            if accepted:
+                self.change_interval(
+                    component_name, variable_name, variable["attribute_value"]
+                )
 
         return call_result.SetVariablesPayload(set_variable_result=variable_result)
 
@@ -240,22 +302,15 @@ class ChargePoint(cp):
             and get_variable_data[0]["variable"]["name"] == "all"
         ):
             # send all
-            for component_name in self.occp_variables:
-                for variable_name in self.occp_variables[component_name]:
-                    variable_data = datatypes.GetVariableDataType(
-                        component=datatypes.ComponentType(name="charger"),
-                        variable=datatypes.VariableType(name="all"),
-                    )
-                    variable_result.append(
-                        datatypes.GetVariableResultType(
-                            attribute_status=enums.SetVariableStatusType.accepted,
-                            component=datatypes.ComponentType(name=component_name),
-                            variable=datatypes.VariableType(name=variable_name),
-                            attribute_value=self.occp_variables[component_name][
-                                variable_name
-                            ],
-                        )
+            for component_name, variable_name, value in self.occp_variables.items():
+                variable_result.append(
+                    datatypes.GetVariableResultType(
+                        attribute_status=enums.SetVariableStatusType.accepted,
+                        component=datatypes.ComponentType(name=component_name),
+                        variable=datatypes.VariableType(name=variable_name),
+                        attribute_value=value,
                     )
+                )
         else:
             for variable_request in get_variable_data:
                 variable_name = variable_request.get(
@@ -264,14 +319,19 @@ class ChargePoint(cp):
                 component_name = variable_request.get(
                     "component", {"name": "evse"}
                 ).get("name", "evse")
+                value = self.occp_variables.get(component_name, variable_name)
+                if value is not None:
+                    status = enums.GetVariableStatusType.accepted
+                elif self.occp_variables.has_component(component_name):
+                    status = enums.GetVariableStatusType.unknown_variable
+                else:
+                    status = enums.GetVariableStatusType.unknown_component
                 variable_result.append(
                     datatypes.GetVariableResultType(
-                        attribute_status=enums.SetVariableStatusType.accepted,
+                        attribute_status=status,
                         component=datatypes.ComponentType(name=component_name),
                         variable=datatypes.VariableType(name=variable_name),
-                        attribute_value=self.occp_variables[component_name][
-                            variable_name
-                        ],
+                        attribute_value=value,
                     )
                 )
 
@@ -322,10 +382,10 @@ class ChargePoint(cp):
         **kwargs,
     ):
         # TODO check versionNumber againt old versionNumber
-        # save new localList
         # local_authorization_list has datatypes.AuthorizationData() inside
+        if not self.local_list.update(update_type, local_authorization_list):
+            return call_result.SendLocalListPayload(status="Failed")
         self.version_number = version_number
-        self.local_list = local_authorization_list
         return call_result.SendLocalListPayload(status="Accepted")
 
     @on("GetLocalListVersion")
@@ -338,15 +398,8 @@ class ChargePoint(cp):
     @on("SetDisplayMessage")
     def on_set_display_messages(self, message: dict, **kwargs):
         # this is for set and replace
-
-        if len(self.display_message) < int(message["id"]):
-            # new msg
-            message["id"] = len(self.display_message)
-            self.display_message.append(message)
-        else:
-            # edit
-            index = int(message["id"]) - 1
-            self.display_message[index] = message
+        if not self.display_message.set(message):
+            return call_result.SetDisplayMessagePayload(status="Rejected")
         return call_result.SetDisplayMessagePayload(status="Accepted")
 
     # F .Remote Control
@@ -444,12 +497,14 @@ class ChargePoint(cp):
             case "LogStatusNotification":
                 pass
             case "FirmwareStatusNotification":
-                await self.send_firmware_status_notification("Installed")
+                await self.send_firmware_status_notification(
+                    self.firmware.status,
+                    self.firmware.request_id if self.firmware.running else None,
+                )
             case "Heartbeat":
-                self.send_heartbeat_once()
-                pass
+                await self.send_heartbeat_once()
             case "MeterValues":
-                pass
+                await self.send_meter_values()
             case "SignChargingStationCertificate":
                 pass
             case "SignV2GCertificate":
@@ -488,21 +543,17 @@ class ChargePoint(cp):
 
     @after("GetDisplayMessages")
     async def after_get_display_messages(self, **kwargs):
+        # messageInfo must not be empty, it is left out without messages
         request = call.NotifyDisplayMessagesPayload(
-            request_id=self.request_id, message_info=self.display_message
+            request_id=self.request_id,
+            message_info=self.display_message.values() or None,
         )
         await self.call(request)
 
     @on("ClearDisplayMessage")
     def on_clear_display_messages(self, id: int, **kwargs):
-        # TODO delete/invalidate the display message
-        # if id last element pop else set to None
-        if len(self.display_message) < id:
+        if not self.display_message.clear(id):
             return call_result.ClearDisplayMessagePayload(status="Unknown")
-        else:
-            self.display_message.pop(id - 1)
-            for index in range(len(self.display_message)):
-                self.display_message[index]["id"] = index
         return call_result.ClearDisplayMessagePayload(status="Accepted")
 
     @on("GetLog")
@@ -656,7 +707,7 @@ class ChargePoint(cp):
         return call_result.CostUpdatedPayload()
 
     @on("UpdateFirmware")
-    async def on_update_firmware(
+    def on_update_firmware(
         self,
         request_id: int,
         firmware: dict,
@@ -664,40 +715,50 @@ class ChargePoint(cp):
         retry_interval: int | None = None,
         **kwargs,
     ):
-        # send firmware uri to virustotal for analysis
-        if self.vt_client:
-            try:
-                url_id = vt.url_id(firmware.get("location"))
-                analysis = await self.vt_client.scan_url_async(
-                    firmware.get("location"), wait_for_completion=True
-                )
-                # url = await self.vt_client.get_object_async("/analyses/{}", analysis.id)
-                url = await self.vt_client.get_object_async("/urls/{}", url_id)
-                vt_result = {
-                    "url": firmware.get("location"),
-                    "result": url.last_analysis_stats,
-                }
-                LOGGER.info(f"VirusTotal  analysis: {vt_result}")
-            except Exception as e:
-                # usually due to invalid virustotal api key
-                pass
-
-        return call_result.UpdateFirmwarePayload("Accepted")
+        # send firmware uri to virustotal for analysis, without delaying the
+        # response
+        if self.vt_client and firmware.get("location"):
+            self.run_in_background(self.scan_firmware_url(firmware.get("location")))
 
-    async def send_firmware_status_notification(self, status):
-        request = call.FirmwareStatusNotificationPayload(status=status)
-        await self.call(request)
+        # A new update replaces the running one
+        status = "AcceptedCanceled" if self.firmware.cancel() else "Accepted"
+        return call_result.UpdateFirmwarePayload(status)
 
     @after("UpdateFirmware")
-    async def after_update_firmware(self, request_id: int, **kwargs):
-        # send FirmwareStatusNotificationRequest Status = Downloaded,Installing,Installed
-        time.sleep(random.randint(4, 20))
-        # fake download, installing and installed notifications
-        await self.send_firmware_status_notification("Downloaded")
-        time.sleep(random.randint(1, 3))
-        await self.send_firmware_status_notification("Installing")
-        time.sleep(random.randint(4, 20))
-        await self.send_firmware_status_notification("Installed")
+    async def after_update_firmware(
+        self,
+        request_id: int,
+        firmware: dict,
+        retries: int | None = None,
+        retry_interval: int | None = None,
+        **kwargs,
+    ):
+        self.firmware.start(request_id, firmware, retries, retry_interval)
+
+    async def scan_firmware_url(self, location: str):
+        try:
+            url_id = vt.url_id(location)
+            analysis = await self.vt_client.scan_url_async(
+                location, wait_for_completion=True
+            )
+            # url = await self.vt_client.get_object_async("/analyses/{}", analysis.id)
+            url = await self.vt_client.get_object_async("/urls/{}", url_id)
+            vt_result = {
+                "url": location,
+                "result": url.last_analysis_stats,
+            }
+            LOGGER.info(f"VirusTotal  analysis: {vt_result}")
+        except Exception as e:
+            # usually due to invalid virustotal api key
+            pass
+
+    async def send_firmware_status_notification(
+        self, status, request_id: int | None = None
+    ):
+        request = call.FirmwareStatusNotificationPayload(
+            status=status, request_id=request_id
+        )
+        await self.call(request)
 
     @on("SetChargingProfile")
     def on_set_charging_profile(
@@ -709,6 +770,123 @@ class ChargePoint(cp):
         return call_result.SetChargingProfilePayload(status="Accepted")
 
 
+def create_ssl_context(config: dict):
+    """Return the security profile and SSL context to reach the CSMS. The
+    context is shared by every station of a fleet."""
+    ssl_context = None
+    security_profile = 1
+    if os.path.isfile(config.get("ssl_key")) and os.path.isfile(config.get("ssl_pem")):
+        # Security profile 3
+        security_profile = 3
+        if not "wss" in config.get("CSMS"):
+            logging.info("Cannot use standard ws with security profile 2/3")
+            exit(-1)
+
+        logging.info("Security profile 3")
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ssl_context.load_cert_chain(config.get("ssl_pem"), config.get("ssl_key"))
+        if os.path.isfile(config.get("local_CA")):
+            ssl_context.load_verify_locations(config.get("local_CA"))
+            logging.info(f"Using local CA: {config.get('local_CA')}")
+
+    elif "wss" in config.get("CSMS"):
+        # Security profile 2
+        security_profile = 2
+        logging.info("Security profile 2")
+        if os.path.isfile(config.get("local_CA")):
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ssl_context.load_verify_locations(config.get("local_CA"))
+            logging.info(f"Using local CA: {config.get('local_CA')}")
+        else:
+            # Trusted Certificated
+            ssl_context = True
+    else:
+        # Security profile 1
+        logging.info("Security profile 1")
+    return security_profile, ssl_context
+
+
+def station_uri(config: dict, station_id: str, security_profile: int) -> str:
+    if security_profile == 3:
+        # No basic auth, the client certificate identifies the station
+        return f"{config.get('CSMS')}/{station_id}"
+    csms = config.get("CSMS")
+    scheme_end = csms.index("://") + 3
+    return (
+        f"{csms[:scheme_end]}{config.get('username')}:{config.get('password')}"
+        f"@{csms[scheme_end:]}{station_id}"
+    )
+
+
+async def run_station(
+    config: dict, station_id: str, security_profile: int, ssl_context=None
+):
+    uri = station_uri(config, station_id, security_profile)
+    logging.info(uri)
+    async with websockets.connect(
+        uri,
+        subprotocols=["ocpp2.0.1", "ocpp2.0"],
+        ssl=ssl_context if security_profile != 1 else None,
+    ) as ws:
+        charge_point = ChargePoint(station_id, ws, 30, config)
+
+        try:
+            await asyncio.gather(
+                charge_point.start(), charge_point.send_boot_notification()
+            )
+        finally:
+            charge_point.stop_periodic_messages()
+            charge_point.firmware.cancel()
+
+
+def fleet_configs(config: dict) -> list:
+    """Return (station id, config) for every station of the fleet.
+
+    config["fleet"] = {"size": 100, "overlays": [{"model": ...}, ...]}: station
+    i uses the base config updated with overlays[i % len(overlays)]. The
+    OCPP_variables of an overlay are merged per component. Each station gets
+    its own copy of the variables so SetVariables on one does not leak.
+    """
+    fleet = config.get("fleet", {})
+    size = fleet.get("size", 1)
+    overlays = fleet.get("overlays") or [{}]
+    prefix = config.get("ID", str(uuid.uuid4()))
+    stations = []
+    for index in range(size):
+        overlay = overlays[index % len(overlays)]
+        station = {**config, **overlay}
+        variables = copy.deepcopy(config.get("OCPP_variables", {}))
+        for component, values in overlay.get("OCPP_variables", {}).items():
+            variables.setdefault(component, {}).update(values)
+        station["OCPP_variables"] = variables
+        station_id = overlay.get("ID", prefix if size == 1 else f"{prefix}-{index}")
+        stations.append((station_id, station))
+    return stations
+
+
+async def run_fleet(config: dict, security_profile: int, ssl_context=None):
+    """Run every station of the fleet in this process. Connections are
+    opened over fleet["ramp_up"] seconds so the CSMS is not hit by a burst
+    of handshakes."""
+    stations = fleet_configs(config)
+    ramp_up = config.get("fleet", {}).get("ramp_up", 0)
+    logging.info(f"Starting fleet of {len(stations)} stations")
+
+    async def start(index, station_id, station_config):
+        await asyncio.sleep(ramp_up * index / len(stations))
+        try:
+            await run_station(station_config, station_id, security_profile, ssl_context)
+        except Exception as e:
+            logging.error(f"Station {station_id} stopped: {e}")
+
+    await asyncio.gather(
+        *(
+            start(index, station_id, station_config)
+            for index, (station_id, station_config) in enumerate(stations)
+        )
+    )
+
+
 async def main():
     # ws://localhost:8081/OCPP/
     # ws://localhost:9000/CP_2
@@ -719,8 +897,8 @@ async def main():
     config = config["CP"]
     logging.info("[Charging Point]Using config:")
     logging.info(config)
-    ssl_context = None
-    security_profile = 1
+    logging.info(f"JSON codec: {codec.use(config.get('json_codec'))}")
+    logging.info(f"Schema validation: {validation.configure(config.get('validation'))}")
 
     if config.get("logstasth").get("ip") is not None:
         logging.info("Using Logstash")
@@ -732,81 +910,8 @@ async def main():
         logger = instance.get()
 
     if config.get("CSMS"):
-        if os.path.isfile(config.get("ssl_key")) and os.path.isfile(
-            config.get("ssl_pem")
-        ):
-            # Security profile 3
-            security_profile = 3
-            if not "wss" in config.get("CSMS"):
-                logging.info("Cannot use standard ws with security profile 2/3")
-                exit(-1)
-
-            logging.info("Security profile 3")
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            ssl_context.load_cert_chain(config.get("ssl_pem"), config.get("ssl_key"))
-            if os.path.isfile(config.get("local_CA")):
-                ssl_context.load_verify_locations(config.get("local_CA"))
-                logging.info(f"Using local CA: {config.get('local_CA')}")
-
-        elif "wss" in config.get("CSMS"):
-            # Security profile 2
-            security_profile = 2
-            logging.info("Security profile 2")
-            username = config.get("username")
-            password = config.get("password")
-            if os.path.isfile(config.get("local_CA")):
-                ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-                ssl_context.load_verify_locations(config.get("local_CA"))
-                logging.info(f"Using local CA: {config.get('local_CA')}")
-            else:
-                # Trusted Certificated
-                ssl_context = True
-        else:
-            # Security profile 1
-            logging.info("Security profile 1")
-            username = config.get("username")
-            password = config.get("password")
-
-        match security_profile:
-            case 1:
-                id = uuid.uuid4()
-                # No SSL
-                # Security profile 1
-                uri = f"{config.get('CSMS')[:5]}{config.get('username')}:{config.get('password')}@{config.get('CSMS')[5:]}{config.get('ID',id)}"
-                logging.info(uri)
-                async with websockets.connect(
-                    uri,
-                    subprotocols=["ocpp2.0.1", "ocpp2.0"],
-                ) as ws:
-                    charge_point = ChargePoint("OCPP", ws, 30, config)
-
-                    await asyncio.gather(
-                        charge_point.start(), charge_point.send_boot_notification()
-                    )
-            case 2:
-                uri = f"{config.get('CSMS')[:5]}{config.get('username')}:{config.get('password')}@{config.get('CSMS')[5:]}{config.get('ID',id)}"
-                logging.info(uri)
-                async with websockets.connect(
-                    uri,
-                    subprotocols=["ocpp2.0.1", "ocpp2.0"],
-                    ssl=ssl_context,
-                ) as ws:
-                    charge_point = ChargePoint("OCPP", ws, 30, config)
-
-                    await asyncio.gather(
-                        charge_point.start(), charge_point.send_boot_notification()
-                    )
-            case 3:
-                async with websockets.connect(
-                    f"{config.get('CSMS')}/{id}",
-                    subprotocols=["ocpp2.0.1", "ocpp2.0"],
-                    ssl=ssl_context,
-                ) as ws:
-                    charge_point = ChargePoint("OCPP", ws, 30, config)
-
-                    await asyncio.gather(
-                        charge_point.start(), charge_point.send_boot_notification()
-                    )
+        security_profile, ssl_context = create_ssl_context(config)
+        await run_fleet(config, security_profile, ssl_context)
     else:
         logging.info("CSMS endpoint not set")
 
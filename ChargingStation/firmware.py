@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timezone
+
+# Simulated firmware update of a charging station (OCPP 2.0.1 L01).
+#
+# An accepted UpdateFirmware starts a task that walks the states
+#
+#   [DownloadScheduled] Downloading -> Downloaded [-> SignatureVerified]
+#   [InstallScheduled] Installing -> Installed
+#
+# sending a FirmwareStatusNotification on every transition. Each step takes a
+# random time from its configured [min, max] seconds and may fail with its
+# configured probability (DownloadFailed, InvalidSignature,
+# InstallationFailed). Failed downloads are retried `retries` times,
+# `retry_interval` seconds apart. Everything waits with asyncio.sleep, so
+# the station keeps answering calls and sending heartbeats meanwhile. A new
+# UpdateFirmware cancels the running one.
+
+LOGGER = logging.getLogger("ocpp")
+
+
+def _seconds_until(date_time: str | None) -> float:
+    if not date_time:
+        return 0
+    try:
+        when = datetime.fromisoformat(date_time.replace("Z", "+00:00"))
+    except ValueError:
+        return 0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class FirmwareUpdate:
+    def __init__(
+        self,
+        send_status,
+        download_time: tuple = (4, 20),
+        verify_time: tuple = (1, 3),
+        install_time: tuple = (4, 20),
+        failure_rate: dict | None = None,
+    ):
+        # Called as await send_status(status, request_id)
+        self.send_status = send_status
+        self.download_time = download_time
+        self.verify_time = verify_time
+        self.install_time = install_time
+        # {"download": 0.1, "signature": 0.0, "install": 0.05}
+        self.failure_rate = failure_rate or {}
+        # Last status sent, reported again on a triggered notification
+        self.status = "Idle"
+        self.request_id = None
+        self._task = None
+
+    @classmethod
+    def from_config(cls, send_status, config: dict | None):
+        return cls(send_status, **(config or {}))
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(
+        self,
+        request_id: int,
+        firmware: dict,
+        retries: int | None = None,
+        retry_interval: int | None = None,
+    ):
+        """Start the update in the background, once the UpdateFirmware
+        response has been sent."""
+        self.cancel()
+        self.request_id = request_id
+        self._task = asyncio.create_task(
+            self._run(request_id, firmware, retries or 0, retry_interval or 0)
+        )
+
+    def cancel(self) -> bool:
+        """Cancel the running update, False if there is none."""
+        if not self.running:
+            return False
+        self._task.cancel()
+        return True
+
+    async def _set(self, status: str, request_id: int):
+        self.status = status
+        await self.send_status(status, request_id)
+
+    def _fails(self, step: str) -> bool:
+        return random.random() < self.failure_rate.get(step, 0)
+
+    @staticmethod
+    async def _wait(interval: tuple):
+        await asyncio.sleep(random.uniform(*interval))
+
+    async def _run(
+        self, request_id: int, firmware: dict, retries: int, retry_interval: int
+    ):
+        try:
+            delay = _seconds_until(firmware.get("retrieve_date_time"))
+            if delay:
+                await self._set("DownloadScheduled", request_id)
+                await asyncio.sleep(delay)
+
+            for attempt in range(retries + 1):
+                await self._set("Downloading", request_id)
+                await self._wait(self.download_time)
+                if not self._fails("download"):
+                    break
+                await self._set("DownloadFailed", request_id)
+                if attempt == retries:
+                    return
+                await asyncio.sleep(retry_interval)
+            await self._set("Downloaded", request_id)
+
+            if firmware.get("signature"):
+                await self._wait(self.verify_time)
+                if self._fails("signature"):
+                    await self._set("InvalidSignature", request_id)
+                    return
+                await self._set("SignatureVerified", request_id)
+
+            delay = _seconds_until(firmware.get("install_date_time"))
+            if delay:
+                await self._set("InstallScheduled", request_id)
+                await asyncio.sleep(delay)
+
+            await self._set("Installing", request_id)
+            await self._wait(self.install_time)
+            if self._fails("install"):
+                await self._set("InstallationFailed", request_id)
+                return
+            await self._set("Installed", request_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # usually the connection to the CSMS was closed
+            LOGGER.error(f"Firmware update {request_id} stopped: {e}")
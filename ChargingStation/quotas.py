@@ -0,0 +1,235 @@
+import logging
+import sys
+
+import codec
+
+# Bounded stores of the state the CSMS writes into a station.
+#
+# Device model variables, the local authorization list and the display
+# messages are set by whoever controls the CSMS, which on a honeypot is the
+# attacker. Each store has a Quota: how many entries it keeps, how large one
+# value may be and how many bytes all of them may take (names included),
+# measured as UTF-8 for strings and as JSON for anything else. Writes over a
+# quota are rejected, except display messages which push out the oldest
+# ones like a display rotating its messages. Rejected and evicted writes are
+# counted and logged: a CSMS hitting the quotas is trying to exhaust the
+# station.
+
+LOGGER = logging.getLogger("ocpp")
+
+
+class Quota:
+    __slots__ = ("entries", "value_bytes", "total_bytes")
+
+    def __init__(self, entries: int = 0, value_bytes: int = 0, total_bytes: int = 0):
+        # 0 disables a limit
+        self.entries = entries
+        self.value_bytes = value_bytes
+        self.total_bytes = total_bytes
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        return cls(**(config or {}))
+
+    def fits(self, entries: int, total_bytes: int) -> bool:
+        return (not self.entries or entries <= self.entries) and (
+            not self.total_bytes or total_bytes <= self.total_bytes
+        )
+
+
+def size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode())
+    return len(codec.dumps(value))
+
+
+class Store:
+    def __init__(self, name: str, owner: str, quota: Quota):
+        self.name = name
+        # Id of the station, for the logs
+        self.owner = owner
+        self.quota = quota
+        self.bytes = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def _too_large(self, value_bytes: int) -> bool:
+        return bool(self.quota.value_bytes) and value_bytes > self.quota.value_bytes
+
+    def _reject(self, key, reason: str):
+        self.rejected += 1
+        # 1st, 2nd, 4th, 8th... so that a flood does not flood the logs too
+        if self.rejected & (self.rejected - 1) == 0:
+            LOGGER.warning(
+                f"Station {self.owner}: rejected {self.name} write of {key!r}: "
+                f"{reason} ({self.rejected} rejected, {self.evicted} evicted), "
+                "possible resource exhaustion attempt"
+            )
+
+    def _evict(self, key):
+        self.evicted += 1
+        if self.evicted & (self.evicted - 1) == 0:
+            LOGGER.warning(
+                f"Station {self.owner}: evicted {self.name} {key!r} "
+                f"({self.rejected} rejected, {self.evicted} evicted), "
+                "possible resource exhaustion attempt"
+            )
+
+
+class VariableStore(Store):
+    """Device model variables by component and variable name. Names are
+    interned, stations of a fleet share them."""
+
+    def __init__(self, variables: dict, owner: str, quota: Quota):
+        super().__init__("variable", owner, quota)
+        self._components = {}
+        self._count = 0
+        # The configured variables are trusted, they only count towards the
+        # quota
+        for component, values in variables.items():
+            for variable, value in values.items():
+                self._store(component, variable, value)
+
+    def __len__(self):
+        return self._count
+
+    def _store(self, component: str, variable: str, value):
+        values = self._components.get(component)
+        if values is None:
+            component = sys.intern(component)
+            values = self._components[component] = {}
+            self.bytes += size(component)
+        if variable in values:
+            self.bytes -= size(values[variable])
+        else:
+            variable = sys.intern(variable)
+            self._count += 1
+            self.bytes += size(variable)
+        values[variable] = value
+        self.bytes += size(value)
+
+    def has_component(self, component: str) -> bool:
+        return component in self._components
+
+    def get(self, component: str, variable: str):
+        """Value of the variable, None if it does not exist."""
+        values = self._components.get(component)
+        return None if values is None else values.get(variable)
+
+    def set(self, component: str, variable: str, value) -> bool:
+        """Create or update a variable, False if over the quota."""
+        value_bytes = size(value)
+        if self._too_large(value_bytes):
+            self._reject((component, variable), "value too large")
+            return False
+        values = self._components.get(component)
+        entries, total = self._count, self.bytes + value_bytes
+        if values is None:
+            entries += 1
+            total += size(component) + size(variable)
+        elif variable in values:
+            total -= size(values[variable])
+        else:
+            entries += 1
+            total += size(variable)
+        if not self.quota.fits(entries, total):
+            self._reject((component, variable), "quota exceeded")
+            return False
+        self._store(component, variable, value)
+        return True
+
+    def items(self):
+        """(component, variable, value) of every variable."""
+        for component, values in self._components.items():
+            for variable, value in values.items():
+                yield component, variable, value
+
+
+class LocalList(Store):
+    """Local authorization list, AuthorizationData entries by id token."""
+
+    def __init__(self, owner: str, quota: Quota):
+        super().__init__("local list", owner, quota)
+        # (id token, type) -> (entry, size)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, id_token: str, type: str):
+        stored = self._entries.get((id_token, type))
+        return None if stored is None else stored[0]
+
+    def update(self, update_type: str, entries: list | None) -> bool:
+        """Apply a SendLocalList, False (and nothing changed) if an entry is
+        malformed or too large or the list would be over the quota."""
+        result = {} if update_type == "Full" else dict(self._entries)
+        total = 0 if update_type == "Full" else self.bytes
+        try:
+            for entry in entries or ():
+                key = entry["id_token"]["id_token"], entry["id_token"]["type"]
+                old = result.pop(key, None)
+                if old is not None:
+                    total -= old[1]
+                if update_type == "Differential" and entry.get("id_token_info") is None:
+                    continue
+                entry_bytes = size(entry)
+                if self._too_large(entry_bytes):
+                    self._reject(key, "entry too large")
+                    return False
+                result[key] = (entry, entry_bytes)
+                total += entry_bytes
+        except (KeyError, TypeError, AttributeError):
+            self._reject(update_type, "malformed entry")
+            return False
+        if not self.quota.fits(len(result), total):
+            self._reject(update_type, "quota exceeded")
+            return False
+        self._entries = result
+        self.bytes = total
+        return True
+
+    def values(self) -> list:
+        return [entry for entry, _ in self._entries.values()]
+
+
+class DisplayMessages(Store):
+    """Display messages by id, the oldest are evicted to make room."""
+
+    def __init__(self, owner: str, quota: Quota):
+        super().__init__("display message", owner, quota)
+        # id -> (message, size), in insertion order
+        self._messages = {}
+
+    def __len__(self):
+        return len(self._messages)
+
+    def set(self, message: dict) -> bool:
+        """Add or replace the message with the id of `message`, False if it
+        is too large."""
+        id = message["id"]
+        message_bytes = size(message)
+        if self._too_large(message_bytes) or not self.quota.fits(1, message_bytes):
+            self._reject(id, "message too large")
+            return False
+        self.clear(id)
+        while self._messages and not self.quota.fits(
+            len(self._messages) + 1, self.bytes + message_bytes
+        ):
+            oldest = next(iter(self._messages))
+            self.clear(oldest)
+            self._evict(oldest)
+        self._messages[id] = (message, message_bytes)
+        self.bytes += message_bytes
+        return True
+
+    def clear(self, id) -> bool:
+        """Remove a message, False if there is none with this id."""
+        stored = self._messages.pop(id, None)
+        if stored is None:
+            return False
+        self.bytes -= stored[1]
+        return True
+
+    def values(self) -> list:
+        return [message for message, _ in self._messages.values()]
@@ -0,0 +1,121 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+from timerwheel import TimerWheel
+
+LOGGER = logging.getLogger("ocpp")
+
+
+class Job:
+    __slots__ = ("callback", "interval", "generation", "task")
+
+    def __init__(self, callback, interval: float, generation: int):
+        self.callback = callback
+        self.interval = interval
+        # Renewed when the interval changes, older wheel entries are ignored
+        self.generation = generation
+        self.task = None
+
+
+class PeriodicScheduler:
+    """Drive the periodic messages (Heartbeat, MeterValues, ...) of every
+    station in the process from one task and one timer wheel, instead of a
+    sleeping task per station and message.
+
+    Jobs are keyed by (owner, name). Every deadline gets +-`jitter` of its
+    interval and the first one a random point of the interval, so stations
+    that boot together do not keep sending in bursts. A job whose previous
+    call has not finished yet skips its turn.
+    """
+
+    def __init__(self, resolution: float = 1.0, jitter: float = 0.1):
+        self.resolution = resolution
+        self.jitter = jitter
+        self.wheel = TimerWheel(resolution)
+        # owner -> name -> Job
+        self.jobs = {}
+        self.fired = 0
+        self.skipped = 0
+        self._generations = itertools.count()
+        self._task = None
+
+    @classmethod
+    def from_config(cls, config: dict | None):
+        config = config or {}
+        return cls(
+            resolution=config.get("resolution", 1.0),
+            jitter=config.get("jitter", 0.1),
+        )
+
+    def _next(self, job: Job, now: float) -> float:
+        return now + job.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def every(self, owner, name: str, interval: float, callback):
+        """Await callback() every `interval` seconds, replacing the interval
+        of an existing job. An interval of 0 stops the job."""
+        if not interval or interval <= 0:
+            self.cancel(owner, name)
+            return
+        jobs = self.jobs.setdefault(owner, {})
+        job = jobs.get(name)
+        now = time.monotonic()
+        if job is None:
+            job = jobs[name] = Job(callback, interval, next(self._generations))
+            deadline = now + random.uniform(0, interval)
+        else:
+            job.callback = callback
+            if job.interval == interval:
+                return
+            job.interval = interval
+            job.generation = next(self._generations)
+            deadline = self._next(job, now)
+        self.wheel.schedule((owner, name, job.generation), deadline)
+        self._start()
+
+    def cancel(self, owner, name: str | None = None):
+        """Stop one job of `owner`, or all of them."""
+        jobs = self.jobs.get(owner)
+        if jobs is None:
+            return
+        if name is None:
+            self.jobs.pop(owner)
+        else:
+            jobs.pop(name, None)
+            if not jobs:
+                self.jobs.pop(owner)
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def _fire(self, job: Job):
+        if job.task is not None and not job.task.done():
+            self.skipped += 1
+            return
+        self.fired += 1
+        job.task = asyncio.create_task(self._call(job.callback))
+
+    @staticmethod
+    async def _call(callback):
+        try:
+            await callback()
+        except Exception as e:
+            LOGGER.error(f"Periodic message failed: {e}")
+
+    def tick(self, now: float | None = None):
+        """Fire the jobs that are due and schedule their next turn."""
+        if now is None:
+            now = time.monotonic()
+        for owner, name, generation in self.wheel.advance(now):
+            job = self.jobs.get(owner, {}).get(name)
+            if job is None or job.generation != generation:
+                continue
+            self._fire(job)
+            self.wheel.schedule((owner, name, generation), self._next(job, now))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.resolution)
+            self.tick()
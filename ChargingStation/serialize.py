@@ -0,0 +1,66 @@
+from dataclasses import asdict, fields, is_dataclass
+
+from keys import to_camel
+
+# Payload dataclass -> OCPP JSON payload in one pass.
+#
+# The ocpp library turns a payload into a frame with asdict() (a deep copy),
+# remove_nones() and snake_to_camel_case(), three walks over the whole
+# structure. to_payload() gives the same result in a single walk: the
+# camelCase key of every field of a payload or datatype class is computed
+# once per class, None fields are skipped as they are read and plain dicts
+# and lists inside the payload are rebuilt with the same rules.
+
+
+# Dataclass -> ((field name, camelCase key), ...)
+_TABLES = {}
+
+
+def _table(cls) -> tuple:
+    table = _TABLES.get(cls)
+    if table is None:
+        table = tuple((field.name, to_camel(field.name)) for field in fields(cls))
+        _TABLES[cls] = table
+    return table
+
+
+def _encode(value):
+    cls = type(value)
+    if cls is str or cls is int or cls is float or cls is bool:
+        return value
+    if cls is list:
+        return [_encode(item) for item in value if item is not None]
+    if cls is dict:
+        return {
+            to_camel(key): _encode(item)
+            for key, item in value.items()
+            if item is not None
+        }
+    table = _TABLES.get(cls)
+    if table is not None or (is_dataclass(value) and not isinstance(value, type)):
+        return {
+            key: _encode(item)
+            for name, key in table or _table(cls)
+            if (item := getattr(value, name)) is not None
+        }
+    if isinstance(value, list):
+        return [_encode(item) for item in value if item is not None]
+    if isinstance(value, dict):
+        return {
+            to_camel(key): _encode(item)
+            for key, item in value.items()
+            if item is not None
+        }
+    if isinstance(value, tuple):
+        # asdict() keeps tuples, remove_nones and the key conversion skip them
+        return tuple(
+            asdict(item) if is_dataclass(item) and not isinstance(item, type) else item
+            for item in value
+        )
+    return value
+
+
+def to_payload(payload) -> dict:
+    """remove_nones(snake_to_camel_case(asdict(payload))) of a call or
+    call_result payload."""
+    return _encode(payload)
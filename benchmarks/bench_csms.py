@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import websockets
+
+# Throughput and latency benchmark of the CSMS.
+#
+# Starts CSMS/CSMS.py or the BackendHttp CSMS in a subprocess on a local port,
+# connects simulated stations to it, and reports JSON like:
+#
+#   python benchmarks/bench_csms.py --server csms --stations 10 100 1000 \
+#       --duration 20 --mix Heartbeat=4,StatusNotification=2,MeterValues=3
+#
+# After a BootNotification every station sends calls from the mix. With
+# --rate 0 each station sends its next call as soon as the previous one is
+# answered. Otherwise it sends --rate calls per second. CPU and RSS of the
+# server process are read from /proc. An already running server can be
+# measured with --url (add --pid to also get CPU and RSS).
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = "Heartbeat=4,StatusNotification=2,MeterValues=3,TransactionEvent=1"
+
+_SERVERS = {
+    "csms": (
+        "CSMS",
+        "import asyncio, logging, sys\n"
+        "import CSMS\n"
+        "logging.getLogger().setLevel(sys.argv[2])\n"
+        "asyncio.run(CSMS.main('127.0.0.1', int(sys.argv[1]), 1, None, None))\n",
+    ),
+    "backend": (
+        "BackendHttp",
+        "import asyncio, logging, sys\n"
+        "from backend import create_websocket_server\n"
+        "from centralsystem import CentralSystem\n"
+        "logging.getLogger().setLevel(sys.argv[2])\n"
+        "async def main():\n"
+        "    config = {'IP': '127.0.0.1', 'port': int(sys.argv[1]),\n"
+        "              'security_profile': 1, 'logstasth': {}}\n"
+        "    server = await create_websocket_server(CentralSystem(config), config)\n"
+        "    await server.wait_closed()\n"
+        "asyncio.run(main())\n",
+    ),
+}
+
+
+def now() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S") + "Z"
+
+
+def boot_notification(station: int) -> dict:
+    return {
+        "chargingStation": {"model": "Bench", "vendorName": "Bench"},
+        "reason": "PowerUp",
+    }
+
+
+def heartbeat(station: int) -> dict:
+    return {}
+
+
+def status_notification(station: int) -> dict:
+    return {
+        "timestamp": now(),
+        "connectorStatus": random.choice(["Available", "Occupied"]),
+        "evseId": 1,
+        "connectorId": 1,
+    }
+
+
+def meter_values(station: int) -> dict:
+    return {
+        "evseId": 1,
+        "meterValue": [
+            {
+                "timestamp": now(),
+                "sampledValue": [
+                    {"value": random.uniform(0, 22000)},
+                    {"value": random.uniform(200, 240), "measurand": "Voltage"},
+                ],
+            }
+        ],
+    }
+
+
+def transaction_event(station: int) -> dict:
+    return {
+        "eventType": "Updated",
+        "timestamp": now(),
+        "triggerReason": "MeterValuePeriodic",
+        "seqNo": random.randint(0, 1000),
+        "transactionInfo": {"transactionId": f"bench-{station}"},
+    }
+
+
+PAYLOADS = {
+    "BootNotification": boot_notification,
+    "Heartbeat": heartbeat,
+    "StatusNotification": status_notification,
+    "MeterValues": meter_values,
+    "TransactionEvent": transaction_event,
+}
+
+
+def parse_mix(mix: str) -> dict:
+    """Parse weights like Heartbeat=4,MeterValues=1 into {action: weight}."""
+    weights = {}
+    for item in mix.split(","):
+        action, _, weight = item.partition("=")
+        if action not in PAYLOADS:
+            raise ValueError(f"Unknown action {action}")
+        weights[action] = float(weight or 1)
+    return weights
+
+
+def process_usage(pid: int) -> dict:
+    """CPU seconds (user + system) and resident memory of a process."""
+    with open(f"/proc/{pid}/stat") as file:
+        # Fields after the command name, which may contain spaces
+        fields = file.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss = 0
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+    return {"cpu": cpu, "rss": rss}
+
+
+class StationStats:
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.sent = {}
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = []
+
+
+async def run_station(
+    url: str,
+    station: int,
+    actions: list,
+    weights: list,
+    stats: StationStats,
+    ready: asyncio.Event,
+    stop: asyncio.Event,
+    rate: float,
+    response_timeout: float,
+):
+    message_ids = itertools.count()
+    pending = {}
+
+    async def receive(ws):
+        async for raw in ws:
+            message = json.loads(raw)
+            if message[0] == 2:
+                # Calls from the CSMS are not part of the benchmark
+                await ws.send(json.dumps([4, message[1], "NotImplemented", "", {}]))
+            else:
+                future = pending.pop(message[1], None)
+                if future is not None and not future.done():
+                    future.set_result(message[0])
+
+    async def send(ws, action):
+        message_id = str(next(message_ids))
+        future = asyncio.get_running_loop().create_future()
+        pending[message_id] = future
+        frame = json.dumps([2, message_id, action, PAYLOADS[action](station)])
+        start = time.perf_counter()
+        await ws.send(frame)
+        try:
+            result = await asyncio.wait_for(future, response_timeout)
+        except asyncio.TimeoutError:
+            pending.pop(message_id, None)
+            return None
+        return result, time.perf_counter() - start
+
+    try:
+        async with websockets.connect(
+            f"{url.rstrip('/')}/bench-{station}", subprotocols=["ocpp2.0.1"]
+        ) as ws:
+            receiver = asyncio.create_task(receive(ws))
+            if await send(ws, "BootNotification") is None:
+                raise TimeoutError("BootNotification not answered")
+            stats.connected += 1
+            await ready.wait()
+            while not stop.is_set():
+                action = random.choices(actions, weights)[0]
+                started = time.perf_counter()
+                answer = await send(ws, action)
+                if stop.is_set():
+                    break
+                if answer is None:
+                    stats.timeouts += 1
+                else:
+                    stats.sent[action] = stats.sent.get(action, 0) + 1
+                    stats.latencies.append(answer[1])
+                    if answer[0] != 3:
+                        stats.errors += 1
+                if rate:
+                    await asyncio.sleep(
+                        max(0, 1 / rate - (time.perf_counter() - started))
+                    )
+            receiver.cancel()
+    except (OSError, TimeoutError, websockets.exceptions.WebSocketException):
+        stats.failed += 1
+
+
+async def run_stations(
+    url: str,
+    stations: range,
+    mix: dict,
+    start_at: float,
+    duration: float,
+    rate: float,
+    response_timeout: float,
+) -> dict:
+    """Connect the stations, send the mix from wall clock time `start_at`
+    for `duration` seconds and return the raw counters."""
+    stats = StationStats()
+    ready = asyncio.Event()
+    stop = asyncio.Event()
+    actions = list(mix)
+    weights = list(mix.values())
+    tasks = [
+        asyncio.create_task(
+            run_station(
+                url,
+                station,
+                actions,
+                weights,
+                stats,
+                ready,
+                stop,
+                rate,
+                response_timeout,
+            )
+        )
+        for station in stations
+    ]
+    await asyncio.sleep(max(0, start_at - time.time()))
+    ready.set()
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.wait(tasks, timeout=response_timeout)
+    return {
+        "connected": stats.connected,
+        "failed": stats.failed,
+        "sent": stats.sent,
+        "errors": stats.errors,
+        "timeouts": stats.timeouts,
+        "latencies": stats.latencies,
+    }
+
+
+def client_process(args: tuple) -> dict:
+    return asyncio.run(run_stations(*args))
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def start_server(
+    server: str, port: int, log_level: str, root: str = ROOT
+) -> subprocess.Popen:
+    """Start the server of a checkout of the repository at `root`."""
+    directory, code = _SERVERS[server]
+    process = subprocess.Popen(
+        [sys.executable, "-c", code, str(port), log_level],
+        cwd=os.path.join(root, directory),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} server exited with {process.returncode}")
+        try:
+            with open("/proc/net/tcp") as file:
+                listening = f":{port:04X} 00000000:0000 0A" in file.read()
+        except OSError:
+            listening = False
+        if listening:
+            return process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{server} server not listening on port {port}")
+
+
+def run(
+    url: str,
+    stations: int,
+    mix: dict,
+    duration: float,
+    rate: float,
+    clients: int,
+    pid: int | None,
+    connect_time: float,
+    response_timeout: float,
+) -> dict:
+    """Benchmark `stations` simulated stations split over `clients`
+    processes against the CSMS at `url`."""
+    baseline = process_usage(pid) if pid else None
+    start_at = time.time() + connect_time
+    groups = [range(first, stations, clients) for first in range(clients)]
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(clients) as pool:
+        pending = pool.map_async(
+            client_process,
+            [
+                (url, group, mix, start_at, duration, rate, response_timeout)
+                for group in groups
+            ],
+        )
+        # Measure once every station is connected and before load starts
+        time.sleep(max(0, start_at - time.time()))
+        connected = process_usage(pid) if pid else None
+        results = pending.get()
+    end = process_usage(pid) if pid else None
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    sent = {}
+    for result in results:
+        for action, count in result["sent"].items():
+            sent[action] = sent.get(action, 0) + count
+    connected_stations = sum(result["connected"] for result in results)
+    report = {
+        "stations": stations,
+        "connected": connected_stations,
+        "failed": sum(result["failed"] for result in results),
+        "duration": duration,
+        "rate": rate,
+        "messages": sum(sent.values()),
+        "messages_per_second": sum(sent.values()) / duration,
+        "by_action": sent,
+        "errors": sum(result["errors"] for result in results),
+        "timeouts": sum(result["timeouts"] for result in results),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_max": latencies[-1] if latencies else None,
+    }
+    if pid:
+        cpu = end["cpu"] - connected["cpu"]
+        report.update(
+            {
+                "cpu_seconds": cpu,
+                "cpu_percent": 100 * cpu / duration,
+                "cpu_per_message": (
+                    cpu / report["messages"] if report["messages"] else None
+                ),
+                "rss_baseline": baseline["rss"],
+                "rss_connected": connected["rss"],
+                "rss_end": end["rss"],
+                "rss_per_connection": (
+                    (connected["rss"] - baseline["rss"]) / connected_stations
+                    if connected_stations
+                    else None
+                ),
+            }
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSMS throughput benchmark")
+    parser.add_argument(
+        "--server",
+        choices=sorted(_SERVERS),
+        default="csms",
+        help="CSMS started for the benchmark: CSMS/CSMS.py or BackendHttp",
+    )
+    parser.add_argument(
+        "--url", help="Benchmark a running CSMS instead, e.g. ws://user:pass@host:9000"
+    )
+    parser.add_argument("--pid", type=int, help="Process of --url for CPU and RSS")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument(
+        "--stations",
+        type=int,
+        nargs="+",
+        default=[100],
+        help="Concurrent stations, one run (and fresh server) per value",
+    )
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Calls per second of every station, 0 for closed loop",
+    )
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Action=weight,...")
+    parser.add_argument(
+        "--clients", type=int, default=1, help="Client processes driving the stations"
+    )
+    parser.add_argument(
+        "--connect-time",
+        type=float,
+        default=5,
+        help="Seconds allowed for the stations to connect before measuring",
+    )
+    parser.add_argument("--timeout", type=float, default=30, help="Response timeout")
+    parser.add_argument(
+        "--server-log-level",
+        default="INFO",
+        help="Log level of the started server, INFO as deployed",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    runs = []
+    for stations in args.stations:
+        server = None
+        url, pid = args.url, args.pid
+        if url is None:
+            server = start_server(args.server, args.port, args.server_log_level)
+            url, pid = f"ws://bench:bench@127.0.0.1:{args.port}", server.pid
+        try:
+            runs.append(
+                run(
+                    url,
+                    stations,
+                    mix,
+                    args.duration,
+                    args.rate,
+                    min(args.clients, stations),
+                    pid,
+                    args.connect_time,
+                    args.timeout,
+                )
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = {
+        "server": args.url or args.server,
+        "mix": mix,
+        "python": sys.version.split()[0],
+        "timestamp": now(),
+        "runs": runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
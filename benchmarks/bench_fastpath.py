@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from bench_csms import ROOT, now
+
+# Cost of answering the calls that have a pre-encoded answer.
+#
+#   python benchmarks/bench_fastpath.py --number 5000
+#
+# Routes the same frames through the CSMS ChargePoint with the fast path of
+# CSMS/fastpath.py enabled and disabled, and checks that both send the same
+# answers.
+
+sys.path.insert(0, os.path.join(ROOT, "CSMS"))
+
+import logging  # noqa: E402
+
+import CSMS  # noqa: E402
+import codec  # noqa: E402
+import fastpath  # noqa: E402
+
+CALLS = {
+    "Heartbeat": {},
+    "StatusNotification": {
+        "timestamp": now(),
+        "connectorStatus": "Occupied",
+        "evseId": 1,
+        "connectorId": 1,
+    },
+    "MeterValues": {
+        "evseId": 1,
+        "meterValue": [
+            {
+                "timestamp": now(),
+                "sampledValue": [
+                    {"value": 1234.5, "measurand": "Energy.Active.Import.Register"},
+                    {"value": 230.1, "measurand": "Voltage", "phase": "L1"},
+                ],
+            }
+        ],
+    },
+    "Authorize": {"idToken": {"idToken": "DEADBEEF", "type": "ISO14443"}},
+}
+
+
+class Connection:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, frame):
+        self.sent.append(frame)
+
+
+async def route(action: str, number: int, enabled: bool) -> tuple:
+    """Best of 5 runs in microseconds per call, and the last answer."""
+    fastpath.enabled = enabled
+    connection = Connection()
+    charge_point = CSMS.ChargePoint("bench", connection)
+    frame = codec.dumps([2, "19223201", action, CALLS[action]])
+    best = None
+    for _ in range(5):
+        connection.sent.clear()
+        start = time.perf_counter()
+        for _ in range(number):
+            await charge_point.route_message(frame)
+        elapsed = (time.perf_counter() - start) / number * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best, connection.sent[-1]
+
+
+async def measure(action: str, number: int) -> dict:
+    slow, slow_answer = await route(action, number, False)
+    fast, fast_answer = await route(action, number, True)
+    return {
+        "identical": slow_answer == fast_answer,
+        "call_us": {"handler": slow, "fast_path": fast},
+    }
+
+
+async def run(number: int) -> dict:
+    return {action: await measure(action, number) for action in CALLS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast path benchmark")
+    parser.add_argument("--number", type=int, default=5000, help="Calls per run")
+    parser.add_argument("--codec", default="auto", help="JSON codec of codec.py")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    codec.use(args.codec)
+    # Every frame sent is logged at INFO
+    logging.getLogger("ocpp").setLevel(logging.WARNING)
+
+    report = {
+        "timestamp": now(),
+        "codec": codec.CODEC,
+        "calls": asyncio.run(run(args.number)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
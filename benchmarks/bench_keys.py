@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+from bench_csms import ROOT, now
+
+# Cost of translating payload keys between camelCase and snake_case.
+#
+#   python benchmarks/bench_keys.py --number 2000
+#
+# Compares the functions of the ocpp library with the memoized ones of
+# CSMS/keys.py on deeply nested inbound payloads, in both directions, and on
+# a payload of random keys like an attacker would send. Also checks that
+# both give the same result and reports the size of the overflow table.
+
+sys.path.insert(0, os.path.join(ROOT, "CSMS"))
+
+import keys  # noqa: E402
+from ocpp.charge_point import camel_to_snake_case, snake_to_camel_case  # noqa: E402
+
+
+def notify_event() -> dict:
+    return {
+        "generatedAt": now(),
+        "seqNo": 0,
+        "tbc": False,
+        "eventData": [
+            {
+                "eventId": index,
+                "timestamp": now(),
+                "trigger": "Delta",
+                "actualValue": "Faulted",
+                "eventNotificationType": "HardWiredMonitor",
+                "component": {
+                    "name": "Connector",
+                    "evse": {"id": 1, "connectorId": index % 2},
+                },
+                "variable": {"name": "AvailabilityState"},
+                "techCode": "G05",
+                "transactionId": f"tx-{index}",
+            }
+            for index in range(50)
+        ],
+    }
+
+
+def transaction_event() -> dict:
+    return {
+        "eventType": "Updated",
+        "timestamp": now(),
+        "triggerReason": "MeterValuePeriodic",
+        "seqNo": 12,
+        "transactionInfo": {"transactionId": "tx-1", "chargingState": "Charging"},
+        "evse": {"id": 1, "connectorId": 1},
+        "idToken": {"idToken": "DEADBEEF", "type": "ISO14443"},
+        "meterValue": [
+            {
+                "timestamp": now(),
+                "sampledValue": [
+                    {
+                        "value": 1234.5,
+                        "measurand": "Energy.Active.Import.Register",
+                        "unitOfMeasure": {"unit": "Wh", "multiplier": 0},
+                        "signedMeterValue": {
+                            "signedMeterData": "AA==",
+                            "signingMethod": "ECDSA",
+                            "encodingMethod": "OCMF",
+                            "publicKey": "AA==",
+                        },
+                    }
+                    for _ in range(4)
+                ],
+            }
+            for _ in range(10)
+        ],
+    }
+
+
+def random_keys() -> dict:
+    def key():
+        return "".join(random.choices(string.ascii_letters, k=12))
+
+    return {key(): {key(): index, key(): [{key(): 1}]} for index in range(50)}
+
+
+PAYLOADS = {
+    "NotifyEvent": notify_event,
+    "TransactionEvent": transaction_event,
+    "random keys": random_keys,
+}
+
+
+def per_call(function, number: int) -> float:
+    """Best of 5 runs, in microseconds per call."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def measure(name: str, number: int) -> dict:
+    # Fresh random keys for every payload, as a flood of garbage would be
+    payloads = [PAYLOADS[name]() for _ in range(number)]
+    snake = [camel_to_snake_case(payload) for payload in payloads]
+    identical = all(
+        keys.camel_to_snake_case(payload) == expected
+        and keys.snake_to_camel_case(expected) == snake_to_camel_case(expected)
+        for payload, expected in zip(payloads, snake)
+    )
+
+    def run(function, inputs):
+        items = iter(inputs * 5)
+        return per_call(lambda: function(next(items)), number)
+
+    return {
+        "identical": identical,
+        "to_snake_us": {
+            "ocpp": run(camel_to_snake_case, payloads),
+            "keys": run(keys.camel_to_snake_case, payloads),
+        },
+        "to_camel_us": {
+            "ocpp": run(snake_to_camel_case, snake),
+            "keys": run(keys.snake_to_camel_case, snake),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Key translation benchmark")
+    parser.add_argument("--number", type=int, default=2000, help="Payloads per run")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": now(),
+        "payloads": {name: measure(name, args.number) for name in PAYLOADS},
+        "seeded_keys": len(keys._SNAKE),
+        "overflow_keys": len(keys._SNAKE_OVERFLOW) + len(keys._CAMEL_OVERFLOW),
+        "overflow_limit": 2 * keys.OVERFLOW_SIZE,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+from bench_csms import ROOT, now, process_usage, start_server
+
+# Memory cost of idle connections to the CSMS.
+#
+#   python benchmarks/bench_memory.py --connections 5000 --baseline /tmp/old
+#
+# Reports for the server of this checkout, and of --baseline when given (e.g.
+# a `git worktree` of an older commit), two numbers:
+#   objects      bytes allocated per ChargePoint of CSMS.py, by tracemalloc
+#   connections  RSS growth of the server per idle websocket connection, as
+#                left by scanners that connect and never send anything
+
+_OBJECTS = """
+import gc, json, sys, tracemalloc
+from CSMS import ChargePoint
+
+class Connection:
+    remote_address = ("127.0.0.1", 1234)
+
+count = int(sys.argv[1])
+gc.collect()
+tracemalloc.start()
+before = tracemalloc.take_snapshot()
+chargers = [ChargePoint(f"cp{i}", Connection()) for i in range(count)]
+after = tracemalloc.take_snapshot()
+size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+# The Connection stand-ins and the id strings are not part of the ChargePoint
+size -= sum(sys.getsizeof(cp.id) + sys.getsizeof(cp._connection) for cp in chargers)
+print(json.dumps({"instances": count, "bytes_per_instance": size / count}))
+"""
+
+
+def measure_objects(root: str, server: str, count: int) -> dict:
+    directory = "CSMS" if server == "csms" else "BackendHttp"
+    output = subprocess.run(
+        [sys.executable, "-c", _OBJECTS, str(count)],
+        cwd=os.path.join(root, directory),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+async def open_connections(url: str, count: int, batch: int = 200) -> list:
+    connections = []
+    for first in range(0, count, batch):
+        connections += await asyncio.gather(
+            *(
+                websockets.connect(f"{url}/idle-{i}", subprotocols=["ocpp2.0.1"])
+                for i in range(first, min(count, first + batch))
+            )
+        )
+    return connections
+
+
+def measure_connections(root: str, server: str, port: int, count: int) -> dict:
+    process = start_server(server, port, "WARNING", root)
+    try:
+        time.sleep(1)
+        baseline = process_usage(process.pid)["rss"]
+
+        async def run():
+            connections = await open_connections(
+                f"ws://bench:bench@127.0.0.1:{port}", count
+            )
+            # Let the server finish setting the connections up
+            await asyncio.sleep(2)
+            rss = process_usage(process.pid)["rss"]
+            for connection in connections:
+                await connection.close()
+            return rss
+
+        rss = asyncio.run(run())
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "connections": count,
+        "rss_baseline": baseline,
+        "rss_connected": rss,
+        "bytes_per_connection": (rss - baseline) / count,
+    }
+
+
+def measure(root: str, server: str, port: int, instances: int, connections: int):
+    return {
+        "root": root,
+        "objects": measure_objects(root, server, instances),
+        "connections": measure_connections(root, server, port, connections),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory per idle connection")
+    parser.add_argument("--server", choices=["csms", "backend"], default="csms")
+    parser.add_argument("--port", type=int, default=9901)
+    parser.add_argument("--instances", type=int, default=10000)
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument(
+        "--baseline", help="Checkout of the repository to compare against"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = {"server": args.server, "timestamp": now()}
+    report["current"] = measure(
+        ROOT, args.server, args.port, args.instances, args.connections
+    )
+    if args.baseline:
+        report["baseline"] = measure(
+            os.path.abspath(args.baseline),
+            args.server,
+            args.port,
+            args.instances,
+            args.connections,
+        )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
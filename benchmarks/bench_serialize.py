@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import sys
+import timeit
+from dataclasses import asdict
+
+from bench_csms import ROOT, now
+
+# Cost of turning payload dataclasses into OCPP frames.
+#
+#   python benchmarks/bench_serialize.py --number 2000
+#
+# Compares, per representative payload, the ocpp library path
+# (asdict + remove_nones + snake_to_camel_case, then json.dumps) with
+# to_payload() of CSMS/serialize.py followed by the selected codec, and
+# checks that both produce the same payload.
+
+sys.path.insert(0, os.path.join(ROOT, "CSMS"))
+
+import codec  # noqa: E402
+from ocpp.charge_point import remove_nones, snake_to_camel_case  # noqa: E402
+from ocpp.messages import CallResult  # noqa: E402
+from ocpp.v201 import call, call_result, datatypes  # noqa: E402
+from serialize import to_payload  # noqa: E402
+
+
+def get_variables_all() -> call_result.GetVariablesPayload:
+    # The GetVariables "all" answer of the charging station
+    with open(os.path.join(ROOT, "ChargingStation", "config.json")) as file:
+        variables = json.load(file)["CP"]["OCPP_variables"]
+    return call_result.GetVariablesPayload(
+        get_variable_result=[
+            datatypes.GetVariableResultType(
+                attribute_status="Accepted",
+                component=datatypes.ComponentType(name=component),
+                variable=datatypes.VariableType(name=variable),
+                attribute_value=value,
+            )
+            for component, values in variables.items()
+            for variable, value in values.items()
+        ]
+    )
+
+
+def notify_display_messages() -> call.NotifyDisplayMessagesPayload:
+    return call.NotifyDisplayMessagesPayload(
+        request_id=1,
+        message_info=[
+            {
+                "id": index,
+                "priority": "NormalCycle",
+                "state": "Idle",
+                "start_date_time": now(),
+                "transaction_id": None,
+                "message": {"format": "UTF8", "content": f"Message {index}"},
+            }
+            for index in range(20)
+        ],
+    )
+
+
+def transaction_event() -> call.TransactionEventPayload:
+    return call.TransactionEventPayload(
+        event_type="Updated",
+        timestamp=now(),
+        trigger_reason="MeterValuePeriodic",
+        seq_no=12,
+        transaction_info=datatypes.TransactionType(
+            transaction_id="bench-1", charging_state="Charging"
+        ),
+        meter_value=[
+            {
+                "timestamp": now(),
+                "sampled_value": [
+                    {"value": 1234.5, "measurand": "Energy.Active.Import.Register"},
+                    {"value": 230.1, "measurand": "Voltage", "phase": "L1"},
+                    {"value": 16.0, "measurand": "Current.Import", "phase": "L1"},
+                ],
+            }
+            for _ in range(5)
+        ],
+        evse={"id": 1, "connector_id": 1},
+        id_token={"id_token": "DEADBEEF", "type": "ISO14443"},
+    )
+
+
+PAYLOADS = {
+    "GetVariables all": get_variables_all,
+    "NotifyDisplayMessages": notify_display_messages,
+    "TransactionEvent": transaction_event,
+}
+
+
+def ocpp_payload(payload) -> dict:
+    return remove_nones(snake_to_camel_case(asdict(payload)))
+
+
+def per_call(function, number: int) -> float:
+    """Best of 5 runs, in microseconds per call."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def measure(name: str, number: int) -> dict:
+    payload = PAYLOADS[name]()
+    frame = lambda build: CallResult("19223201", build(payload))
+    return {
+        "identical": ocpp_payload(payload) == to_payload(payload),
+        "bytes": len(codec.pack(frame(to_payload))),
+        "payload_us": {
+            "ocpp": per_call(lambda: ocpp_payload(payload), number),
+            "serialize": per_call(lambda: to_payload(payload), number),
+        },
+        "frame_us": {
+            "ocpp": per_call(lambda: frame(ocpp_payload).to_json(), number),
+            f"serialize+{codec.CODEC}": per_call(
+                lambda: codec.pack(frame(to_payload)), number
+            ),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload serialization benchmark")
+    parser.add_argument("--number", type=int, default=2000, help="Payloads per run")
+    parser.add_argument("--codec", default="auto", help="JSON codec of codec.py")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    codec.use(args.codec)
+
+    report = {
+        "timestamp": now(),
+        "codec": codec.CODEC,
+        "payloads": {name: measure(name, args.number) for name in PAYLOADS},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from bench_csms import ROOT, now
+
+# Cost of holding tarpitted sessions.
+#
+#   python benchmarks/bench_tarpit.py --sessions 50000
+#
+# Puts --sessions CSMS ChargePoints in the tarpit of CSMS/tarpit.py, each
+# holding one Heartbeat answer, over stand-in connections that count the
+# bytes written. Reports the memory the tarpit holds per session (measured
+# by tracemalloc and as estimated by Tarpit.memory()), the cost of holding a
+# frame (with tracemalloc running) and of the ticks that release them all,
+# for every mode.
+
+sys.path.insert(0, os.path.join(ROOT, "CSMS"))
+
+import logging  # noqa: E402
+
+import CSMS  # noqa: E402
+from tarpit import Tarpit  # noqa: E402
+
+FRAME = '[3,"19223201",{"currentTime":"2023-01-01T12:00:00Z"}]'
+
+POLICIES = {
+    "delay": {"mode": "delay", "delay": 1, "jitter": 1},
+    "trickle": {"mode": "trickle", "delay": 1, "chunk_size": 16, "interval": 0.5},
+    "defer": {"mode": "defer", "delay": 1},
+}
+
+
+class Transport:
+    def get_write_buffer_size(self):
+        return 0
+
+
+class Connection:
+    open = True
+    transport = Transport()
+
+    def __init__(self, index: int):
+        self.remote_address = ("10.0.0.1", index)
+        self.written = 0
+
+    def write_frame_sync(self, fin, opcode, data):
+        self.written += len(data)
+
+
+def measure(mode: str, sessions: int) -> dict:
+    tarpit = Tarpit(
+        {mode: POLICIES[mode]},
+        sources={"10.0.0.0/8": mode},
+        max_sessions=sessions,
+        log_interval=0,
+    )
+    chargers = [CSMS.ChargePoint(f"cp{i}", Connection(i)) for i in range(sessions)]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    for cp in chargers:
+        tarpit.hold(cp, FRAME)
+    hold_us = (time.perf_counter() - start) / sessions * 1e6
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    stats = tarpit.stats()
+
+    # Run the wheel to the end instead of waiting for it
+    ticks = 0
+    start = time.perf_counter()
+    clock = time.monotonic()
+    while tarpit.pending:
+        clock += tarpit.wheel.resolution
+        tarpit.tick(clock)
+        ticks += 1
+    tick_ms = (time.perf_counter() - start) / ticks * 1e3
+    written = sum(cp._connection.written for cp in chargers)
+    return {
+        "sessions": stats["sessions"],
+        "bytes_per_session": held / sessions,
+        "estimated_bytes_per_session": stats["memory_bytes"] / sessions,
+        "hold_us": hold_us,
+        "ticks": ticks,
+        "tick_ms": tick_ms,
+        "delivered": written == sessions * len(FRAME),
+    }
+
+
+async def run(sessions: int) -> dict:
+    # The tarpit starts its task on the running loop
+    return {mode: measure(mode, sessions) for mode in POLICIES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tarpit benchmark")
+    parser.add_argument("--sessions", type=int, default=50000)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+    # Every frame sent is logged at INFO
+    logging.getLogger("ocpp").setLevel(logging.WARNING)
+
+    report = {"timestamp": now(), "modes": asyncio.run(run(args.sessions))}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()